@@ -18,6 +18,10 @@ from sanic_session import InMemorySessionInterface
 # from core.libs.sanic_log import LOGGING_CONFIG_DEFAULTS
 from .models import *
 from tortoise.contrib.sanic import register_tortoise
+from core.libs.db_router import tortoise_config
+from core.libs.classification import dept_classes
+from core.libs.cost_guard import cost_guard
+from core.libs.closed_periods import closed_periods
 from sanic_session import Session
 
 
@@ -39,6 +43,12 @@ def create_app() -> Sanic:
     # 服务配置初始化
     app.config.update_config(toml_config)
     app.config['CORS_SUPPORTS_CREDENTIALS'] = True
+    # 报表清运单位分类
+    dept_classes.load(toml_config)
+    # 查询代价保护
+    cost_guard.load(toml_config)
+    # 已结账月份报表结果存储
+    closed_periods.load(toml_config)
 
     # 静态资源加载
     app: Sanic = configure_static_resources(app, toml_config)
@@ -60,15 +70,9 @@ def create_app() -> Sanic:
 
     # 注册创建数据库引擎
 
-    mysql_host = toml_config['MYSQL']['HOST']
-    mysql_db = toml_config['MYSQL']['DB']
-    mysql_port = toml_config['MYSQL']['PORT']
-    mysql_user = toml_config['MYSQL']['USER']
-    mysql_password = toml_config['MYSQL']['PASSWORD']
-    # mysql_config = toml_config['MYSQL']['CONFIG']
+    # 配置了 [MYSQL.REPLICA] 时统计查询读从库
     register_tortoise(
-        app, db_url=f"mysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_db}",
-        modules={"models": ["core.models"]}, generate_schemas=True
+        app, config=tortoise_config(toml_config), generate_schemas=True
     )
 
     return app
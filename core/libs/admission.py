@@ -0,0 +1,147 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+# 优先级类别
+GATE = "GATE"  # 地磅现场称重写入, 不能被报表拖慢
+LIST = "LIST"  # 交互式列表查询
+REPORT = "REPORT"  # 重统计报表与导出
+
+# 各类别的请求路径前缀, 按前缀最长匹配; 未匹配的请求不做准入控制. 可由 ADMISSION.<类别>.PATHS 覆盖
+ADMISSION_PATHS: Dict[str, Tuple[str, ...]] = {
+    GATE: (
+        "/admin_api/weight_record/insert_weight_record",
+        "/admin_api/weight_record/update_weight_record",
+        "/admin_api/weight_record/delete_weight_record",
+        "/admin_api/weight_record/weight_operation",
+    ),
+    LIST: (
+        "/web_api/statistics",
+        "/admin_api/weight_record/read_weight_record",
+        "/admin_api/weight_record/read_full_weight_record",
+    ),
+    REPORT: (
+        "/web_api/statistics/get_region_weight_info",
+        "/web_api/statistics/get_garbage_source_trans_info",
+        "/web_api/statistics/get_pound_garbage_info",
+        "/web_api/statistics/get_trans_group_by_date_info",
+        "/web_api/statistics/export_trans_info",
+        "/web_api/statistics/get_rank_info",
+        "/web_api/statistics/get_pound_hourly_load_info",
+        "/admin_api/weight_record/classify_weight_record",
+    ),
+}
+# 各类别的默认限制: (并发上限, 排队上限, 排队超时秒数), 并发上限为None表示不限
+ADMISSION_LIMITS: Dict[str, Tuple[Optional[int], int, float]] = {
+    GATE: (None, 0, 0),
+    LIST: (8, 32, 10),
+    REPORT: (2, 4, 5),
+}
+
+
+class AdmissionClass:
+    """单个优先级类别的并发限制
+
+    执行中的请求数达到上限时进入有界队列按先后等待, 队列已满或等待超时则拒绝; 释放时槽位直接交给队首请求
+    """
+
+    __slots__ = ('name', 'limit', 'queue', 'timeout', '_active', '_waiters')
+
+    def __init__(self, name: str, limit: Optional[int], queue: int = 0, timeout: float = 0) -> None:
+        self.name: str = name
+        self.limit: Optional[int] = limit
+        self.queue: int = queue
+        self.timeout: float = timeout
+        self._active: int = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self) -> bool:
+        """获取执行槽位, 被拒绝时返回False"""
+        if self.limit is None or (self._active < self.limit and not self.waiting):
+            self._active += 1
+            return True
+        if self.waiting >= self.queue:
+            return False
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # 超时或断开的同时已分到槽位, 转交下一个
+                self.release()
+            else:
+                waiter.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self._active -= 1
+
+
+class Admission:
+    """按请求路径分类的准入控制, 各类别独立限制并发, 保证称重写入不被重报表挤占数据库连接
+
+    配置(可选), 每个工作进程单独计数:
+    ADMISSION.REPORT.LIMIT = 2      并发上限, 不配置或为0表示不限
+    ADMISSION.REPORT.QUEUE = 4      排队上限
+    ADMISSION.REPORT.TIMEOUT = 5    排队超时(秒)
+    ADMISSION.REPORT.PATHS = []     请求路径前缀
+    ADMISSION.RETRY_AFTER = 5       拒绝时 Retry-After 秒数
+    """
+
+    __slots__ = ('classes', '_routes', 'retry_after')
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None) -> None:
+        config = dict(settings or {})
+        self.classes: Dict[str, AdmissionClass] = {}
+        routes = []
+        for name, (limit, queue, timeout) in ADMISSION_LIMITS.items():
+            item = config.get(name) or {}
+            self.classes[name] = AdmissionClass(
+                name,
+                item.get('LIMIT', limit) or None,
+                item.get('QUEUE', queue),
+                item.get('TIMEOUT', timeout),
+            )
+            routes.extend((prefix, name) for prefix in item.get('PATHS', ADMISSION_PATHS[name]))
+        self._routes: Tuple[Tuple[str, str], ...] = tuple(sorted(routes, key=lambda r: len(r[0]), reverse=True))
+        self.retry_after: int = int(config.get('RETRY_AFTER', 5))
+
+    def classify(self, path: str) -> Optional[AdmissionClass]:
+        """请求路径所属类别, 不做准入控制时返回None"""
+        for prefix, name in self._routes:
+            if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                return self.classes[name]
+        return None
+
+
+def hold_admission(request) -> Callable[[], None]:
+    """流式响应在发送完毕前保留准入槽位
+
+    准入控制在响应开始时释放槽位, 流式响应在 request.respond() 时即开始, 需在调用前取走释放函数,
+    发送结束(含出错, 断开)后调用; 请求未占用槽位时返回空函数
+    """
+    release = getattr(request.ctx, 'admission', None)
+    request.ctx.admission = None
+    return release if release is not None else lambda: None
@@ -0,0 +1,70 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from typing import Any, Dict, List, Sequence, Tuple
+
+# 默认汇总指标: 车数, 毛重, 皮重, 净重
+MEASURES: Tuple[str, ...] = ("vehicle_num", "weight_gross_sum", "weight_tare_sum", "weight_net_sum")
+
+
+def add_measure(a: Any, b: Any) -> Any:
+    """汇总值相加, 忽略None"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def union_group_by(grouping_sets: Dict[str, Sequence[str]]) -> Tuple[str, ...]:
+    """所有分组集合的字段并集(保持出现顺序), 即一次扫描所需的最细分组"""
+    keys: List[str] = []
+    for group_by in grouping_sets.values():
+        for key in group_by:
+            if key not in keys:
+                keys.append(key)
+    return tuple(keys)
+
+
+def reduce_groups(
+        rows: Sequence[Dict[str, Any]],
+        group_by: Sequence[str],
+        measures: Sequence[str] = MEASURES,
+) -> List[Dict[str, Any]]:
+    """将细粒度分组结果上卷到 group_by 粒度, 指标相加
+
+    :param rows: 细粒度分组结果, 需包含 group_by 与 measures 字段
+    :param group_by: 上卷后的分组字段, 为空时得到总计
+    :param measures: 汇总指标
+    :return:
+    """
+    return split_grouping_sets(rows, {"": group_by}, measures)[""]
+
+
+def split_grouping_sets(
+        rows: Sequence[Dict[str, Any]],
+        grouping_sets: Dict[str, Sequence[str]],
+        measures: Sequence[str] = MEASURES,
+) -> Dict[str, List[dict]]:
+    """一次遍历细粒度分组结果, 同时得到多个分组集合(等价于 GROUPING SETS / WITH ROLLUP)
+
+    :param rows: 按 union_group_by(grouping_sets) 分组的统计结果
+    :param grouping_sets: {返回键: 分组字段}
+    :param measures: 汇总指标
+    :return: {返回键: [{分组字段..., 指标...}]}
+    """
+    buckets: Dict[str, Dict[Tuple, Dict[str, Any]]] = {name: {} for name in grouping_sets}
+    for row in rows:
+        for name, group_by in grouping_sets.items():
+            key = tuple(row[g] for g in group_by)
+            bucket = buckets[name].get(key)
+            if bucket is None:
+                bucket = {g: row[g] for g in group_by}
+                bucket.update({m: row[m] for m in measures})
+                buckets[name][key] = bucket
+                continue
+            for m in measures:
+                bucket[m] = add_measure(bucket[m], row[m])
+    return {name: list(bucket.values()) for name, bucket in buckets.items()}
@@ -0,0 +1,70 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import hashlib
+import time
+from collections import OrderedDict
+from json import dumps
+from typing import Any, Hashable, Optional
+
+
+def make_key(*parts: Any) -> str:
+    """由请求参数生成缓存键, 字典按键排序后序列化, 保证相同条件得到相同的键"""
+    raw = dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """进程内LRU缓存, 超过容量淘汰最久未使用项, 超过ttl秒的项视为失效"""
+
+    __slots__ = ('_maxsize', '_ttl', '_data')
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None) -> None:
+        self._maxsize: int = maxsize
+        self._ttl: Optional[float] = ttl
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expire_at = item
+        if expire_at is not None and expire_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expire_at = time.monotonic() + self._ttl if self._ttl is not None else None
+        self._data[key] = (value, expire_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class WriteGeneration:
+    """称重记录修改/删除计数
+    新增记录会改变数据水位(最大id), 修改或删除已有记录不会, 因此由写入方递增该计数使相关缓存失效
+    """
+
+    value: int = 0
+
+    @classmethod
+    def bump(cls) -> None:
+        cls.value += 1
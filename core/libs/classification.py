@@ -0,0 +1,61 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from typing import Any, Dict, Iterable, Tuple
+
+# 称重记录的清运单位字段
+DEPT_FIELD = "vehicle_id__dept_id_id"
+
+# 未配置 CLASSIFICATION 时的默认分类
+DEFAULT_CLASSES: Dict[str, Tuple[int, ...]] = {
+    # 运输区域垃圾量汇总表: 环卫处
+    "SANITATION": (349,),
+    # 地磅清运统计汇总表: 永康市卫生环卫管理处
+    "POUND_SANITATION": (51,),
+}
+
+
+class DeptClassification:
+    """报表清运单位分类登记表, 分类名 -> 清运单位id集合
+
+    服务启动时由配置 CLASSIFICATION 加载后常驻内存, 报表据此生成 SQL 条件汇总的条件, 不再逐次查询单位名称比较
+    """
+
+    __slots__ = ('_classes',)
+
+    def __init__(self) -> None:
+        self._classes: Dict[str, Tuple[int, ...]] = dict(DEFAULT_CLASSES)
+
+    def load(self, settings) -> None:
+        """加载配置, 配置项覆盖同名的默认分类
+
+        CLASSIFICATION.SANITATION = [349]
+        """
+        for name, dept_ids in (settings.get('CLASSIFICATION') or {}).items():
+            self.register(name, dept_ids)
+
+    def register(self, name: str, dept_ids: Iterable[int]) -> None:
+        self._classes[name.upper()] = tuple(int(dept_id) for dept_id in dept_ids)
+
+    def dept_ids(self, name: str) -> Tuple[int, ...]:
+        """分类包含的清运单位id, 分类不存在时抛出 KeyError"""
+        return self._classes[name.upper()]
+
+    def member(self, name: str, field: str = DEPT_FIELD) -> Dict[str, Any]:
+        """属于该分类的条件"""
+        return {field + "__in": list(self.dept_ids(name))}
+
+    def non_member(self, name: str, include_unassigned: bool = True, field: str = DEPT_FIELD) -> Dict[str, Any]:
+        """不属于该分类的条件
+
+        :param include_unassigned: 是否包含未关联清运单位的记录
+        """
+        condition: Dict[str, Any] = {field + "__not_in": list(self.dept_ids(name))}
+        if not include_unassigned:
+            condition[field + "__isnull"] = False
+        return condition
+
+
+dept_classes: DeptClassification = DeptClassification()
@@ -0,0 +1,245 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+from functools import wraps
+from json import loads
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from sanic.request import Request
+from sanic.response import HTTPResponse, empty, raw
+
+from .cache import make_key
+from .periods import month_range
+from .error_code.errorcode import ECEnum
+from .logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+# month_invalidation 中表示全部月份失效的记录
+ALL_MONTHS = '*'
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_result (
+    key TEXT PRIMARY KEY,
+    report TEXT NOT NULL,
+    month TEXT NOT NULL,
+    body BLOB NOT NULL,
+    content_type TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_report_result_month ON report_result (month);
+CREATE TABLE IF NOT EXISTS month_invalidation (
+    month TEXT PRIMARY KEY,
+    invalidated_at REAL NOT NULL
+);
+"""
+
+
+def normalize_month(month: Any) -> Optional[str]:
+    """月份参数规范为 YYYY-MM, 无法解析时返回None"""
+    try:
+        return month_range(month)[0].strftime("%Y-%m")
+    except (TypeError, ValueError):
+        return None
+
+
+class ClosedPeriodStore:
+    """已结账月份的报表结果存储
+
+    月末之后超过宽限天数的月份视为已结账, 其报表响应按 报表 + 请求体 持久化到本地 SQLite 文件, 之后一直从文件返回,
+    不再查询数据库; 多个工作进程共用同一文件. 修改已结账月份的称重记录后须调用 invalidate 删除该月的全部结果,
+    invalidate 同时记录失效时间, 失效前开始计算的结果不再写入, 避免写入与统计并发时保存旧数据.
+    单位, 区域, 垃圾来源等维度数据(含名称与所属关系)修改后须调用 invalidate_all 删除全部结果.
+    绕过本服务直接修改数据库时, 删除存储文件即可清空
+
+    配置(可选):
+    CLOSED_PERIODS.ENABLED = false
+    CLOSED_PERIODS.GRACE_DAYS = 15      月末之后的宽限天数
+    CLOSED_PERIODS.PATH = ''            存储文件, 默认 data/closed_periods.sqlite3
+    """
+
+    __slots__ = ('enabled', 'grace_days', 'path', '_ready')
+
+    def __init__(self, path: str = os.path.join('data', 'closed_periods.sqlite3')) -> None:
+        self.enabled: bool = False
+        self.grace_days: int = 15
+        self.path: str = path
+        self._ready: bool = False
+
+    def load(self, settings) -> None:
+        config = settings.get('CLOSED_PERIODS') or {}
+        self.enabled = bool(config.get('ENABLED', False))
+        self.grace_days = int(config.get('GRACE_DAYS', self.grace_days))
+        self.path = config.get('PATH') or os.path.join(settings['BASE_PATH'], 'data', 'closed_periods.sqlite3')
+        self._ready = False
+
+    def is_closed(self, month: Any, today: Optional[date] = None) -> bool:
+        """月份是否已结账, 无法解析时为False"""
+        try:
+            end = month_range(month)[1].date()
+        except (TypeError, ValueError):
+            return False
+        return (today or date.today()) >= end + timedelta(days=self.grace_days)
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _get(self, key: str) -> Optional[Tuple[bytes, str, str]]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT body, content_type, etag FROM report_result WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return (bytes(row[0]), row[1], row[2]) if row is not None else None
+
+    def _put(self, report: str, month: str, key: str, body: bytes, content_type: str, started_at: float) -> bool:
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        conn = self._connect()
+        try:
+            with conn:
+                # 计算开始后该月或维度数据被修改过, 结果可能是旧数据, 不保存
+                row = conn.execute(
+                    "SELECT MAX(invalidated_at) FROM month_invalidation WHERE month IN (?, ?)", (month, ALL_MONTHS)
+                ).fetchone()
+                if row[0] is not None and row[0] >= started_at:
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO report_result VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, report, month, body, content_type, etag, time.time()),
+                )
+        finally:
+            conn.close()
+        return True
+
+    def _invalidate(self, months: Iterable[str]) -> int:
+        now = time.time()
+        count = 0
+        conn = self._connect()
+        try:
+            with conn:
+                for month in months:
+                    conn.execute("INSERT OR REPLACE INTO month_invalidation VALUES (?, ?)", (month, now))
+                    count += conn.execute("DELETE FROM report_result WHERE month = ?", (month,)).rowcount
+        finally:
+            conn.close()
+        return count
+
+    def _invalidate_all(self) -> int:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO month_invalidation VALUES (?, ?)", (ALL_MONTHS, time.time()))
+                return conn.execute("DELETE FROM report_result").rowcount
+        finally:
+            conn.close()
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, str, str]]:
+        """读取保存的响应 (响应体, 内容类型, ETag), 不存在或读取失败时返回None"""
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, self._get, key)
+        except sqlite3.Error as e:
+            logger.warning('closed period store read failed: %s' % e)
+            return None
+
+    async def put(self, report: str, month: str, key: str, body: bytes, content_type: str, started_at: float) -> bool:
+        """保存响应, started_at 之后该月被修改过时不保存
+
+        :return: 是否已保存
+        """
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self._put, report, month, key, body, content_type, started_at
+            )
+        except sqlite3.Error as e:
+            logger.warning('closed period store write failed: %s' % e)
+            return False
+
+    async def invalidate(self, months: Iterable[Any]) -> int:
+        """已结账月份的称重记录被修改后删除这些月份的全部结果, 未结账的月份忽略
+
+        :param months: 月份, 如 2022-02
+        :return: 删除的结果数
+        """
+        closed: Set[str] = {m for m in map(normalize_month, months) if m is not None and self.is_closed(m)}
+        if not self.enabled or not closed:
+            return 0
+        try:
+            count = await asyncio.get_event_loop().run_in_executor(None, self._invalidate, sorted(closed))
+        except sqlite3.Error as e:
+            logger.error('closed period invalidation failed for %s: %s' % (sorted(closed), e))
+            return 0
+        logger.info('closed period results invalidated: %s, %d removed' % (sorted(closed), count))
+        return count
+
+    async def invalidate_all(self) -> int:
+        """维度数据修改后删除全部结果, 在修改事务提交后调用
+
+        :return: 删除的结果数
+        """
+        if not self.enabled:
+            return 0
+        try:
+            count = await asyncio.get_event_loop().run_in_executor(None, self._invalidate_all)
+        except sqlite3.Error as e:
+            logger.error('closed period invalidation failed: %s' % e)
+            return 0
+        logger.info('closed period results invalidated: all, %d removed' % count)
+        return count
+
+    async def invalidate_records(self, *buckets: Iterable[Dict[str, Any]]) -> int:
+        """按写入前后的记录(rollup_buckets 的结果)删除所在已结账月份的结果, 在写入事务提交后调用"""
+        return await self.invalidate({row["day"].strftime("%Y-%m") for rows in buckets for row in rows if row["day"]})
+
+
+closed_periods: ClosedPeriodStore = ClosedPeriodStore()
+
+
+def closed_period_report(report: str, variant: Optional[Callable[[], Any]] = None) -> Callable:
+    """已结账月份的报表响应持久化
+
+    请求体 month 为已结账月份时, 以 报表 + 请求体 为键读取 closed_periods, 命中时直接返回; 未命中时执行并保存成功响应.
+    其它请求直接执行. 与 single_flight, cached_report 同用时放在两者之间
+
+    :param report: 报表名称
+    :param variant: 影响结果的配置, 如清运单位分类, 计入键
+    """
+    def decorator(handler: Callable) -> Callable:
+        @wraps(handler)
+        async def wrapper(view, request: Request, *args, **kwargs) -> HTTPResponse:
+            body = request.json or {}
+            month = normalize_month(body.get("month"))
+            if not closed_periods.enabled or month is None or not closed_periods.is_closed(month):
+                return await handler(view, request, *args, **kwargs)
+            key = make_key(report, body, variant() if variant is not None else None)
+            stored = await closed_periods.get(key)
+            if stored is not None:
+                content, content_type, etag = stored
+                if request.headers.get("If-None-Match") == etag:
+                    return empty(status=304, headers={"ETag": etag})
+                return raw(content, content_type=content_type, headers={"ETag": etag})
+            started_at = time.time()
+            response = await handler(view, request, *args, **kwargs)
+            if response.status == 200 and loads(response.body).get("code") == ECEnum.Success.code:
+                await closed_periods.put(report, month, key, response.body, response.content_type, started_at)
+            return response
+
+        return wrapper
+
+    return decorator
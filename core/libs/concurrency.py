@@ -0,0 +1,92 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Awaitable, List, Optional
+
+# 单个请求内同时执行的查询数上限, 需小于数据库连接池大小(默认5)
+QUERY_CONCURRENCY: int = 4
+
+# 请求内共用的并发名额, 由最外层的 gather_queries 创建, 嵌套调用(查询协程内再次调用)共用
+_semaphore: ContextVar[Optional[asyncio.Semaphore]] = ContextVar('query_semaphore', default=None)
+# 当前协程是否已占用一个名额
+_holding: ContextVar[bool] = ContextVar('query_holding', default=False)
+
+
+def _discard(aw: Awaitable) -> None:
+    """关闭不再执行的协程, 避免未执行告警"""
+    if asyncio.iscoroutine(aw):
+        aw.close()
+
+
+async def gather_queries(*aws: Awaitable, limit: int = QUERY_CONCURRENCY) -> List[Any]:
+    """并发执行相互独立的查询, 结果按参数顺序返回
+
+    事务外的每条查询由 Tortoise 从连接池单独获取连接, 因此可以并行; 事务内共用同一连接, 不要在事务中使用.
+    嵌套调用与外层共用并发上限: 已占用名额的查询内再次调用时, 有空闲名额的查询另起执行, 其余在已占用的名额内依次执行.
+    任一查询失败时取消其余查询并抛出异常
+
+    :param aws: QuerySet 或协程
+    :param limit: 并发上限, 只在最外层调用生效
+    :return:
+    """
+    semaphore = _semaphore.get()
+    token = None
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(limit)
+        token = _semaphore.set(semaphore)
+    holding = _holding.get()
+
+    async def run(index: int, aw: Awaitable, acquired: bool) -> Any:
+        started.add(index)
+        if not acquired:
+            try:
+                await semaphore.acquire()
+            except asyncio.CancelledError:
+                _discard(aw)
+                raise
+        _holding.set(True)
+        try:
+            return await aw
+        finally:
+            semaphore.release()
+
+    results: List[Any] = [None] * len(aws)
+    tasks = {}
+    inline = []
+    # 已分配名额但尚未开始执行的查询被取消时, 名额由此处归还
+    reserved = set()
+    started = set()
+    try:
+        for index, aw in enumerate(aws):
+            if holding and semaphore.locked():
+                inline.append((index, aw))
+                continue
+            acquired = not semaphore.locked()
+            if acquired:
+                # 有空闲名额时不会挂起
+                await semaphore.acquire()
+                reserved.add(index)
+            tasks[index] = asyncio.ensure_future(run(index, aw, acquired))
+        while inline:
+            index, aw = inline.pop(0)
+            results[index] = await aw
+        for index, result in zip(tasks, await asyncio.gather(*tasks.values())):
+            results[index] = result
+        return results
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        for index in tasks.keys() - started:
+            _discard(aws[index])
+            if index in reserved:
+                semaphore.release()
+        for _, aw in inline:
+            _discard(aw)
+        raise
+    finally:
+        if token is not None:
+            _semaphore.reset(token)
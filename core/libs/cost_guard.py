@@ -0,0 +1,109 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from tortoise.queryset import QuerySet
+
+from core.models import WeightRecord
+from .periods import narrow_range, pop_period
+from .weight_rollup import rollup_covers
+from .logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+# 处理方式
+RUN = "run"  # 直接执行
+ROLLUP = "rollup"  # 日汇总表可以回答, 从日汇总表统计
+JOB = "job"  # 转为后台任务
+REJECT = "reject"  # 拒绝
+
+
+async def explain_rows(queryset: QuerySet) -> Optional[int]:
+    """EXPLAIN 查询得到预估扫描行数, 非 MySQL 或执行失败时返回None
+
+    各表 rows × filtered% 相乘, 关联维表为主键查找(rows=1), 结果近似于称重记录表的扫描行数
+    """
+    db = queryset.model._choose_db()
+    if db.capabilities.dialect != "mysql":
+        return None
+    try:
+        plan = await db.execute_query_dict("EXPLAIN " + queryset.sql())
+    except Exception as e:
+        logger.warning('explain failed: %s' % e)
+        return None
+    estimate = None
+    for row in plan:
+        if row.get("rows") is None:
+            continue
+        rows = float(row["rows"]) * float(row.get("filtered") or 100) / 100
+        estimate = rows if estimate is None else estimate * max(rows, 1)
+    return int(estimate) if estimate is not None else None
+
+
+class CostGuard:
+    """执行前的查询代价保护
+
+    日汇总表能回答的统计直接读日汇总表; 否则按 EXPLAIN 预估的称重记录扫描行数, 超过 JOB_ROWS 时转为后台任务
+    (接口不支持时直接执行), 超过 REJECT_ROWS 时拒绝. 仅 MySQL 可预估, 其它数据库直接执行
+
+    配置(可选):
+    COST_GUARD.ENABLED = false
+    COST_GUARD.JOB_ROWS = 2000000       转后台任务的预估行数, 0表示不转
+    COST_GUARD.REJECT_ROWS = 20000000   拒绝的预估行数, 0表示不拒绝
+    """
+
+    __slots__ = ('enabled', 'job_rows', 'reject_rows')
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.job_rows: int = 0
+        self.reject_rows: int = 0
+
+    def load(self, settings) -> None:
+        config = settings.get('COST_GUARD') or {}
+        self.enabled = bool(config.get('ENABLED', False))
+        self.job_rows = int(config.get('JOB_ROWS', 0))
+        self.reject_rows = int(config.get('REJECT_ROWS', 0))
+
+    async def check(
+            self,
+            filters: Dict[str, Any],
+            start_time: Any = None,
+            end_time: Any = None,
+            group_by: Sequence[str] = (),
+            date_format: str = "%Y-%m-%d",
+            deferrable: bool = False,
+    ) -> Tuple[str, Optional[int]]:
+        """判断统计的处理方式, 参数同 aggregate_weight_records
+
+        :param deferrable: 接口是否支持转为后台任务
+        :return: (处理方式, 预估行数)
+        """
+        if not self.enabled:
+            return RUN, None
+        if rollup_covers(filters, start_time, end_time, group_by, date_format):
+            return ROLLUP, None
+        filters = dict(filters)
+        period = pop_period(filters)
+        end_inclusive = True
+        if period is not None:
+            start_time, end_time, end_inclusive = narrow_range(start_time, end_time, end_inclusive, period)
+        time_filters: Dict[str, Any] = {}
+        if start_time is not None:
+            time_filters["time_weight__gte"] = start_time
+        if end_time is not None:
+            time_filters["time_weight__lte" if end_inclusive else "time_weight__lt"] = end_time
+        estimate = await explain_rows(WeightRecord.filter(**filters, **time_filters).values_list("id"))
+        if estimate is None:
+            return RUN, None
+        if self.reject_rows and estimate >= self.reject_rows:
+            return REJECT, estimate
+        if deferrable and self.job_rows and estimate >= self.job_rows:
+            return JOB, estimate
+        return RUN, estimate
+
+
+cost_guard: CostGuard = CostGuard()
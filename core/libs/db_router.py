@@ -0,0 +1,71 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Type
+
+from tortoise import Model, connections
+from tortoise.backends.base.client import BaseTransactionWrapper
+
+# 主库/从库连接名
+PRIMARY = "default"
+REPLICA = "replica"
+
+# 当前请求是否允许读从库, 由 ReplicaMiddleware 按请求路径设置
+_read_replica: ContextVar[bool] = ContextVar("read_replica", default=False)
+
+
+class ReplicaState:
+    """从库状态, 由 ReplicaListener 定时检查复制延迟后更新"""
+
+    # 已配置从库
+    enabled: bool = False
+    # 复制延迟在允许范围内
+    healthy: bool = False
+    # 最近一次检查到的复制延迟(秒), 未知时为None
+    lag: Optional[float] = None
+
+
+def use_replica(allowed: bool) -> None:
+    """设置当前请求的读库"""
+    _read_replica.set(allowed)
+
+
+class ReplicaRouter:
+    """读写分离路由
+
+    仅当前请求允许读从库且从库延迟正常时, 读查询路由到从库; 其余情况(写入, 事务内, 本请求已有写入)均使用主库
+    """
+
+    def db_for_read(self, model: Type[Model]) -> Optional[str]:
+        if not (_read_replica.get() and ReplicaState.healthy):
+            return None
+        if isinstance(connections.get(PRIMARY), BaseTransactionWrapper):
+            return None
+        return REPLICA
+
+    def db_for_write(self, model: Type[Model]) -> Optional[str]:
+        # 写后读: 本请求后续查询走主库
+        _read_replica.set(False)
+        return None
+
+
+def tortoise_config(settings) -> Dict[str, Any]:
+    """由配置生成 Tortoise 配置, 配置了 [MYSQL.REPLICA] 时增加从库连接与读写分离路由
+
+    MYSQL.REPLICA.HOST 必填, 其余未配置项沿用主库配置
+    """
+    mysql = settings['MYSQL']
+    url = "mysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DB}"
+    config: Dict[str, Any] = {
+        "connections": {PRIMARY: url.format(**mysql)},
+        "apps": {"models": {"models": ["core.models"], "default_connection": PRIMARY}},
+    }
+    replica = mysql.get('REPLICA')
+    if replica and replica.get('HOST'):
+        config["connections"][REPLICA] = url.format(**{**mysql, **replica})
+        config["routers"] = ["core.libs.db_router.ReplicaRouter"]
+        ReplicaState.enabled = True
+    return config
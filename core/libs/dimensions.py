@@ -0,0 +1,253 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from tortoise.functions import Count, Sum
+
+from core.models import WeightRecord
+from .aggregation import MEASURES, reduce_groups
+from .concurrency import gather_queries
+from .sql_udfs import NetWeightSum, aggregate_totals
+from .weight_rollup import aggregate_weight_records, rollup_covers
+
+# 分组维度白名单: 维度名 -> (id字段, 名称字段), 字段为称重记录的查询路径; 两者相同时只返回名称
+DIMENSIONS: Dict[str, Tuple[str, str]] = {
+    "pound": ("pound_id_id", "pound_id__comp_name"),
+    "dept": ("vehicle_id__dept_id_id", "vehicle_id__dept_id__department_name"),
+    "region": ("garbage_source_id__region_id_id", "garbage_source_id__region_id__region_name"),
+    "source": ("garbage_source_id_id", "garbage_source_id__source_name"),
+    "type": ("garbage_type_id_id", "garbage_type_id__garbage_type_name"),
+    "driver": ("driver_id_id", "driver_id__driver_name"),
+    "vehicle": ("vehicle_id_id", "vehicle_id__vehicle_no"),
+    "info": ("info", "info"),
+}
+# 时间维度: 维度名 -> 称重时间的 DATE_FORMAT 格式, 一次统计最多一个
+TIME_BUCKETS: Dict[str, str] = {
+    "month": "%Y-%m",
+    "day": "%Y-%m-%d",
+    "hour": "%Y-%m-%d %H:00",
+}
+# 一次统计的维度数上限
+MAX_DIMENSIONS: int = 4
+# 排名的默认名次数与上限
+RANK_LIMIT: int = 20
+MAX_RANK_LIMIT: int = 100
+
+
+def compile_dimensions(dimensions: Sequence[str]) -> Tuple[Tuple[str, ...], str]:
+    """维度转分组字段与日期格式
+
+    :raise ValueError: 维度不在白名单, 重复, 超过上限或含多个时间维度
+    """
+    if len(dimensions) > MAX_DIMENSIONS:
+        raise ValueError("分组维度最多%d个" % MAX_DIMENSIONS)
+    if len(set(dimensions)) != len(dimensions):
+        raise ValueError("分组维度重复")
+    group_by: List[str] = []
+    date_format = TIME_BUCKETS["day"]
+    buckets = [d for d in dimensions if d in TIME_BUCKETS]
+    if len(buckets) > 1:
+        raise ValueError("时间维度只能选择一个")
+    for dimension in dimensions:
+        if dimension in TIME_BUCKETS:
+            group_by.append("date")
+            date_format = TIME_BUCKETS[dimension]
+            continue
+        if dimension not in DIMENSIONS:
+            raise ValueError("不支持的分组维度: %s" % dimension)
+        for field in DIMENSIONS[dimension]:
+            if field not in group_by:
+                group_by.append(field)
+    return tuple(group_by), date_format
+
+
+def compile_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """维度过滤条件转称重记录过滤条件, 值为列表时表示其中之一
+
+    {"pound": 1, "type": [1, 2]} -> {"pound_id_id": 1, "garbage_type_id_id__in": [1, 2]}
+
+    :raise ValueError: 维度不在白名单
+    """
+    compiled: Dict[str, Any] = {}
+    for dimension, value in (filters or {}).items():
+        if dimension not in DIMENSIONS:
+            raise ValueError("不支持的过滤维度: %s" % dimension)
+        field = DIMENSIONS[dimension][0]
+        if isinstance(value, (list, tuple)):
+            compiled[field + "__in"] = list(value)
+        else:
+            compiled[field] = value
+    return compiled
+
+
+def compile_measures(measures: Optional[Sequence[str]]) -> Tuple[str, ...]:
+    """汇总指标, 未指定时为全部
+
+    :raise ValueError: 指标不在 MEASURES 中
+    """
+    if not measures:
+        return MEASURES
+    for measure in measures:
+        if measure not in MEASURES:
+            raise ValueError("不支持的汇总指标: %s" % measure)
+    return tuple(measures)
+
+
+def _sort_key(row: Dict[str, Any], keys: Sequence[str]) -> Tuple:
+    # 空值排在最后
+    return tuple((row[k] is None, row[k] if row[k] is not None else "") for k in keys)
+
+
+async def group_weight_records(
+        dimensions: Sequence[str],
+        measures: Optional[Sequence[str]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        start_time: Any = None,
+        end_time: Any = None,
+) -> List[Dict[str, Any]]:
+    """按白名单维度分组统计称重记录
+
+    维度编译为一次分组聚合, 由 aggregate_weight_records 按条件选择列式缓存, 日汇总表或称重记录表;
+    司机与小时维度日汇总表无法表达, 只能读取称重记录表
+
+    :param dimensions: 分组维度, 见 DIMENSIONS 与 TIME_BUCKETS, 为空时得到总计
+    :param measures: 汇总指标, 见 MEASURES, 为空时为全部
+    :param filters: 维度过滤条件 {维度: id或id列表}
+    :param start_time: 开始时间(含), None表示不限
+    :param end_time: 结束时间(含), None表示不限
+    :return: [{维度: 名称, 维度_id: id, ..., 指标...}], 按维度排序
+    :raise ValueError: 参数不在白名单内
+    """
+    group_by, date_format = compile_dimensions(dimensions)
+    measures = compile_measures(measures)
+    rows = await aggregate_weight_records(
+        compile_filters(filters),
+        start_time,
+        end_time,
+        group_by=group_by,
+        date_format=date_format,
+    )
+    keys: List[str] = []
+    results = []
+    for row in rows:
+        result = _result_row(row, dimensions, measures)
+        if not keys:
+            keys = list(result)
+        results.append(result)
+    results.sort(key=lambda r: _sort_key(r, keys))
+    return results
+
+
+def _result_row(row: Dict[str, Any], dimensions: Sequence[str], measures: Sequence[str]) -> Dict[str, Any]:
+    """统计结果行转为 {维度: 名称, 维度_id: id, ..., 指标...}"""
+    result: Dict[str, Any] = {}
+    for dimension in dimensions:
+        if dimension in TIME_BUCKETS:
+            result[dimension] = row["date"]
+            continue
+        id_field, name_field = DIMENSIONS[dimension]
+        result[dimension] = row[name_field]
+        if id_field != name_field:
+            result[dimension + "_id"] = row[id_field]
+    for measure in measures:
+        result[measure] = row[measure]
+    return result
+
+
+def _measure_value(row: Dict[str, Any], measure: str) -> Any:
+    return row[measure] if row[measure] is not None else 0
+
+
+async def _rank_raw(
+        filters: Dict[str, Any],
+        group_by: Sequence[str],
+        measure: str,
+        limit: int,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """在数据库中按指标降序取前 limit 个分组, 同时统计总计与分组数"""
+    top = WeightRecord.filter(**filters, **{group_by[0] + "__isnull": False}).annotate(
+        vehicle_num=Count("id_center"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+        weight_net_sum=NetWeightSum(),
+    ).group_by(*group_by).order_by("-" + measure, group_by[0]).limit(limit).values(*group_by, *MEASURES)
+    total = aggregate_totals(
+        WeightRecord.filter(**filters).annotate(
+            vehicle_num=Count("id_center"),
+            weight_gross_sum=Sum("weight_gross"),
+            weight_tare_sum=Sum("weight_tare"),
+            weight_net_sum=NetWeightSum(),
+            group_num=Count(group_by[0], distinct=True),
+        ),
+        *MEASURES,
+        "group_num",
+    )
+    return await gather_queries(top, total)
+
+
+async def rank_weight_records(
+        dimension: str,
+        measure: str = "weight_net_sum",
+        limit: int = RANK_LIMIT,
+        filters: Optional[Dict[str, Any]] = None,
+        start_time: Any = None,
+        end_time: Any = None,
+) -> Dict[str, Any]:
+    """按维度统计称重记录, 取指标最大的前 limit 个分组, 其余合并为"其它"
+
+    日汇总表可覆盖时读取全部分组后排序(分组数为维表规模); 否则在数据库中按指标降序 LIMIT 取前 limit + 1 个分组,
+    并发统计总计. 指标相同的分组名次相同(1, 2, 2, 4), 按id先后排列; 第 limit + 1 个分组与末位并列时 tie_at_limit 为True.
+    未关联该维度的记录(如无垃圾来源)不参与排名, 计入"其它"
+
+    :param dimension: 排名维度, 见 DIMENSIONS
+    :param measure: 排名指标, 见 MEASURES
+    :param limit: 名次数, 1 到 MAX_RANK_LIMIT
+    :param filters: 维度过滤条件 {维度: id或id列表}
+    :param start_time: 开始时间(含), None表示不限
+    :param end_time: 结束时间(含), None表示不限
+    :return: {ranking: [{rank, 维度, 维度_id, 指标...}], others: {group_num, 指标...}, total: {group_num, 指标...},
+        tie_at_limit: bool}
+    :raise ValueError: 参数不在白名单内
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError("不支持的排名维度: %s" % dimension)
+    if measure not in MEASURES:
+        raise ValueError("不支持的排名指标: %s" % measure)
+    if not 0 < limit <= MAX_RANK_LIMIT:
+        raise ValueError("名次数须在1到%d之间" % MAX_RANK_LIMIT)
+    group_by = tuple(dict.fromkeys(DIMENSIONS[dimension]))
+    compiled = compile_filters(filters)
+    if rollup_covers(compiled, start_time, end_time, group_by):
+        rows = await aggregate_weight_records(compiled, start_time, end_time, group_by=group_by)
+        totals = reduce_groups(rows, ())
+        total = totals[0] if totals else None
+        ranked = [row for row in rows if row[group_by[0]] is not None]
+        ranked.sort(key=lambda r: (-_measure_value(r, measure), r[group_by[0]]))
+        if total is not None:
+            total["group_num"] = len(ranked)
+        top = ranked[:limit + 1]
+    else:
+        time_filters: Dict[str, Any] = {}
+        if start_time is not None:
+            time_filters["time_weight__gte"] = start_time
+        if end_time is not None:
+            time_filters["time_weight__lte"] = end_time
+        top, total = await _rank_raw(dict(compiled, **time_filters), group_by, measure, limit + 1)
+    if total is None:
+        total = dict({m: None for m in MEASURES}, vehicle_num=0, group_num=0)
+
+    ranking = []
+    for position, row in enumerate(top[:limit], 1):
+        result = dict(rank=position, **_result_row(row, (dimension,), MEASURES))
+        if ranking and _measure_value(row, measure) == _measure_value(top[position - 2], measure):
+            result["rank"] = ranking[-1]["rank"]
+        ranking.append(result)
+    others: Dict[str, Any] = dict(group_num=total["group_num"] - len(ranking))
+    for m in MEASURES:
+        others[m] = total[m] - sum((r[m] or 0 for r in ranking), 0) if total[m] is not None else None
+    others["vehicle_num"] = int(others["vehicle_num"] or 0)
+    tie_at_limit = len(top) > limit and _measure_value(top[limit], measure) == _measure_value(top[limit - 1], measure)
+    return dict(ranking=ranking, others=others, total=total, tie_at_limit=tie_at_limit)
@@ -12,6 +12,7 @@ class ECEnum(BaseECEnum):
     Fail = ECData("-1", "失败")
     # ImageDelete = ECData("")
     ServerError = ECData("500", "服务异常，请稍后重试")
+    ServerBusy = ECData("503", "服务繁忙，请稍后重试")
     NoResourceFound = ECData("40001", "未找到资源")
     InvalidParameter = ECData("40002", "参数无效")
     AccountOrPassWordErr = ECData("40003", "账户或密码错误")
@@ -25,4 +26,6 @@ class ECEnum(BaseECEnum):
     # FailOTHERLOGIN = ECData("40011", "其他地方登陆")
     FailToken = ECData("40012", "认证无效或过期")
     SessionExpired = ECData("40013", "会话过期或失效")
+    QueryTooLarge = ECData("40014", "查询数据量过大，请缩小时间范围或增加过滤条件")
+    JobAccepted = ECData("202", "查询数据量较大，已转为后台任务，请通过任务接口获取结果")
     # TEST = ECData("TEST", "测试错误")
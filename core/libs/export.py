@@ -0,0 +1,303 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import csv
+import io
+import tempfile
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from tortoise.queryset import QuerySet
+
+from .pagination import row_key, seek
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # xlsx 导出为可选功能
+    Workbook = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # arrow/parquet 导出为可选功能
+    pa = pq = None
+
+# 导出列: (WeightRecord.to_dict 键, 表头)
+EXPORT_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("id_center", "中心编号"),
+    ("vehicle_no", "车牌号"),
+    ("vehicle_door_no", "自编号"),
+    ("driver_name", "司机名"),
+    ("time_weight", "进场称重时间"),
+    ("time_leave", "出场称重时间"),
+    ("weight_gross", "毛重"),
+    ("weight_tare", "皮重"),
+    ("weight_net", "净重"),
+    ("loading_rate", "装载率"),
+    ("pound_name", "收货单位"),
+    ("dept_name", "清运单位"),
+    ("weight_checker", "计量员"),
+    ("garbage_source_name", "垃圾来源"),
+    ("garbage_type_name", "垃圾类别"),
+    ("region_name", "区域/发货单位"),
+    ("data_type", "备注"),
+    ("info", "数据类型"),
+    ("check_time", "核对时间"),
+)
+
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+# 需要 pyarrow 的导出格式
+ARROW_FORMATS: Tuple[str, ...] = ("arrow", "parquet")
+
+# 每批读取的记录数
+BATCH_SIZE: int = 1000
+# xlsx 临时文件回传时每块大小
+CHUNK_SIZE: int = 64 * 1024
+# arrow/parquet 每批读取的记录数, 即每个 RecordBatch/行组的行数
+ARROW_BATCH_SIZE: int = 10000
+
+
+# WeightRecord.to_dict 所需字段 -> values() 查询字段, 关联表在同一条查询中 LEFT JOIN
+PROJECTION_FIELDS: Dict[str, str] = {
+    "id": "id",
+    "id_center": "id_center",
+    "vehicle_ref": "vehicle_id_id",
+    "vehicle_no": "vehicle_id__vehicle_no",
+    "vehicle_door_no": "vehicle_id__vehicle_door_no",
+    "max_net_weight": "vehicle_id__max_net_weight",
+    "dept_name": "vehicle_id__dept_id__department_name",
+    "driver_name": "driver_id__driver_name",
+    "time_weight": "time_weight",
+    "weight_gross": "weight_gross",
+    "time_leave": "time_leave",
+    "weight_tare": "weight_tare",
+    "pound_name": "pound_id__comp_name",
+    "weight_checker": "user_id__username",
+    "user_ref": "user_id_id",
+    "garbage_source_name": "garbage_source_id__source_name",
+    "garbage_type_name": "garbage_type_id__garbage_type_name",
+    "region_name": "garbage_source_id__region_id__region_name",
+    "data_mark": "data_mark",
+    "time_loading": "time_loading",
+    "load_meter_pos_id": "load_meter_pos_id",
+    "info": "info",
+    "check_time": "check_time",
+}
+DATA_TYPES: Dict[int, str] = {
+    0: "自动读取",
+    1: "手动补充",
+    2: "读卡失败后手动输入车门号",
+}
+
+
+def project(queryset: QuerySet) -> QuerySet:
+    """只查询 to_dict 所需列, 返回字典行"""
+    return queryset.values(**PROJECTION_FIELDS)
+
+
+def format_weight_records(rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """将 project 查询的字典行批量转为 WeightRecord.to_dict 的格式, 不实例化模型"""
+    records = []
+    for row in rows:
+        gross, tare = row["weight_gross"], row["weight_tare"]
+        weight_net = gross - tare if gross is not None and tare is not None else None
+        loading_rate = 0.00
+        if row["vehicle_ref"] is not None and weight_net is not None and row["max_net_weight"]:
+            loading_rate = "%.2f" % (weight_net / row["max_net_weight"] * 100) + "%"
+        records.append(dict(
+            id_center=row["id_center"],
+            vehicle_no=row["vehicle_no"] or "",
+            driver_name=row["driver_name"] or "",
+            vehicle_door_no=row["vehicle_door_no"] or "",
+            time_weight=row["time_weight"],
+            weight_gross=gross,
+            time_leave=row["time_leave"],
+            weight_tare=tare,
+            weight_net=weight_net,
+            loading_rate=loading_rate,
+            pound_name=row["pound_name"] or "",
+            dept_name=row["dept_name"] or "",
+            # 计量员不在操作员表中时同 to_dict 取 user_id
+            weight_checker=row["weight_checker"] if row["weight_checker"] is not None else row["user_ref"],
+            garbage_source_name=row["garbage_source_name"] or "",
+            garbage_type_name=row["garbage_type_name"] or "",
+            region_name=row["region_name"] or "",
+            data_type=DATA_TYPES.get(row["data_mark"], ""),
+            image_in="无图片",
+            image_out="无图片",
+            time_loading=row["time_loading"],
+            load_meter_pos_id=row["load_meter_pos_id"],
+            info=row["info"],
+            check_time=row["check_time"],
+        ))
+    return records
+
+
+async def iter_projected_rows(queryset: QuerySet, batch_size: int = BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+    """按 (称重时间, id) 游标分批读取 project 字典行, 每批只在内存中保留 batch_size 条"""
+    key = None
+    while True:
+        rows = await project(seek(queryset, key).limit(batch_size))
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        key = row_key(rows[-1])
+
+
+async def iter_weight_records(queryset: QuerySet, batch_size: int = BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+    """分批读取称重记录, 格式同 WeightRecord.to_dict"""
+    async for rows in iter_projected_rows(queryset, batch_size):
+        yield format_weight_records(rows)
+
+
+def _cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def export_row(record: Dict[str, Any], columns: Sequence[Tuple[str, str]] = EXPORT_COLUMNS) -> List[Any]:
+    """按导出列取出一条记录的值"""
+    return [_cell(record[key]) for key, _ in columns]
+
+
+async def csv_chunks(queryset: QuerySet, columns: Sequence[Tuple[str, str]] = EXPORT_COLUMNS) -> AsyncIterator[bytes]:
+    """逐批生成 CSV 内容, 带 BOM 以便 Excel 识别 UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for _, title in columns])
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    async for batch in iter_weight_records(queryset):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(export_row(record, columns) for record in batch)
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def xlsx_chunks(queryset: QuerySet, columns: Sequence[Tuple[str, str]] = EXPORT_COLUMNS) -> AsyncIterator[bytes]:
+    """以只写模式生成 xlsx, 行数据落盘到临时文件, 完成后分块回传"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("称重数据明细")
+    sheet.append([title for _, title in columns])
+    async for batch in iter_weight_records(queryset):
+        for record in batch:
+            sheet.append(export_row(record, columns))
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk: Optional[bytes] = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def arrow_schema() -> "pa.Schema":
+    """arrow/parquet 导出的列类型: 重量为 decimal, 时间为 timestamp, 装载率为百分数 float"""
+    weight = pa.decimal128(10, 2)
+    return pa.schema([
+        ("id", pa.int64()),
+        ("id_center", pa.int64()),
+        ("vehicle_no", pa.string()),
+        ("vehicle_door_no", pa.string()),
+        ("driver_name", pa.string()),
+        ("time_weight", pa.timestamp("s")),
+        ("time_leave", pa.timestamp("s")),
+        ("weight_gross", weight),
+        ("weight_tare", weight),
+        ("weight_net", weight),
+        ("max_net_weight", weight),
+        ("loading_rate", pa.float64()),
+        ("pound_name", pa.string()),
+        ("dept_name", pa.string()),
+        ("weight_checker", pa.string()),
+        ("garbage_source_name", pa.string()),
+        ("garbage_type_name", pa.string()),
+        ("region_name", pa.string()),
+        ("data_mark", pa.int32()),
+        ("data_type", pa.string()),
+        ("info", pa.string()),
+        ("time_loading", pa.timestamp("s")),
+        ("load_meter_pos_id", pa.int64()),
+        ("check_time", pa.timestamp("s")),
+    ])
+
+
+def arrow_batch(rows: Sequence[Dict[str, Any]], schema: "pa.Schema") -> "pa.RecordBatch":
+    """将 project 查询的字典行按列转为 RecordBatch, 派生列与 format_weight_records 一致, 空值保留为 null"""
+    columns: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    derived = ("weight_net", "loading_rate", "data_type")
+    for row in rows:
+        gross, tare = row["weight_gross"], row["weight_tare"]
+        weight_net = gross - tare if gross is not None and tare is not None else None
+        loading_rate = None
+        if weight_net is not None and row["max_net_weight"]:
+            loading_rate = float(weight_net / row["max_net_weight"] * 100)
+        columns["weight_net"].append(weight_net)
+        columns["loading_rate"].append(loading_rate)
+        columns["data_type"].append(DATA_TYPES.get(row["data_mark"], ""))
+        for name in schema.names:
+            if name not in derived:
+                columns[name].append(row[name])
+    return pa.record_batch([pa.array(columns[f.name], type=f.type) for f in schema], schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """只写缓冲, 写入的内容在每批结束后取出回传"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position: int = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+async def arrow_chunks(queryset: QuerySet) -> AsyncIterator[bytes]:
+    """逐批生成 Arrow IPC 流, 客户端可用 pyarrow.ipc.open_stream 读取"""
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    yield sink.drain()
+    async for rows in iter_projected_rows(queryset, ARROW_BATCH_SIZE):
+        writer.write_batch(arrow_batch(rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+async def parquet_chunks(queryset: QuerySet) -> AsyncIterator[bytes]:
+    """逐批生成 Parquet 文件, 每批一个行组; 文件尾在全部写完后回传"""
+    schema = arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    async for rows in iter_projected_rows(queryset, ARROW_BATCH_SIZE):
+        writer.write_batch(arrow_batch(rows, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,287 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+from json import dumps
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .cache import make_key
+from .error_code.errorcode import ECEnum
+from .response import ExtJsonEncoder
+from .logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+# 报表函数: 请求体 -> 响应数据
+ReportFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 清理过期结果文件的间隔(秒)
+PRUNE_INTERVAL = 600
+
+
+class QueueFull(Exception):
+    """排队任务数已达上限"""
+
+
+class Job:
+    """报表任务"""
+
+    __slots__ = ('id', 'key', 'report', 'params', 'status', 'error', 'created_at', 'started_at', 'finished_at')
+
+    def __init__(self, key: str, report: str, params: Dict[str, Any]) -> None:
+        self.id: str = uuid.uuid4().hex
+        self.key: str = key
+        self.report: str = report
+        self.params: Dict[str, Any] = params
+        self.status: str = PENDING
+        self.error: Optional[str] = None
+        self.created_at: datetime = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def in_flight(self) -> bool:
+        return self.status in (PENDING, RUNNING)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            id=self.id,
+            report=self.report,
+            status=self.status,
+            error=self.error,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+        )
+
+
+class ResultStore:
+    """任务结果存储, 每个任务一个json文件, 内容与同步接口的响应体一致; 超过ttl秒的文件视为不存在, 由 prune 删除"""
+
+    __slots__ = ('directory', 'ttl')
+
+    def __init__(self, directory: str, ttl: float = 3600) -> None:
+        self.directory: str = directory
+        self.ttl: float = ttl
+
+    def path(self, job_id: str) -> str:
+        # 任务id为uuid的十六进制, 防止拼出目录外的路径
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return os.path.join(self.directory, job_id + '.json')
+
+    def write(self, job_id: str, content: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(job_id)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    def _expired(self, mtime: float) -> bool:
+        return mtime < time.time() - self.ttl
+
+    def read(self, job_id: str) -> Optional[bytes]:
+        try:
+            with open(self.path(job_id), 'rb') as f:
+                if self._expired(os.fstat(f.fileno()).st_mtime):
+                    return None
+                return f.read()
+        except (KeyError, OSError):
+            return None
+
+    def exists(self, job_id: str) -> bool:
+        try:
+            return not self._expired(os.path.getmtime(self.path(job_id)))
+        except (KeyError, OSError):
+            return False
+
+    def prune(self) -> int:
+        """删除过期的结果文件
+
+        :return: 删除数
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        count = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if self._expired(os.path.getmtime(path)):
+                    os.remove(path)
+                    count += 1
+            except OSError:
+                pass
+        return count
+
+
+class JobManager:
+    """异步报表任务
+
+    耗时的统计查询提交为任务后立即返回任务id, 由固定数量的后台协程按提交顺序执行, 结果写入本地结果存储;
+    相同报表和参数的任务在排队或执行中时, 重复提交返回已有任务. 排队数超过上限时拒绝提交.
+    任务状态保存在进程内, 多进程部署时其它进程只能根据结果文件判断任务已完成.
+    结果超过保留时间后查询即视为不存在, 过期的结果文件由后台定时删除
+    """
+
+    __slots__ = ('_reports', '_jobs', '_in_flight', '_queue', '_workers', '_pruner', 'store', 'max_pending')
+
+    def __init__(self, store: ResultStore, max_pending: int = 32) -> None:
+        self._reports: Dict[str, ReportFunc] = {}
+        self._jobs: Dict[str, Job] = {}
+        # 任务键 -> 排队或执行中的任务
+        self._in_flight: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pruner: Optional[asyncio.Task] = None
+        self.store: ResultStore = store
+        self.max_pending: int = max_pending
+
+    def register(self, report: str, func: ReportFunc) -> None:
+        self._reports[report] = func
+
+    @property
+    def reports(self) -> List[str]:
+        return sorted(self._reports)
+
+    def configure(self, settings) -> None:
+        """加载配置
+
+        JOBS.MAX_PENDING = 32       排队任务数上限
+        JOBS.RESULT_TTL = 3600      结果保留时间(秒)
+        JOBS.RESULT_DIR = ''        结果目录, 默认 data/jobs
+        """
+        config = settings.get('JOBS') or {}
+        self.max_pending = config.get('MAX_PENDING', self.max_pending)
+        self.store.ttl = config.get('RESULT_TTL', self.store.ttl)
+        self.store.directory = config.get('RESULT_DIR') or os.path.join(settings['BASE_PATH'], 'data', 'jobs')
+
+    def start(self, workers: int = 2) -> None:
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(max(workers, 1))]
+        self._pruner = asyncio.ensure_future(self._prune_results())
+
+    async def stop(self) -> None:
+        tasks = self._workers + ([self._pruner] if self._pruner is not None else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._pruner = None
+        self._queue = None
+
+    def submit(self, report: str, params: Dict[str, Any]) -> Job:
+        """提交任务, 相同的任务在排队或执行中时返回已有任务
+
+        :raise KeyError: 报表未登记
+        :raise QueueFull: 后台未启动或排队任务数已达上限
+        """
+        if report not in self._reports:
+            raise KeyError(report)
+        key = make_key(report, params)
+        job = self._in_flight.get(key)
+        if job is not None:
+            return job
+        if self._queue is None or self._queue.qsize() >= self.max_pending:
+            raise QueueFull(report)
+        self.prune()
+        job = Job(key, report, params)
+        self._jobs[job.id] = job
+        self._in_flight[key] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务状态, 任务不存在或结果已过期时返回None"""
+        self.prune()
+        job = self._jobs.get(job_id)
+        if job is not None:
+            status = job.to_dict()
+            if job.status == PENDING:
+                status['position'] = self._position(job)
+            return status
+        if self.store.exists(job_id):
+            return dict(id=job_id, status=DONE)
+        return None
+
+    async def result(self, job_id: str) -> Optional[bytes]:
+        """已完成任务的响应体, 未完成或已过期时返回None; 结果文件在线程池中读取"""
+        self.prune()
+        job = self._jobs.get(job_id)
+        if job is not None and job.status != DONE:
+            return None
+        return await asyncio.get_event_loop().run_in_executor(None, self.store.read, job_id)
+
+    def prune(self) -> None:
+        """清理超过结果保留时间的已结束任务"""
+        expire_at = datetime.now().timestamp() - self.store.ttl
+        for job_id, job in list(self._jobs.items()):
+            if not job.in_flight and job.finished_at.timestamp() < expire_at:
+                del self._jobs[job_id]
+
+    async def _prune_results(self) -> None:
+        """定时删除过期的结果文件"""
+        while True:
+            try:
+                count = await asyncio.get_event_loop().run_in_executor(None, self.store.prune)
+                logger.debug('expired job results removed: %d' % count)
+            except Exception as e:
+                logger.error('job result prune failed: %s' % e)
+            await asyncio.sleep(PRUNE_INTERVAL)
+
+    def _position(self, job: Job) -> int:
+        """排队任务前面的排队任务数"""
+        return sum(1 for j in self._jobs.values() if j.status == PENDING and j.created_at < job.created_at)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = RUNNING
+        job.started_at = datetime.now()
+        try:
+            data = await self._reports[job.report](dict(job.params))
+            content = dict(code=str(ECEnum.Success.code), data=data, msg=ECEnum.Success.message)
+            body = dumps(content, cls=ExtJsonEncoder).encode('utf-8')
+            await asyncio.get_event_loop().run_in_executor(None, self.store.write, job.id, body)
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "任务已取消"
+            raise
+        except KeyError as e:
+            logger.error('report job %s failed: missing %s' % (job.id, e))
+            job.status = FAILED
+            job.error = "缺少参数: %s" % e.args[0]
+        except Exception as e:
+            logger.error('report job %s failed: %s' % (job.id, e))
+            job.status = FAILED
+            job.error = str(e) or e.__class__.__name__
+        finally:
+            job.finished_at = datetime.now()
+            self._in_flight.pop(job.key, None)
+
+
+report_jobs: JobManager = JobManager(ResultStore(os.path.join('data', 'jobs')))
@@ -0,0 +1,127 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from tortoise.expressions import Q
+from tortoise.queryset import QuerySet
+
+from .cache import TTLCache
+
+# 游标键: (称重时间, id)
+SeekKey = Tuple[datetime, int]
+
+NEXT = 'next'
+PREV = 'prev'
+
+
+def encode_cursor(key: SeekKey, direction: str = NEXT, version: Optional[str] = None) -> str:
+    """生成不透明游标
+
+    :param version: 首页查询时的数据版本, 随游标传递, 翻页时沿用而不重新查询
+    """
+    raw = [key[0].isoformat(sep=' ', timespec='microseconds'), key[1], direction]
+    if version is not None:
+        raw.append(version)
+    return base64.urlsafe_b64encode(json.dumps(raw).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[SeekKey, str, Optional[str]]:
+    """解析游标为 (游标键, 方向, 数据版本), 未携带数据版本时为None; 格式错误时抛出 ValueError"""
+    try:
+        time_weight, record_id, direction, *rest = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        key = (datetime.fromisoformat(time_weight), int(record_id))
+    except Exception as e:
+        raise ValueError("invalid cursor: %s" % cursor) from e
+    if direction not in (NEXT, PREV):
+        raise ValueError("invalid cursor direction: %s" % direction)
+    version = rest[0] if rest else None
+    if version is not None and not isinstance(version, str):
+        raise ValueError("invalid cursor version: %s" % cursor)
+    return key, direction, version
+
+
+def seek(queryset: QuerySet, key: Optional[SeekKey] = None, direction: str = NEXT) -> QuerySet:
+    """按 (time_weight, id) 排序并定位到游标之后(或之前)
+
+    向前翻页(prev)时结果为倒序, 取出后需反转
+    """
+    if direction == PREV:
+        if key is not None:
+            queryset = queryset.filter(time_weight__lte=key[0]).filter(
+                Q(time_weight__lt=key[0]) | Q(id__lt=key[1])
+            )
+        return queryset.order_by("-time_weight", "-id")
+
+    if key is not None:
+        queryset = queryset.filter(time_weight__gte=key[0]).filter(
+            Q(time_weight__gt=key[0]) | Q(id__gt=key[1])
+        )
+    return queryset.order_by("time_weight", "id")
+
+
+class PageIndex:
+    """稀疏页边界索引
+    每隔 stride 页记录一次该页起点之前的游标键, 跳转到第N页时从最近的边界开始定位, 避免深度OFFSET
+    """
+
+    __slots__ = ('_stride', '_boundaries')
+
+    def __init__(self, stride: int = 10, maxsize: int = 256, ttl: float = 600) -> None:
+        self._stride: int = stride
+        self._boundaries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def record(self, index_key: str, page_num: int, key: SeekKey) -> None:
+        """记录第 page_num 页之前最后一条记录的键"""
+        if page_num <= 0 or page_num % self._stride:
+            return
+        boundaries: Optional[Dict[int, SeekKey]] = self._boundaries.get(index_key)
+        if boundaries is None:
+            boundaries = {}
+            self._boundaries.set(index_key, boundaries)
+        boundaries[page_num] = key
+
+    def nearest(self, index_key: str, page_num: int) -> Tuple[int, Optional[SeekKey]]:
+        """不超过 page_num 的最近边界, 无记录时为第0页"""
+        boundaries: Dict[int, SeekKey] = self._boundaries.get(index_key) or {}
+        pages = [p for p in boundaries if p <= page_num]
+        if not pages:
+            return 0, None
+        page = max(pages)
+        return page, boundaries[page]
+
+    async def locate(
+            self,
+            queryset: QuerySet,
+            index_key: str,
+            page_num: int,
+            length: int,
+    ) -> Tuple[Optional[SeekKey], int]:
+        """定位第 page_num 页, 返回 (起点游标键, 剩余偏移行数)
+
+        与目标页之间缺少边界时按 stride 页逐段跳跃, 每段只读取一行键并记录为新边界
+        """
+        page, key = self.nearest(index_key, page_num)
+        while page_num - page >= self._stride:
+            hop = self._stride - page % self._stride
+            boundary = await seek(queryset, key).offset(hop * length - 1).limit(1).values_list("time_weight", "id")
+            if not boundary:
+                break
+            page, key = page + hop, tuple(boundary[0])
+            self.record(index_key, page, key)
+        return key, (page_num - page) * length
+
+
+def row_key(record: Any) -> SeekKey:
+    """记录(模型或 values() 字典行)的游标键"""
+    if isinstance(record, dict):
+        return record["time_weight"], record["id"]
+    return record.time_weight, record.id
+
+
+page_index: PageIndex = PageIndex()
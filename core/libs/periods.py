@@ -0,0 +1,92 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from datetime import datetime, date
+from typing import Any, Dict, Optional, Tuple
+
+# 请求中的时间字符串格式
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+# 按自然周期过滤的参数 -> 取值格式
+PERIOD_FORMATS: Dict[str, str] = {
+    "year": "%Y",
+    "month": "%Y-%m",
+    "day": "%Y-%m-%d",
+}
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    """解析请求中的时间字符串, 无法解析时返回None"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def period_range(period: str, value: str) -> Tuple[datetime, datetime]:
+    """自然周期转半开时间区间 [起点, 下一周期起点)
+
+    :param period: year / month / day
+    :param value: 2022 / 2022-02 / 2022-02-01
+    :return:
+    """
+    start = datetime.strptime(str(value), PERIOD_FORMATS[period])
+    if period == "year":
+        end = datetime(start.year + 1, 1, 1)
+    elif period == "month":
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    else:
+        end = datetime.fromordinal(start.toordinal() + 1)
+    return start, end
+
+
+def month_range(month: str) -> Tuple[datetime, datetime]:
+    """月份转半开时间区间 [月初, 下月初)
+
+    :param month: 2022-02
+    :return:
+    """
+    return period_range("month", month)
+
+
+def pop_period(filters: Dict[str, Any]) -> Optional[Tuple[datetime, datetime]]:
+    """取出过滤条件中的 year/month/day 参数, 转为半开时间区间, 同时存在时取交集
+
+    :param filters: 过滤条件, 会被修改
+    :return: (起点, 终点), 无周期参数时返回None
+    """
+    result = None
+    for period in PERIOD_FORMATS:
+        if period not in filters:
+            continue
+        start, end = period_range(period, filters.pop(period))
+        if result is not None:
+            start, end = max(start, result[0]), min(end, result[1])
+        result = (start, end)
+    return result
+
+
+def narrow_range(
+        start_time: Any,
+        end_time: Any,
+        end_inclusive: bool,
+        period: Tuple[datetime, datetime],
+) -> Tuple[Any, Any, bool]:
+    """时间范围与自然周期取交集
+
+    :return: (开始时间, 结束时间, 是否包含结束时间)
+    """
+    start = parse_time(start_time) if start_time is not None else None
+    if start is None or start < period[0]:
+        start_time = period[0]
+    end = parse_time(end_time) if end_time is not None else None
+    if end is None or end >= period[1]:
+        end_time, end_inclusive = period[1], False
+    return start_time, end_time, end_inclusive
@@ -0,0 +1,78 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sanic.request import Request
+from sanic.response import HTTPResponse, empty
+
+from .response import response_ok
+from .error_code.errorcode import ECEnum
+
+
+class RefDataCache:
+    """下拉栏参考数据(地磅, 单位, 区域, 垃圾来源/类别, 司机, 字典等)的进程内缓存
+
+    各数据包首次请求时加载, 之后直接从内存返回; 相关表在本进程写入后调用 invalidate 使全部数据包失效并递增版本号.
+    多进程部署时其它进程无法感知写入, 由 ttl 兜底
+    """
+
+    __slots__ = ('_ttl', '_boot', '_version', '_expire_at', '_bundles')
+
+    def __init__(self, ttl: Optional[float] = 300) -> None:
+        self._ttl: Optional[float] = ttl
+        # 进程启动时间, 避免重启后版本号重复
+        self._boot: int = int(time.time())
+        self._version: int = 0
+        self._expire_at: Optional[float] = None
+        self._bundles: Dict[str, Any] = {}
+
+    @property
+    def etag(self) -> str:
+        """当前版本号, 用作ETag"""
+        self._check_expired()
+        return '"%d-%d"' % (self._boot, self._version)
+
+    def invalidate(self) -> None:
+        """参考数据已变更, 清空缓存并递增版本号"""
+        self._version += 1
+        self._expire_at = None
+        self._bundles.clear()
+
+    def _check_expired(self) -> None:
+        if self._expire_at is not None and self._expire_at < time.monotonic():
+            self.invalidate()
+
+    async def get(self, name: str, loader: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """获取数据包, 未缓存时调用 loader 加载
+
+        :return: (数据, 对应版本的ETag)
+        """
+        etag = self.etag
+        if name in self._bundles:
+            return self._bundles[name], etag
+        version = self._version
+        data = await loader()
+        # 加载期间发生写入时不缓存旧数据
+        if version == self._version:
+            if self._expire_at is None and self._ttl is not None:
+                self._expire_at = time.monotonic() + self._ttl
+            self._bundles[name] = data
+        return data, etag
+
+
+ref_data: RefDataCache = RefDataCache()
+
+
+async def ref_data_response(request: Request, name: str, loader: Callable[[], Awaitable[Any]]) -> HTTPResponse:
+    """返回缓存的参考数据包, 请求头 If-None-Match 与当前版本一致时返回304"""
+    etag = ref_data.etag
+    if request.headers.get("If-None-Match") == etag:
+        return empty(status=304, headers={"ETag": etag})
+    data, etag = await ref_data.get(name, loader)
+    response = response_ok(data, ECEnum.Success)
+    response.headers["ETag"] = etag
+    return response
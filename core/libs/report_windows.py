@@ -0,0 +1,119 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import copy
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .periods import month_range, parse_time
+from .cache import WriteGeneration
+from .response_cache import filter_watermark
+
+# 报表加载函数: (地磅id, 起点, 终点) -> 统计结果, 时间为半开区间
+WindowLoader = Callable[[int, datetime, datetime], Awaitable[Any]]
+Window = Tuple[datetime, datetime]
+
+
+def standard_windows(today: Optional[date] = None) -> Dict[str, Window]:
+    """标准时间窗口: 今日, 本月, 上月, 均为半开区间"""
+    today = today or date.today()
+    day_start = datetime(today.year, today.month, today.day)
+    this_month = month_range(today.strftime("%Y-%m"))
+    last_month = month_range((this_month[0] - timedelta(days=1)).strftime("%Y-%m"))
+    return {
+        "today": (day_start, day_start + timedelta(days=1)),
+        "this_month": this_month,
+        "last_month": last_month,
+    }
+
+
+def inclusive_window(start_time: Any, end_time: Any) -> Optional[Window]:
+    """请求的闭区间 [开始时间, 结束时间] 转半开区间, 结束时间须为某日 23:59:59, 否则返回None"""
+    start = parse_time(start_time)
+    end = parse_time(end_time)
+    if start is None or end is None or (end.hour, end.minute, end.second) != (23, 59, 59):
+        return None
+    return start, end.replace(microsecond=0) + timedelta(seconds=1)
+
+
+def month_window(month: Any) -> Optional[Window]:
+    """月份转半开区间, 无法解析时返回None"""
+    try:
+        return month_range(month)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReportWindows:
+    """按地磅预计算标准时间窗口(今日, 本月, 上月)的报表统计结果
+
+    各报表通过 register 登记加载函数, ReportWindowListener 定时刷新全部地磅的标准窗口;
+    结果连同计算前的数据水位保存在内存中, 读取时数据水位未变化才直接返回, 否则重新计算并更新.
+    数据水位检查后 check_interval 秒内且本进程没有修改记录(WriteGeneration 未变化)时不再查询水位,
+    其它进程或外部新增的记录最多延迟 check_interval 秒可见
+    """
+
+    __slots__ = ('_loaders', '_entries', 'check_interval')
+
+    def __init__(self, check_interval: float = 10) -> None:
+        self._loaders: Dict[str, WindowLoader] = {}
+        # (报表, 地磅id, 起点, 终点) -> [数据水位, 检查时间, 结果]
+        self._entries: Dict[Tuple[str, int, datetime, datetime], List[Any]] = {}
+        self.check_interval: float = check_interval
+
+    def register(self, report: str, loader: WindowLoader) -> None:
+        self._loaders[report] = loader
+
+    @staticmethod
+    def is_standard(window: Window) -> bool:
+        return window in standard_windows().values()
+
+    async def get(self, report: str, pound_id: Any, window: Optional[Window]) -> Optional[Any]:
+        """读取标准窗口的统计结果(副本), 非标准窗口或报表未登记时返回None"""
+        if window is None or report not in self._loaders or not self.is_standard(window):
+            return None
+        try:
+            pound_id = int(pound_id)
+        except (TypeError, ValueError):
+            return None
+        return copy.deepcopy(await self._load(report, pound_id, window))
+
+    async def _load(self, report: str, pound_id: int, window: Window) -> Any:
+        start, end = window
+        key = (report, pound_id, start, end)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        # 数据水位的最后一项为修改计数, 本进程修改记录后立即重新检查
+        if entry is not None and entry[0][-1] == WriteGeneration.value and now - entry[1] < self.check_interval:
+            return entry[2]
+        watermark = await filter_watermark(dict(pound_id=pound_id, time_weight__gte=start, time_weight__lt=end))
+        if entry is not None and entry[0] == watermark:
+            entry[1] = now
+            return entry[2]
+        result = await self._loaders[report](pound_id, start, end)
+        self._entries[key] = [watermark, now, result]
+        return result
+
+    async def refresh(self, pound_ids: Iterable[int], today: Optional[date] = None) -> int:
+        """刷新全部地磅的标准窗口, 数据未变化的窗口不重新计算; 清理已不是标准窗口的结果
+
+        :return: 窗口数
+        """
+        windows = list(standard_windows(today).values())
+        pound_ids = list(pound_ids)
+        for key in list(self._entries):
+            if (key[2], key[3]) not in windows or key[1] not in pound_ids:
+                del self._entries[key]
+        count = 0
+        for report in list(self._loaders):
+            for pound_id in pound_ids:
+                for window in windows:
+                    await self._load(report, pound_id, window)
+                    count += 1
+        return count
+
+
+report_windows: ReportWindows = ReportWindows()
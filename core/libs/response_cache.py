@@ -0,0 +1,143 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from functools import wraps
+from json import loads
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from sanic.request import Request
+from sanic.response import HTTPResponse, empty, raw
+from tortoise.functions import Max
+
+from core.models import WeightRecord
+from .cache import TTLCache, WriteGeneration, make_key
+from .periods import pop_period
+from .error_code.errorcode import ECEnum
+
+
+async def data_watermark(body: Dict[str, Any]) -> Tuple[Any, ...]:
+    """请求时间范围内的数据水位: (最大id, 最大称重时间, 修改计数)
+
+    时间范围取自 start_time/end_time 或 year/month/day, 均未提供时为全表
+    """
+    body = dict(body or {})
+    filters: Dict[str, Any] = {}
+    if body.get("start_time"):
+        filters["time_weight__gte"] = body["start_time"]
+    if body.get("end_time"):
+        filters["time_weight__lte"] = body["end_time"]
+    try:
+        period = pop_period({k: v for k, v in body.items() if v})
+    except ValueError:
+        period = None
+    if period is not None:
+        filters["time_weight__gte"], filters["time_weight__lt"] = period
+    return await filter_watermark(filters)
+
+
+async def filter_watermark(filters: Dict[str, Any]) -> Tuple[Any, ...]:
+    """满足过滤条件的称重记录的数据水位: (最大id, 最大称重时间, 修改计数), 过滤条件不应跨关联表"""
+    row = await WeightRecord.filter(**filters).annotate(
+        max_id=Max("id"),
+        max_time_weight=Max("time_weight"),
+    ).first().values("max_id", "max_time_weight")
+    return row["max_id"], row["max_time_weight"], WriteGeneration.value
+
+
+def cached_report(maxsize: int = 256, ttl: float = 300) -> Callable:
+    """统计报表响应缓存
+
+    以 路径 + 查询参数 + 请求体 + 数据水位 为键缓存序列化后的成功响应, 命中时直接返回缓存内容;
+    键同时作为ETag, 请求头 If-None-Match 一致时返回304. 失败响应不缓存.
+    多进程部署时修改计数无法跨进程同步, 由 ttl 兜底
+    """
+    def decorator(handler: Callable) -> Callable:
+        cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        @wraps(handler)
+        async def wrapper(view, request: Request, *args, **kwargs) -> HTTPResponse:
+            body = request.json or {}
+            watermark = await data_watermark(body)
+            etag = '"%s"' % make_key(request.path, request.query_string, body, watermark)
+            if request.headers.get("If-None-Match") == etag:
+                return empty(status=304, headers={"ETag": etag})
+            cached = cache.get(etag)
+            if cached is None:
+                response = await handler(view, request, *args, **kwargs)
+                if response.status != 200 or loads(response.body).get("code") != ECEnum.Success.code:
+                    return response
+                cached = (response.body, response.content_type)
+                cache.set(etag, cached)
+            return raw(cached[0], content_type=cached[1], headers={"ETag": etag})
+
+        return wrapper
+
+    return decorator
+
+
+# 合并后重新构造响应时不复制的响应头, 由 raw 重新生成
+_SKIP_HEADERS = ("content-length", "content-type")
+
+
+async def _capture(response: Awaitable[HTTPResponse]) -> Tuple[bytes, int, str, Dict[str, str]]:
+    """执行处理函数, 取出可共享的响应内容"""
+    response = await response
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in _SKIP_HEADERS}
+    return response.body, response.status, response.content_type, headers
+
+
+# 执行中的合并请求: 键 -> 执行结果, 键含请求路径, 各处理函数共用
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def _flight_key(request: Request) -> str:
+    return make_key(request.path, request.query_string, request.json or {}, request.headers.get("If-None-Match"))
+
+
+def join_in_flight(request: Request) -> bool:
+    """相同请求正在由 single_flight 执行时记下该次执行, 之后直接等待其结果
+
+    供准入控制在分配槽位前调用: 返回True的请求不会再次执行, 无需占用槽位
+    """
+    if not _in_flight:
+        return False
+    future = _in_flight.get(_flight_key(request))
+    if future is None:
+        return False
+    request.ctx.in_flight = future
+    return True
+
+
+def single_flight() -> Callable:
+    """相同请求合并执行
+
+    以 路径 + 查询参数 + 请求体(键排序) + If-None-Match 为键, 同一键的请求在执行中时, 后到的请求等待同一次执行,
+    各自得到相同的响应内容. 只合并同时在执行的请求, 不缓存结果; 与 cached_report 同用时放在其外层,
+    保证后到的请求拿到的是首个请求按其数据水位得到的响应. 发起执行的请求断开时执行不中断.
+    准入控制经 join_in_flight 放行的请求等待放行时记下的执行, 即使该次执行已结束
+    """
+    def decorator(handler: Callable) -> Callable:
+        @wraps(handler)
+        async def wrapper(view, request: Request, *args, **kwargs) -> HTTPResponse:
+            future = getattr(request.ctx, "in_flight", None)
+            if future is None:
+                key = _flight_key(request)
+                future = _in_flight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(_capture(handler(view, request, *args, **kwargs)))
+                _in_flight[key] = future
+
+                def done(_: asyncio.Future) -> None:
+                    if _in_flight.get(key) is future:
+                        del _in_flight[key]
+
+                future.add_done_callback(done)
+            body, status, content_type, headers = await asyncio.shield(future)
+            return raw(body, status=status, content_type=content_type, headers=headers)
+
+        return wrapper
+
+    return decorator
@@ -3,8 +3,16 @@ Author: rensongqi(）
 Email: rensongqi1024@gmail.com
 """
 # coding: utf-8
-from pypika import CustomFunction
-from tortoise.expressions import F, Function
+from typing import Any, Dict, List, Optional, Type
+
+from pypika import Case, CustomFunction, functions as fn
+from pypika.terms import Criterion, Term, ValueWrapper
+from tortoise import Model
+from tortoise.expressions import Aggregate, Function, Table
+from tortoise.queryset import QuerySet
+
+# 汇总查询的常量分组键
+TOTAL = "total"
 
 class TruncDateTime(Function):
     database_func = CustomFunction("DATE_FORMAT", ["name", "dt_format"])
@@ -12,3 +20,110 @@ class TruncDateTime(Function):
 # sql = Task.all().annotate(date=TruncMonth('created_at', '%Y-%m-%d')).values('date').sql()
 # print(sql)
 # SELECT DATE_FORMAT(`created_at`,'%Y-%m-%d') `date` FROM `task`
+
+
+# 条件支持的查询后缀, 语义同 Tortoise 过滤条件(not/not_in 包含空值)
+CONDITION_LOOKUPS = ("not", "in", "not_in", "isnull")
+
+
+class SumIf(Aggregate):
+    """条件求和 SUM(CASE WHEN 条件 THEN 字段 ELSE 0 END), 无条件时即 SUM(字段)
+
+    条件写法同过滤条件 {字段[__后缀]: 值}, 多个条件同时满足, 后缀见 CONDITION_LOOKUPS;
+    条件字段可跨关联表, 如 {"vehicle_id__dept_id_id__in": [349]}
+    """
+
+    database_func = fn.Sum
+    populate_field_object = True
+    # 不满足条件时的取值, None表示不写 ELSE
+    otherwise: Any = 0
+
+    def __init__(self, field: str, when: Optional[Dict[str, Any]] = None) -> None:
+        super().__init__(field)
+        self.when: Dict[str, Any] = when or {}
+
+    def _resolve(self, model: Type[Model], table: Table, field: str, joins: List) -> Term:
+        resolved = Function._resolve_field_for_model(self, model, table, field)
+        joins.extend(resolved["joins"])
+        return resolved["field"]
+
+    def _summand(self, model: Type[Model], table: Table, joins: List) -> Term:
+        """被求和的表达式"""
+        return self._resolve(model, table, self.field, joins)
+
+    def _criterion(self, model: Type[Model], table: Table, joins: List) -> Criterion:
+        criteria = []
+        # 条件字段不决定结果类型
+        populate, self.populate_field_object = self.populate_field_object, False
+        for key, value in self.when.items():
+            field, _, lookup = key.rpartition("__")
+            if lookup not in CONDITION_LOOKUPS:
+                field, lookup = key, ""
+            term = self._resolve(model, table, field, joins)
+            if lookup == "in":
+                criteria.append(term.isin(list(value)))
+            elif lookup == "not_in":
+                criteria.append(term.notin(list(value)) | term.isnull())
+            elif lookup == "not":
+                criteria.append((term != value) | term.isnull())
+            elif lookup == "isnull":
+                criteria.append(term.isnull() if value else term.notnull())
+            else:
+                criteria.append(term == value)
+        self.populate_field_object = populate
+        return Criterion.all(criteria)
+
+    def resolve(self, model: Type[Model], table: Table) -> dict:
+        joins: List = []
+        term = self._summand(model, table, joins)
+        if self.when:
+            case = Case().when(self._criterion(model, table, joins), term)
+            term = case.else_(self.otherwise) if self.otherwise is not None else case
+        return {"joins": joins, "field": self.database_func(term)}
+
+
+class CountIf(SumIf):
+    """条件计数 COUNT(CASE WHEN 条件 THEN 字段 END), 条件格式同 SumIf"""
+
+    database_func = fn.Count
+    populate_field_object = False
+    otherwise = None
+
+
+class NetWeightSum(SumIf):
+    """净重求和 SUM(毛重 - IFNULL(皮重, 0)), 可带条件, 条件格式同 SumIf"""
+
+    def __init__(
+            self,
+            gross: str = "weight_gross",
+            tare: str = "weight_tare",
+            when: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        super().__init__(gross, when)
+        self.tare: str = tare
+
+    def _summand(self, model: Type[Model], table: Table, joins: List) -> Term:
+        gross = super()._summand(model, table, joins)
+        field_object = self.field_object
+        tare = self._resolve(model, table, self.tare, joins)
+        # 结果类型取毛重字段
+        self.field_object = field_object
+        return gross - fn.IfNull(tare, 0)
+
+
+async def aggregate_totals(queryset: QuerySet, *fields: str) -> Optional[Dict[str, Any]]:
+    """不分组的汇总查询, 返回单行汇总结果, 无匹配记录时返回None
+
+    过滤条件跨关联表时, Tortoise 会给聚合查询自动加上按主表全部字段的分组, annotate().first() 只能得到其中一条记录的值;
+    这里改为按常量分组
+
+    :param queryset: 已 annotate 聚合字段的查询
+    :param fields: 返回字段
+    :return:
+    """
+    rows = await queryset.annotate(**{TOTAL: ValueWrapper(TOTAL)}).group_by(TOTAL).values(TOTAL, *fields)
+    if not rows:
+        return None
+    row = rows[0]
+    del row[TOTAL]
+    return row
@@ -0,0 +1,334 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from core.models import WeightRecord, GarbageSource, Pound, Department, Region, GarbageType, Driver
+from core.libs.aggregation import MEASURES, reduce_groups
+from core.libs.periods import parse_time
+from core.libs.logger import LoggerProxy
+
+try:
+    import numpy as np
+except ImportError:  # 列式缓存为可选功能
+    np = None
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+# 维度 -> 可用于过滤/分组的称重记录字段
+DIMENSIONS: Dict[str, Tuple[str, ...]] = {
+    "pound": ("pound_id", "pound_id_id"),
+    "dept": ("vehicle_id__dept_id", "vehicle_id__dept_id_id"),
+    "region": ("garbage_source_id__region_id", "garbage_source_id__region_id_id"),
+    "source": ("garbage_source_id", "garbage_source_id_id"),
+    "type": ("garbage_type_id", "garbage_type_id_id"),
+    "driver": ("driver_id", "driver_id_id"),
+    "info": ("info",),
+}
+FIELD_DIMENSIONS: Dict[str, str] = {field: dim for dim, fields in DIMENSIONS.items() for field in fields}
+# 按名称分组的字段 -> (维度, 模型, 名称字段)
+NAME_FIELDS: Dict[str, Tuple[str, Any, str]] = {
+    "pound_id__comp_name": ("pound", Pound, "comp_name"),
+    "vehicle_id__dept_id__department_name": ("dept", Department, "department_name"),
+    "garbage_source_id__region_id__region_name": ("region", Region, "region_name"),
+    "garbage_source_id__source_name": ("source", GarbageSource, "source_name"),
+    "garbage_type_id__garbage_type_name": ("type", GarbageType, "garbage_type_name"),
+    "driver_id__driver_name": ("driver", Driver, "driver_name"),
+}
+# 过滤条件允许携带的查询后缀
+CUBE_LOOKUPS = ("not", "in", "not_in", "isnull", "not_isnull")
+# 日期分组支持的格式符 -> 时间粒度, 按从粗到细排列
+DATE_UNITS: Tuple[Tuple[str, str], ...] = (("%Y", "Y"), ("%m", "M"), ("%d", "D"), ("%H", "h"))
+# 重量定点数放大倍数(保留两位小数)
+SCALE = 100
+# 加载时每批读取的记录数
+LOAD_BATCH_SIZE = 50000
+
+_FETCH_FIELDS = (
+    "id", "time_weight", "pound_id_id", "vehicle_id__dept_id_id", "garbage_source_id_id",
+    "garbage_type_id_id", "driver_id_id", "info", "weight_gross", "weight_tare",
+)
+
+
+class _Dictionary:
+    """维度字典编码, 原值 -> 连续整数编码(含None)"""
+
+    __slots__ = ('values', 'codes')
+
+    def __init__(self) -> None:
+        self.values: List[Any] = []
+        self.codes: Dict[Any, int] = {}
+
+    def encode(self, value: Any) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: Any) -> int:
+        """原值的编码, 不存在时为-1(不匹配任何记录)"""
+        return self.codes.get(value, -1)
+
+
+def _date_unit(date_format: str) -> Optional[str]:
+    """日期格式对应的最细时间粒度, 含不支持的格式符时返回None"""
+    rest = date_format
+    unit = None
+    for spec, spec_unit in DATE_UNITS:
+        if spec in rest:
+            unit = spec_unit
+            rest = rest.replace(spec, "")
+    if unit is None or "%" in rest:
+        return None
+    return unit
+
+
+def _fixed(value: Any) -> int:
+    return 0 if value is None else int(round(value * SCALE))
+
+
+def _decimal(value: float) -> Decimal:
+    return Decimal(int(round(value))).scaleb(-2)
+
+
+class WeightCube:
+    """称重记录的进程内列式缓存
+
+    维度字典编码后存为整型数组, 重量存为定点整数; 过滤使用向量化掩码, 分组汇总使用 bincount.
+    服务启动时加载, 之后按 id 增量追加新记录; 已有记录被修改或删除, 或车辆所属单位、垃圾来源所属区域变化时标记失效,
+    重新加载前不参与统计
+    """
+
+    __slots__ = ('_size', '_columns', '_dicts', '_names', '_source_regions', '_max_id', '_start', '_lock',
+                 'ready', 'stale')
+
+    def __init__(self) -> None:
+        self._size: int = 0
+        self._columns: Dict[str, Any] = {}
+        self._dicts: Dict[str, _Dictionary] = {}
+        self._names: Dict[str, Dict[Any, Any]] = {}
+        self._source_regions: Dict[int, Optional[int]] = {}
+        self._max_id: int = 0
+        # 加载的起始时间, 更早的时间段不由缓存统计; None表示全部
+        self._start: Optional[datetime] = None
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self.ready: bool = False
+        self.stale: bool = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def mark_stale(self) -> None:
+        """已有记录被修改或删除, 或维度映射变化, 等待重新加载"""
+        self.stale = True
+
+    def _reset(self, capacity: int = 1024) -> None:
+        self._size = 0
+        self._max_id = 0
+        self._dicts = {dim: _Dictionary() for dim in DIMENSIONS}
+        self._columns = {
+            "id": np.zeros(capacity, dtype=np.int64),
+            "time": np.zeros(capacity, dtype="datetime64[s]"),
+            "gross": np.zeros(capacity, dtype=np.int64),
+            "tare": np.zeros(capacity, dtype=np.int64),
+        }
+        for dim in DIMENSIONS:
+            self._columns[dim] = np.zeros(capacity, dtype=np.int32)
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._columns["id"])
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def _append(self, rows: Sequence[Tuple]) -> None:
+        if not rows:
+            return
+        start, end = self._size, self._size + len(rows)
+        self._reserve(end)
+        columns, dicts = self._columns, self._dicts
+        record_id, time_weight, pound, dept, source, garbage_type, driver, info, gross, tare = zip(*rows)
+        columns["id"][start:end] = record_id
+        columns["time"][start:end] = np.array([t.replace(tzinfo=None) for t in time_weight], dtype="datetime64[s]")
+        columns["gross"][start:end] = [_fixed(v) for v in gross]
+        columns["tare"][start:end] = [_fixed(v) for v in tare]
+        region = [self._source_regions.get(s) for s in source]
+        for dim, values in (("pound", pound), ("dept", dept), ("region", region), ("source", source),
+                            ("type", garbage_type), ("driver", driver), ("info", info)):
+            columns[dim][start:end] = [dicts[dim].encode(v) for v in values]
+        self._size = end
+        self._max_id = max(self._max_id, max(record_id))
+
+    async def load_reference(self) -> None:
+        """加载垃圾来源所属区域与各维度名称"""
+        self._source_regions = dict(await GarbageSource.all().values_list("id", "region_id_id"))
+        for field, (_, model, name_field) in NAME_FIELDS.items():
+            self._names[field] = dict(await model.all().values_list("id", name_field))
+
+    async def load(self, days: int = 0) -> None:
+        """全量加载
+
+        :param days: 加载最近多少天的记录, 0表示全部
+        """
+        async with self._lock:
+            self.ready = False
+            self.stale = False
+            self._reset()
+            self._start = None
+            if days:
+                today = date.today()
+                self._start = datetime(today.year, today.month, today.day) - timedelta(days=days)
+            await self.load_reference()
+            query = WeightRecord.all()
+            if self._start is not None:
+                query = query.filter(time_weight__gte=self._start)
+            last_id = 0
+            while True:
+                rows = await query.filter(id__gt=last_id).order_by("id").limit(LOAD_BATCH_SIZE) \
+                    .values_list(*_FETCH_FIELDS)
+                self._append(rows)
+                if len(rows) < LOAD_BATCH_SIZE:
+                    break
+                last_id = rows[-1][0]
+            self.ready = True
+            logger.info('weight cube loaded: %d records' % self._size)
+
+    async def catch_up(self) -> int:
+        """追加 id 大于已加载最大 id 的新记录
+
+        :return: 追加条数
+        """
+        if not self.ready:
+            return 0
+        async with self._lock:
+            rows = await WeightRecord.filter(id__gt=self._max_id).order_by("id").values_list(*_FETCH_FIELDS)
+            self._append(rows)
+            return len(rows)
+
+    def _filter_mask(self, filters: Dict[str, Any], size: int) -> Optional[Any]:
+        mask = np.ones(size, dtype=bool)
+        for key, value in filters.items():
+            field, lookup = key, ""
+            if field not in FIELD_DIMENSIONS:
+                field, _, lookup = key.rpartition("__")
+                if field not in FIELD_DIMENSIONS or lookup not in CUBE_LOOKUPS:
+                    return None
+            dim = FIELD_DIMENSIONS[field]
+            codes = self._columns[dim][:size]
+            dictionary = self._dicts[dim]
+            null_code = dictionary.lookup(None)
+            # 与 Tortoise 一致: not / not_in 同时包含空值
+            if lookup == "":
+                mask &= codes == dictionary.lookup(value)
+            elif lookup == "not":
+                mask &= codes != dictionary.lookup(value)
+            elif lookup in ("in", "not_in"):
+                matched = np.isin(codes, [dictionary.lookup(v) for v in value])
+                mask &= matched if lookup == "in" else ~matched
+            elif lookup in ("isnull", "not_isnull"):
+                is_null = codes == null_code
+                mask &= is_null if bool(value) == (lookup == "isnull") else ~is_null
+        return mask
+
+    async def aggregate(
+            self,
+            filters: Dict[str, Any],
+            start_time: Any = None,
+            end_time: Any = None,
+            group_by: Sequence[str] = (),
+            date_format: str = "%Y-%m-%d",
+            end_inclusive: bool = True,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """分组统计, 结果格式同 aggregate_weight_records; 条件或分组无法由缓存计算时返回None"""
+        if not self.ready or self.stale:
+            return None
+        start = parse_time(start_time) if start_time is not None else None
+        end = parse_time(end_time) if end_time is not None else None
+        if (start_time is not None and start is None) or (end_time is not None and end is None):
+            return None
+        if self._start is not None and (start is None or start < self._start):
+            return None
+        unit = _date_unit(date_format) if "date" in group_by else None
+        if "date" in group_by and unit is None:
+            return None
+        if any(g != "date" and g not in FIELD_DIMENSIONS and g not in NAME_FIELDS for g in group_by):
+            return None
+
+        await self.catch_up()
+        size = self._size
+        mask = self._filter_mask(filters, size)
+        if mask is None:
+            return None
+        times = self._columns["time"][:size]
+        if start is not None:
+            mask &= times >= np.datetime64(start, "s")
+        if end is not None:
+            mask &= (times <= np.datetime64(end, "s")) if end_inclusive else (times < np.datetime64(end, "s"))
+
+        gross = self._columns["gross"][:size][mask]
+        tare = self._columns["tare"][:size][mask]
+        if not group_by:
+            if not len(gross):
+                return []
+            return [dict(
+                vehicle_num=int(len(gross)),
+                weight_gross_sum=_decimal(gross.sum()),
+                weight_tare_sum=_decimal(tare.sum()),
+                weight_net_sum=_decimal(gross.sum() - tare.sum()),
+            )]
+
+        # 各分组列组合为单一下标, 再按下标 bincount
+        keys = []
+        for g in group_by:
+            if g == "date":
+                keys.append(times[mask].astype("datetime64[%s]" % unit).astype(np.int64))
+            else:
+                dim = FIELD_DIMENSIONS.get(g) or NAME_FIELDS[g][0]
+                keys.append(self._columns[dim][:size][mask].astype(np.int64))
+        index = np.zeros(len(gross), dtype=np.int64)
+        for key in keys:
+            uniques, inverse = np.unique(key, return_inverse=True)
+            index = index * len(uniques) + inverse
+        groups, first, inverse = np.unique(index, return_index=True, return_inverse=True)
+        counts = np.bincount(inverse)
+        gross_sums = np.bincount(inverse, weights=gross)
+        tare_sums = np.bincount(inverse, weights=tare)
+
+        rows = []
+        for i in range(len(groups)):
+            row: Dict[str, Any] = {}
+            for g, key in zip(group_by, keys):
+                value = key[first[i]]
+                if g == "date":
+                    bucket = np.datetime64(int(value), unit).astype("datetime64[s]").item()
+                    row[g] = bucket.strftime(date_format)
+                elif g in NAME_FIELDS:
+                    raw = self._dicts[NAME_FIELDS[g][0]].values[value]
+                    row[g] = self._names[g].get(raw)
+                else:
+                    row[g] = self._dicts[FIELD_DIMENSIONS[g]].values[value]
+            row["vehicle_num"] = int(counts[i])
+            row["weight_gross_sum"] = _decimal(gross_sums[i])
+            row["weight_tare_sum"] = _decimal(tare_sums[i])
+            row["weight_net_sum"] = _decimal(gross_sums[i] - tare_sums[i])
+            rows.append(row)
+        # 不同编码可能对应同一名称或同一日期标签
+        return reduce_groups(rows, group_by, MEASURES)
+
+
+weight_cube: WeightCube = WeightCube()
@@ -0,0 +1,752 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.functions import Count, Sum
+from tortoise.transactions import in_transaction
+
+from core.models import WeightRecord, WeightRecordDaily, WeightRecordHourly, GarbageSource
+from core.libs.sql_udfs import CountIf, NetWeightSum, SumIf, TruncDateTime, aggregate_totals
+from core.libs.aggregation import MEASURES, reduce_groups, split_grouping_sets, union_group_by
+from core.libs.periods import narrow_range, parse_time, pop_period
+from core.libs.concurrency import gather_queries
+from core.libs.weight_cube import weight_cube
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+# 称重记录字段 -> 日汇总表字段, 按最长前缀匹配. 外键带查询后缀时需使用 _id 字段
+ROLLUP_FIELDS: Dict[str, str] = {
+    "pound_id": "pound_id",
+    "pound_id_id": "pound_id_id",
+    "vehicle_id__dept_id": "dept_id",
+    "vehicle_id__dept_id_id": "dept_id_id",
+    "garbage_source_id__region_id": "region_id",
+    "garbage_source_id__region_id_id": "region_id_id",
+    "garbage_source_id": "garbage_source_id",
+    "garbage_source_id_id": "garbage_source_id_id",
+    "garbage_type_id": "garbage_type_id",
+    "garbage_type_id_id": "garbage_type_id_id",
+    "info": "info",
+}
+# 过滤条件允许携带的查询后缀
+ROLLUP_LOOKUPS = ("not", "in", "not_in", "isnull", "not_isnull", "gt", "gte", "lt", "lte")
+# 日汇总表无法表达的时间格式(小时及以下粒度)
+SUB_DAY_FORMATS = ("%H", "%h", "%I", "%i", "%k", "%l", "%p", "%r", "%S", "%s", "%T", "%f")
+
+
+class RollupState:
+    """日汇总表状态, sealed_until 及之前的日期已汇总完毕
+
+    rebuilding 为正在整日重建的日期, 重建期间提交的写入记入 dirty, 重建结束前据此重来;
+    stale 为维度映射修改后等待后台整日重建的日期, 重建完成前不从日汇总表读取, 加入后通过 wakeup 唤醒汇总任务
+    """
+
+    sealed_until: Optional[date] = None
+    rebuilding: Set[date] = set()
+    dirty: Set[date] = set()
+    stale: Set[date] = set()
+    wakeup: asyncio.Event = asyncio.Event()
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def _translate(key: str, lookups: Optional[Sequence[str]] = None) -> Optional[str]:
+    """称重记录字段转日汇总表字段, 无对应维度时返回None
+
+    :param key: 过滤或分组字段, 如 vehicle_id__dept_id__not
+    :param lookups: 允许的后缀, None时允许任意关联字段
+    :return:
+    """
+    for raw in sorted(ROLLUP_FIELDS, key=len, reverse=True):
+        if key == raw:
+            return ROLLUP_FIELDS[raw]
+        if key.startswith(raw + "__"):
+            rest = key[len(raw) + 2:]
+            if lookups is not None and rest not in lookups:
+                return None
+            return ROLLUP_FIELDS[raw] + "__" + rest
+    return None
+
+
+def translate_filters(filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """过滤条件转日汇总表过滤条件, 含未汇总维度时返回None"""
+    rollup_filters = {}
+    for key, value in filters.items():
+        rollup_key = _translate(key, ROLLUP_LOOKUPS)
+        if rollup_key is None:
+            return None
+        rollup_filters[rollup_key] = value
+    return rollup_filters
+
+
+def split_measures(splits: Optional[Dict[str, Dict[str, Any]]]) -> Tuple[str, ...]:
+    """条件汇总指标名: 每个条件对应 {名称}_vehicle_num, {名称}_weight_gross_sum 等"""
+    return tuple("%s_%s" % (name, measure) for name in (splits or {}) for measure in MEASURES)
+
+
+def _split_annotations(splits: Dict[str, Dict[str, Any]], rollup: bool) -> Dict[str, Any]:
+    """条件汇总的聚合表达式, rollup 表示统计日汇总表"""
+    annotations = {}
+    for name, when in splits.items():
+        annotations["%s_vehicle_num" % name] = SumIf("record_num", when) if rollup else CountIf("id_center", when)
+        annotations["%s_weight_gross_sum" % name] = SumIf("weight_gross", when)
+        annotations["%s_weight_tare_sum" % name] = SumIf("weight_tare", when)
+        annotations["%s_weight_net_sum" % name] = NetWeightSum(when=when)
+    return annotations
+
+
+def translate_group_by(group_by: Sequence[str]) -> Optional[List[str]]:
+    """分组字段转日汇总表分组字段, 含未汇总维度时返回None"""
+    rollup_group_by = []
+    for key in group_by:
+        if key == "date":
+            rollup_group_by.append(key)
+            continue
+        rollup_key = _translate(key)
+        if rollup_key is None:
+            return None
+        rollup_group_by.append(rollup_key)
+    return rollup_group_by
+
+
+async def _aggregate_raw(
+        filters: Dict[str, Any],
+        time_filters: Dict[str, Any],
+        group_by: Sequence[str],
+        date_format: str,
+        splits: Dict[str, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """直接从称重记录表统计"""
+    query = WeightRecord.filter(**filters, **time_filters)
+    if "date" in group_by:
+        query = query.annotate(date=TruncDateTime("time_weight", date_format))
+    query = query.annotate(
+        vehicle_num=Count("id_center"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+        weight_net_sum=NetWeightSum(),
+        **_split_annotations(splits, False),
+    )
+    measures = MEASURES + split_measures(splits)
+    if not group_by:
+        totals = await aggregate_totals(query, *measures)
+        return [totals] if totals is not None else []
+    return await query.group_by(*group_by).values(*group_by, *measures)
+
+
+async def _aggregate_rollup(
+        rollup_filters: Dict[str, Any],
+        first_day: Optional[date],
+        last_day: date,
+        group_by: Sequence[str],
+        rollup_group_by: Sequence[str],
+        date_format: str,
+        rollup_splits: Dict[str, Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """从日汇总表统计, 分组字段还原为称重记录字段名"""
+    query = WeightRecordDaily.filter(**rollup_filters, day__lte=last_day)
+    if first_day is not None:
+        query = query.filter(day__gte=first_day)
+    if "date" in group_by:
+        query = query.annotate(date=TruncDateTime("day", date_format))
+    query = query.annotate(
+        vehicle_num=Sum("record_num"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+        weight_net_sum=NetWeightSum(),
+        **_split_annotations(rollup_splits, True),
+    )
+    measures = MEASURES + split_measures(rollup_splits)
+    if rollup_group_by:
+        rows = await query.group_by(*rollup_group_by).values(*rollup_group_by, *measures)
+    else:
+        totals = await aggregate_totals(query, *measures)
+        rows = [totals] if totals is not None else []
+    results = []
+    for row in rows:
+        result = {key: row[rollup_key] for key, rollup_key in zip(group_by, rollup_group_by)}
+        for measure in measures:
+            result[measure] = row[measure]
+        result["vehicle_num"] = int(row["vehicle_num"] or 0)
+        results.append(result)
+    return results
+
+
+def _rollup_span(
+        filters: Dict[str, Any],
+        start_time: Any,
+        end_time: Any,
+        group_by: Sequence[str],
+        date_format: str,
+        splits: Dict[str, Dict[str, Any]],
+) -> Optional[Tuple[Optional[date], date]]:
+    """日汇总表可覆盖的完整自然日 (first_day, last_day), first_day 为None表示不限; 无法使用日汇总表时返回None
+
+    :param filters: 已去除 year/month/day 的过滤条件
+    """
+    start = parse_time(start_time) if start_time is not None else None
+    end = parse_time(end_time) if end_time is not None else None
+    usable = (
+        RollupState.sealed_until is not None
+        and translate_filters(filters) is not None
+        and translate_group_by(group_by) is not None
+        and all(translate_filters(when) is not None for when in splits.values())
+        and (start_time is None or start is not None)
+        and (end_time is None or end is not None)
+        and not ("date" in group_by and any(f in date_format for f in SUB_DAY_FORMATS))
+    )
+    if not usable:
+        return None
+    first_day = None
+    if start is not None:
+        first_day = start.date() if start == _day_start(start.date()) else start.date() + timedelta(days=1)
+    last_day = RollupState.sealed_until
+    if RollupState.stale:
+        # 等待重建的日期及之后读取称重记录表
+        last_day = min(last_day, min(RollupState.stale) - timedelta(days=1))
+    if end is not None:
+        last_day = min(last_day, end.date() - timedelta(days=1))
+    if first_day is not None and first_day > last_day:
+        return None
+    return first_day, last_day
+
+
+def rollup_covers(
+        filters: Dict[str, Any],
+        start_time: Any = None,
+        end_time: Any = None,
+        group_by: Sequence[str] = (),
+        date_format: str = "%Y-%m-%d",
+) -> bool:
+    """aggregate_weight_records 能否从日汇总表读取该统计的完整自然日, 此时只有首尾非整日的部分读取称重记录表"""
+    filters = dict(filters)
+    period = pop_period(filters)
+    end_inclusive = True
+    if period is not None:
+        start_time, end_time, end_inclusive = narrow_range(start_time, end_time, end_inclusive, period)
+    return _rollup_span(filters, start_time, end_time, tuple(group_by), date_format, {}) is not None
+
+
+async def aggregate_weight_records(
+        filters: Dict[str, Any],
+        start_time: Any = None,
+        end_time: Any = None,
+        group_by: Sequence[str] = (),
+        date_format: str = "%Y-%m-%d",
+        end_inclusive: bool = True,
+        splits: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """称重记录分组统计(车数, 毛重, 皮重, 净重)
+
+    启用列式缓存且条件可由缓存计算时直接从内存统计; 否则已汇总的完整自然日从日汇总表读取,
+    其余时间段(未汇总的当日, 非整日的首尾)读取称重记录表
+
+    :param filters: 称重记录过滤条件, 可含 year/month/day, 改写为称重时间的半开区间
+    :param start_time: 开始时间, None表示不限
+    :param end_time: 结束时间, None表示不限
+    :param group_by: 分组字段, date 表示按 date_format 格式化的称重时间
+    :param date_format: 日期分组格式, DATE_FORMAT 语法
+    :param end_inclusive: 是否包含结束时间
+    :param splits: 条件汇总 {名称: 条件}, 条件格式同 SumIf, 如 {"sanitation": {"vehicle_id__dept_id_id__in": [349]}},
+        结果增加各指标的条件汇总 {名称}_vehicle_num, {名称}_weight_gross_sum 等
+    :return: [{分组字段..., vehicle_num, weight_gross_sum, weight_tare_sum, weight_net_sum}]
+    """
+    group_by = tuple(group_by)
+    filters = dict(filters)
+    splits = splits or {}
+    period = pop_period(filters)
+    if period is not None:
+        start_time, end_time, end_inclusive = narrow_range(start_time, end_time, end_inclusive, period)
+    # 已加载列式缓存时优先从内存统计
+    if weight_cube.ready and not splits:
+        rows = await weight_cube.aggregate(filters, start_time, end_time, group_by, date_format, end_inclusive)
+        if rows is not None:
+            return rows
+    end_lookup = "time_weight__lte" if end_inclusive else "time_weight__lt"
+    time_filters: Dict[str, Any] = {}
+    if start_time is not None:
+        time_filters["time_weight__gte"] = start_time
+    if end_time is not None:
+        time_filters[end_lookup] = end_time
+
+    span = _rollup_span(filters, start_time, end_time, group_by, date_format, splits)
+    if span is None:
+        return await _aggregate_raw(filters, time_filters, group_by, date_format, splits)
+    # 可由日汇总表覆盖的完整自然日 [first_day, last_day]
+    first_day, last_day = span
+    start = parse_time(start_time) if start_time is not None else None
+    rollup_filters = translate_filters(filters)
+    rollup_group_by = translate_group_by(group_by)
+    rollup_splits = {name: translate_filters(when) for name, when in splits.items()}
+
+    # 首尾明细与日汇总相互独立, 并发查询
+    queries = []
+    if start is not None and start < _day_start(first_day):
+        head_filters = {"time_weight__gte": start_time, "time_weight__lt": _day_start(first_day)}
+        queries.append(_aggregate_raw(filters, head_filters, group_by, date_format, splits))
+    queries.append(_aggregate_rollup(
+        rollup_filters, first_day, last_day, group_by, rollup_group_by, date_format, rollup_splits,
+    ))
+    tail_filters = {"time_weight__gte": _day_start(last_day + timedelta(days=1))}
+    if end_time is not None:
+        tail_filters[end_lookup] = end_time
+    queries.append(_aggregate_raw(filters, tail_filters, group_by, date_format, splits))
+    parts = await gather_queries(*queries)
+    return reduce_groups([row for rows in parts for row in rows], group_by, MEASURES + split_measures(splits))
+
+
+async def aggregate_grouping_sets(
+        filters: Dict[str, Any],
+        start_time: Any = None,
+        end_time: Any = None,
+        grouping_sets: Optional[Dict[str, Sequence[str]]] = None,
+        date_format: str = "%Y-%m-%d",
+        end_inclusive: bool = True,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """一次扫描得到多个分组集合的统计结果
+
+    按所有分组字段的并集统计一次, 再在内存中上卷到各个分组集合
+
+    :param grouping_sets: {返回键: 分组字段}, 如 {"by_date": ("date",), "by_source": ("garbage_source_id__source_name",)}
+    :return: {返回键: [{分组字段..., vehicle_num, weight_gross_sum, weight_tare_sum, weight_net_sum}]}
+    """
+    grouping_sets = grouping_sets or {}
+    rows = await aggregate_weight_records(
+        filters,
+        start_time,
+        end_time,
+        group_by=union_group_by(grouping_sets),
+        date_format=date_format,
+        end_inclusive=end_inclusive,
+    )
+    return split_grouping_sets(rows, grouping_sets)
+
+
+# 小时汇总表支持的过滤字段
+HOURLY_FILTER_FIELDS = ("pound_id", "pound_id_id")
+# 小时统计的分组字段
+HOURLY_GROUP_BY = ("pound_id_id", "hour")
+
+
+async def _aggregate_hourly_raw(filters: Dict[str, Any], time_filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """从称重记录表按 地磅站 × 小时 统计"""
+    rows = await WeightRecord.filter(**filters, **time_filters).annotate(
+        hour=TruncDateTime("time_weight", "%H"),
+        vehicle_num=Count("id_center"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+        weight_net_sum=NetWeightSum(),
+    ).group_by(*HOURLY_GROUP_BY).values(*HOURLY_GROUP_BY, *MEASURES)
+    for row in rows:
+        row["hour"] = int(row["hour"])
+    return rows
+
+
+async def _aggregate_hourly_rollup(
+        filters: Dict[str, Any],
+        first_day: Optional[date],
+        last_day: date,
+) -> List[Dict[str, Any]]:
+    """从小时汇总表按 地磅站 × 小时 统计"""
+    query = WeightRecordHourly.filter(**filters, day__lte=last_day)
+    if first_day is not None:
+        query = query.filter(day__gte=first_day)
+    rows = await query.annotate(
+        vehicle_num=Sum("record_num"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+        weight_net_sum=NetWeightSum(),
+    ).group_by(*HOURLY_GROUP_BY).values(*HOURLY_GROUP_BY, *MEASURES)
+    for row in rows:
+        row["vehicle_num"] = int(row["vehicle_num"] or 0)
+    return rows
+
+
+async def aggregate_hourly(
+        filters: Dict[str, Any],
+        start_time: Any = None,
+        end_time: Any = None,
+) -> List[Dict[str, Any]]:
+    """称重记录按 地磅站 × 小时(0-23) 统计, 范围内各日同一小时相加
+
+    已汇总的完整自然日从小时汇总表读取, 其余时间段(未汇总的当日, 非整日的首尾)读取称重记录表;
+    过滤条件只含地磅站时才能使用小时汇总表
+
+    :param filters: 称重记录过滤条件
+    :param start_time: 开始时间(含), None表示不限
+    :param end_time: 结束时间(含), None表示不限
+    :return: [{pound_id_id, hour, vehicle_num, weight_gross_sum, weight_tare_sum, weight_net_sum}]
+    """
+    time_filters: Dict[str, Any] = {}
+    if start_time is not None:
+        time_filters["time_weight__gte"] = start_time
+    if end_time is not None:
+        time_filters["time_weight__lte"] = end_time
+    span = None
+    if all(key.split("__")[0] in HOURLY_FILTER_FIELDS for key in filters):
+        span = _rollup_span({}, start_time, end_time, (), "%Y-%m-%d", {})
+    if span is None:
+        return await _aggregate_hourly_raw(filters, time_filters)
+    first_day, last_day = span
+    start = parse_time(start_time) if start_time is not None else None
+    queries = []
+    if start is not None and start < _day_start(first_day):
+        head_filters = {"time_weight__gte": start_time, "time_weight__lt": _day_start(first_day)}
+        queries.append(_aggregate_hourly_raw(filters, head_filters))
+    queries.append(_aggregate_hourly_rollup(filters, first_day, last_day))
+    tail_filters = {"time_weight__gte": _day_start(last_day + timedelta(days=1))}
+    if end_time is not None:
+        tail_filters["time_weight__lte"] = end_time
+    queries.append(_aggregate_hourly_raw(filters, tail_filters))
+    parts = await gather_queries(*queries)
+    return reduce_groups([row for rows in parts for row in rows], HOURLY_GROUP_BY)
+
+
+async def build_rollup_day(day: date) -> int:
+    """重新汇总某一日的称重记录, 可重复执行
+
+    :param day: 日期
+    :return: 汇总行数
+    """
+    day_start = _day_start(day)
+    # 区域由垃圾来源决定, 单独查询以避免关联 garbage_source 表后 info 字段重名
+    source_regions = dict(await GarbageSource.all().values_list("id", "region_id_id"))
+    rows = await WeightRecord.filter(
+        time_weight__gte=day_start,
+        time_weight__lt=day_start + timedelta(days=1),
+    ).annotate(
+        record_num=Count("id_center"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+    ).group_by(
+        "pound_id_id",
+        "vehicle_id__dept_id_id",
+        "garbage_source_id_id",
+        "garbage_type_id_id",
+        "info",
+    ).values(
+        "pound_id_id",
+        "vehicle_id__dept_id_id",
+        "garbage_source_id_id",
+        "garbage_type_id_id",
+        "info",
+        "record_num",
+        "weight_gross_sum",
+        "weight_tare_sum",
+    )
+    hourly = await _hourly_rollup_rows(day)
+    async with in_transaction("default"):
+        await WeightRecordHourly.filter(day=day).delete()
+        await WeightRecordHourly.bulk_create(hourly)
+        await WeightRecordDaily.filter(day=day).delete()
+        await WeightRecordDaily.bulk_create([
+            WeightRecordDaily(
+                day=day,
+                pound_id_id=row["pound_id_id"],
+                dept_id_id=row["vehicle_id__dept_id_id"],
+                region_id_id=source_regions.get(row["garbage_source_id_id"]),
+                garbage_source_id_id=row["garbage_source_id_id"],
+                garbage_type_id_id=row["garbage_type_id_id"],
+                info=row["info"],
+                record_num=row["record_num"],
+                weight_gross=row["weight_gross_sum"] or Decimal(0),
+                weight_tare=row["weight_tare_sum"] or Decimal(0),
+            )
+            for row in rows
+        ])
+    return len(rows)
+
+
+async def _hourly_rollup_rows(day: date) -> List[WeightRecordHourly]:
+    """某一日按小时和地磅站汇总的行"""
+    day_start = _day_start(day)
+    rows = await WeightRecord.filter(
+        time_weight__gte=day_start,
+        time_weight__lt=day_start + timedelta(days=1),
+    ).annotate(
+        hour=TruncDateTime("time_weight", "%H"),
+        record_num=Count("id_center"),
+        weight_gross_sum=Sum("weight_gross"),
+        weight_tare_sum=Sum("weight_tare"),
+    ).group_by("hour", "pound_id_id").values("hour", "pound_id_id", "record_num", "weight_gross_sum", "weight_tare_sum")
+    return [
+        WeightRecordHourly(
+            day=day,
+            hour=int(row["hour"]),
+            pound_id_id=row["pound_id_id"],
+            record_num=row["record_num"],
+            weight_gross=row["weight_gross_sum"] or Decimal(0),
+            weight_tare=row["weight_tare_sum"] or Decimal(0),
+        )
+        for row in rows
+    ]
+
+
+async def build_hourly_rollup_day(day: date) -> int:
+    """只重新汇总某一日的小时汇总表, 用于补齐小时汇总表上线前的历史日期
+
+    :return: 汇总行数
+    """
+    rows = await _hourly_rollup_rows(day)
+    async with in_transaction("default"):
+        await WeightRecordHourly.filter(day=day).delete()
+        await WeightRecordHourly.bulk_create(rows)
+    return len(rows)
+
+
+# 日汇总表的分组键
+ROLLUP_BUCKET_KEYS: Tuple[str, ...] = (
+    "day", "pound_id_id", "dept_id_id", "region_id_id", "garbage_source_id_id", "garbage_type_id_id", "info",
+)
+# 小时汇总表的分组键
+HOURLY_BUCKET_KEYS: Tuple[str, ...] = ("day", "hour", "pound_id_id")
+
+
+async def rollup_buckets(queryset) -> List[Dict[str, Any]]:
+    """查询称重记录所属的日汇总分组及重量, 用于写入前后计算增量
+
+    :param queryset: 称重记录查询
+    :return: [{id, 分组键..., weight_gross, weight_tare}]
+    """
+    rows = await queryset.values(
+        "id",
+        "time_weight",
+        "pound_id_id",
+        "garbage_source_id_id",
+        "garbage_type_id_id",
+        "info",
+        "weight_gross",
+        "weight_tare",
+        dept_id_id="vehicle_id__dept_id_id",
+    )
+    source_ids = {row["garbage_source_id_id"] for row in rows if row["garbage_source_id_id"] is not None}
+    source_regions = {}
+    if source_ids:
+        source_regions = dict(await GarbageSource.filter(id__in=list(source_ids)).values_list("id", "region_id_id"))
+    for row in rows:
+        time_weight = row.pop("time_weight")
+        row["day"] = time_weight.date() if time_weight is not None else None
+        row["hour"] = time_weight.hour if time_weight is not None else None
+        row["region_id_id"] = source_regions.get(row["garbage_source_id_id"])
+    return rows
+
+
+async def _maintained_until() -> Optional[date]:
+    """日汇总表中已汇总完整, 需随写入维护的最后一日
+
+    未汇总过时, 下次汇总从表中最后一日起重建, 其之前的日期需要维护
+    """
+    if RollupState.sealed_until is not None:
+        return RollupState.sealed_until
+    last_day = await WeightRecordDaily.all().order_by("-day").first().values_list("day", flat=True)
+    return last_day - timedelta(days=1) if last_day is not None else None
+
+
+async def apply_rollup_deltas(removed: Sequence[Dict[str, Any]], added: Sequence[Dict[str, Any]]) -> Set[date]:
+    """按写入前后的记录将增量(车数, 毛重, 皮重)累加到日汇总表与小时汇总表, 需在写入称重记录的同一事务中调用
+
+    记录在分组间移动时, 原分组减去旧值, 新分组加上新值; 未汇总或正在重建的日期不累加,
+    返回这些日期, 由写入方在事务提交后交给 reconcile_rollup
+
+    :param removed: 写入前的记录(删除, 修改前), rollup_buckets 的结果
+    :param added: 写入后的记录(新增, 修改后), rollup_buckets 的结果
+    :return: 未累加增量的日期
+    """
+    until = await _maintained_until()
+    days = {row["day"] for rows in (removed, added) for row in rows if row["day"] is not None}
+    pending = {day for day in days if until is None or day > until or day in RollupState.rebuilding}
+    if len(pending) == len(days):
+        return pending
+    removed = [row for row in removed if row["day"] is not None and row["day"] not in pending]
+    added = [row for row in added if row["day"] is not None and row["day"] not in pending]
+    for model, keys in ((WeightRecordDaily, ROLLUP_BUCKET_KEYS), (WeightRecordHourly, HOURLY_BUCKET_KEYS)):
+        await _apply_deltas(model, keys, removed, added)
+    return pending
+
+
+async def reconcile_rollup(days: Iterable[date]) -> None:
+    """写入事务提交后处理 apply_rollup_deltas 未累加的日期
+
+    日期正在重建时标记重来; 已在写入期间汇总完毕时(汇总读取发生在提交前, 缺少本次写入)整日重建;
+    仍未汇总的日期由之后的汇总读取, 不做处理
+    """
+    for day in sorted(days):
+        if day in RollupState.rebuilding:
+            RollupState.dirty.add(day)
+        elif RollupState.sealed_until is not None and day <= RollupState.sealed_until:
+            await rebuild_rollup_day(day)
+
+
+async def remap_rollup(queryset) -> Set[date]:
+    """维度映射(车辆所属单位, 垃圾来源所属区域)修改后标记这些称重记录所在的已汇总日期, 在修改事务提交后调用
+
+    日汇总表按汇总时的映射记录单位与区域, 映射修改后原有分组不再正确; 标记的日期由汇总任务在后台整日重建,
+    重建完成前统计改为读取称重记录表; 未汇总的日期之后按新映射汇总, 不做处理
+
+    :param queryset: 受影响的称重记录查询, 如 WeightRecord.filter(vehicle_id_id=车辆id)
+    :return: 标记的日期
+    """
+    until = await _maintained_until()
+    if until is None and not RollupState.rebuilding:
+        return set()
+    rows = await queryset.annotate(
+        day=TruncDateTime("time_weight", "%Y-%m-%d"),
+        record_num=Count("id_center"),
+    ).group_by("day").values("day", "record_num")
+    days = {datetime.strptime(str(row["day"]), "%Y-%m-%d").date() for row in rows if row["day"] is not None}
+    days = {day for day in days if (until is not None and day <= until) or day in RollupState.rebuilding}
+    # 正在重建的日期可能已按原映射读取, 标记重来
+    RollupState.dirty.update(days & RollupState.rebuilding)
+    if days:
+        RollupState.stale.update(days)
+        RollupState.wakeup.set()
+    return days
+
+
+async def rebuild_stale_rollup() -> Set[date]:
+    """整日重建 remap_rollup 标记的日期, 由汇总任务在后台调用
+
+    :return: 重建的日期
+    """
+    days = set()
+    while RollupState.stale:
+        day = min(RollupState.stale)
+        await rebuild_rollup_day(day)
+        RollupState.stale.discard(day)
+        days.add(day)
+    return days
+
+
+async def rebuild_rollup_day(day: date) -> int:
+    """整日重建日汇总与小时汇总, 重建期间有写入提交时重来; 该日已在重建时只标记重来
+
+    :return: 汇总行数
+    """
+    if day in RollupState.rebuilding:
+        RollupState.dirty.add(day)
+        return 0
+    RollupState.rebuilding.add(day)
+    try:
+        while True:
+            RollupState.dirty.discard(day)
+            row_num = await build_rollup_day(day)
+            if day not in RollupState.dirty:
+                return row_num
+    finally:
+        RollupState.rebuilding.discard(day)
+
+
+async def _add_to_bucket(
+        model,
+        bucket: Dict[str, Any],
+        record_num: int,
+        weight_gross: Decimal,
+        weight_tare: Decimal,
+) -> bool:
+    """累加到汇总表 model 中的已有分组, 分组不存在时返回False
+
+    分组键含空值时唯一约束不生效, 同一分组可能有多行, 统计时求和, 只累加到其中一行
+    """
+    row_id = await model.filter(**bucket).first().values_list("id", flat=True)
+    if row_id is None:
+        return False
+    await model.filter(id=row_id).update(
+        record_num=F("record_num") + record_num,
+        weight_gross=F("weight_gross") + weight_gross,
+        weight_tare=F("weight_tare") + weight_tare,
+    )
+    return True
+
+
+async def _apply_deltas(
+        model,
+        keys: Sequence[str],
+        removed: Sequence[Dict[str, Any]],
+        added: Sequence[Dict[str, Any]],
+) -> int:
+    """将增量累加到汇总表 model 中按 keys 分组的行"""
+    deltas: Dict[Tuple, List[Any]] = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            key = tuple(row[k] for k in keys)
+            delta = deltas.setdefault(key, [0, Decimal(0), Decimal(0)])
+            delta[0] += sign
+            delta[1] += sign * (row["weight_gross"] or 0)
+            delta[2] += sign * (row["weight_tare"] or 0)
+    count = 0
+    for key, (record_num, weight_gross, weight_tare) in deltas.items():
+        if not record_num and not weight_gross and not weight_tare:
+            continue
+        bucket = {k: v for k, v in zip(keys, key) if v is not None}
+        bucket.update({k + "__isnull": True for k, v in zip(keys, key) if v is None})
+        # 分组不存在时新增; 并发新增同一分组时唯一键冲突, 改为累加到对方新增的行
+        if not await _add_to_bucket(model, bucket, record_num, weight_gross, weight_tare):
+            try:
+                await model.create(
+                    **dict(zip(keys, key)),
+                    record_num=record_num,
+                    weight_gross=weight_gross,
+                    weight_tare=weight_tare,
+                )
+            except IntegrityError:
+                await _add_to_bucket(model, bucket, record_num, weight_gross, weight_tare)
+        # 分组合计车数为0时才删除, 分组有多行时单行可能为负
+        if sum(await model.filter(**bucket).values_list("record_num", flat=True)) <= 0:
+            await model.filter(**bucket).delete()
+        count += 1
+    return count
+
+
+async def _backfill_hourly(before: date) -> None:
+    """小时汇总表晚于日汇总表启用时, 补齐 before 之前已有日汇总的日期"""
+    day = await WeightRecordHourly.all().order_by("-day").first().values_list("day", flat=True)
+    if day is None:
+        first_time = await WeightRecord.all().order_by("time_weight").first().values_list("time_weight", flat=True)
+        if first_time is None:
+            return
+        day = first_time.date()
+    while day < before:
+        row_num = await build_hourly_rollup_day(day)
+        logger.debug('weight hourly rollup %s: %d rows' % (day, row_num))
+        day += timedelta(days=1)
+
+
+async def seal_rollup(until: date) -> Optional[date]:
+    """汇总截至 until(含)的所有自然日
+
+    首次执行时从日汇总表最后一日(可能未汇总完整)或称重记录最早一日开始补齐
+
+    :param until: 汇总截止日期
+    :return: 已汇总截止日期
+    """
+    day = None
+    if RollupState.sealed_until is not None:
+        day = RollupState.sealed_until + timedelta(days=1)
+    else:
+        day = await WeightRecordDaily.all().order_by("-day").first().values_list("day", flat=True)
+        if day is None:
+            first_time = await WeightRecord.all().order_by("time_weight").first().values_list("time_weight", flat=True)
+            day = first_time.date() if first_time is not None else until + timedelta(days=1)
+        await _backfill_hourly(day)
+
+    while day <= until:
+        # 重建结束与更新 sealed_until 之间没有等待, 写入方提交后看到的要么是重建中, 要么是已汇总
+        row_num = await rebuild_rollup_day(day)
+        logger.debug('weight rollup %s: %d rows' % (day, row_num))
+        RollupState.sealed_until = day
+        day += timedelta(days=1)
+
+    if RollupState.sealed_until is None or RollupState.sealed_until < until:
+        RollupState.sealed_until = until
+    return RollupState.sealed_until
@@ -8,8 +8,17 @@ Description:
 from __future__ import annotations
 from typing import Tuple,Type
 from .base import BaseListener
+from .rollup import RollupListener
+from .replica import ReplicaListener
+from .cube import CubeListener
+from .report_windows import ReportWindowListener
+from .jobs import JobListener
 
 
 LISTENER_TUPLE: Tuple[Type[BaseListener], ...] = (
-
+    RollupListener,
+    ReplicaListener,
+    CubeListener,
+    ReportWindowListener,
+    JobListener,
 )
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+import time
+from asyncio.base_events import BaseEventLoop
+from typing import Optional
+
+from sanic import Sanic
+
+from .base import BaseListener
+from core.libs.weight_cube import weight_cube
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class CubeListener(BaseListener):
+    """称重记录列式缓存
+    服务启动后加载, 之后定时追加新记录; 缓存失效或到达重载间隔时全量重新加载.
+    需安装 numpy, 未启用时统计查询照常读取数据库
+
+    配置(可选):
+    CUBE.ENABLED = false            是否启用
+    CUBE.DAYS = 400                 加载最近多少天的记录, 0表示全部
+    CUBE.INTERVAL = 60              追加新记录与刷新名称的间隔(秒)
+    CUBE.RELOAD_INTERVAL = 3600     全量重新加载间隔(秒)
+    """
+
+    __slots__ = ('_task',)
+
+    def __init__(self, settings) -> None:
+        super().__init__(settings)
+        self._task: Optional[asyncio.Task] = None
+
+    async def after_server_start(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if not self._settings.get('CUBE', {}).get('ENABLED', False):
+            return
+        if not weight_cube.available():
+            logger.warning('weight cube enabled but numpy is not installed')
+            return
+        self._task = loop.create_task(self._run())
+
+    async def before_server_stop(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        weight_cube.ready = False
+
+    async def _run(self) -> None:
+        config = self._settings['CUBE']
+        days = config.get('DAYS', 400)
+        interval = config.get('INTERVAL', 60)
+        reload_interval = config.get('RELOAD_INTERVAL', 3600)
+        loaded_at = None
+        while True:
+            try:
+                if not weight_cube.ready or weight_cube.stale or time.monotonic() - loaded_at >= reload_interval:
+                    await weight_cube.load(days)
+                    loaded_at = time.monotonic()
+                else:
+                    await weight_cube.load_reference()
+                    await weight_cube.catch_up()
+            except Exception as e:
+                logger.error('weight cube refresh failed: %s' % e)
+            await asyncio.sleep(interval)
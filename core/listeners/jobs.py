@@ -0,0 +1,33 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from asyncio.base_events import BaseEventLoop
+
+from sanic import Sanic
+
+from .base import BaseListener
+from core.libs.jobs import report_jobs
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class JobListener(BaseListener):
+    """异步报表任务
+    服务启动后加载配置并启动后台执行与过期结果清理协程, 服务停止前取消
+
+    配置(可选):
+    JOBS.WORKERS = 2            同时执行的任务数
+    JOBS.MAX_PENDING = 32       排队任务数上限
+    JOBS.RESULT_TTL = 3600      结果保留时间(秒)
+    JOBS.RESULT_DIR = ''        结果目录, 默认 data/jobs
+    """
+
+    async def after_server_start(self, app: Sanic, loop: BaseEventLoop) -> None:
+        report_jobs.configure(self._settings)
+        report_jobs.start(self._settings.get('JOBS', {}).get('WORKERS', 2))
+
+    async def before_server_stop(self, app: Sanic, loop: BaseEventLoop) -> None:
+        await report_jobs.stop()
@@ -0,0 +1,74 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from asyncio.base_events import BaseEventLoop
+from typing import Optional
+
+from sanic import Sanic
+from tortoise import connections
+
+from .base import BaseListener
+from core.libs.db_router import REPLICA, ReplicaState
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class ReplicaListener(BaseListener):
+    """从库复制延迟检查
+    定时读取从库复制状态, 延迟超过阈值或无法获取时统计查询回退到主库
+
+    配置(可选, 仅在配置了 MYSQL.REPLICA.HOST 时生效):
+    MYSQL.REPLICA.MAX_LAG = 5           允许的复制延迟(秒)
+    MYSQL.REPLICA.CHECK_INTERVAL = 10   检查间隔(秒)
+    """
+
+    __slots__ = ('_task',)
+
+    def __init__(self, settings) -> None:
+        super().__init__(settings)
+        self._task: Optional[asyncio.Task] = None
+
+    async def after_server_start(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if ReplicaState.enabled:
+            self._task = loop.create_task(self._run())
+
+    async def before_server_stop(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        ReplicaState.healthy = False
+
+    async def _run(self) -> None:
+        config = self._settings['MYSQL']['REPLICA']
+        max_lag = config.get('MAX_LAG', 5)
+        interval = config.get('CHECK_INTERVAL', 10)
+        while True:
+            lag = await self._check_lag()
+            healthy = lag is not None and lag <= max_lag
+            if healthy != ReplicaState.healthy:
+                logger.warning('replica %s, lag: %s' % ('available' if healthy else 'unavailable', lag))
+            ReplicaState.lag = lag
+            ReplicaState.healthy = healthy
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    async def _check_lag() -> Optional[float]:
+        """从库复制延迟(秒), 复制未运行或查询失败时返回None"""
+        try:
+            rows = await connections.get(REPLICA).execute_query_dict("SHOW SLAVE STATUS")
+        except Exception as e:
+            logger.error('replica status check failed: %s' % e)
+            return None
+        if not rows:
+            return None
+        # MySQL 8.0.22 起字段名改为 Seconds_Behind_Source
+        lag = rows[0].get('Seconds_Behind_Master', rows[0].get('Seconds_Behind_Source'))
+        return float(lag) if lag is not None else None
@@ -0,0 +1,59 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from asyncio.base_events import BaseEventLoop
+from typing import Optional
+
+from sanic import Sanic
+
+from .base import BaseListener
+from core.models import Pound
+from core.libs.report_windows import report_windows
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class ReportWindowListener(BaseListener):
+    """报表标准时间窗口预计算
+    服务启动后按地磅计算今日, 本月, 上月的报表统计结果, 之后定时刷新, 数据未变化的窗口不重新计算
+
+    配置(可选):
+    REPORT_WINDOWS.INTERVAL = 300       刷新间隔(秒)
+    REPORT_WINDOWS.CHECK_INTERVAL = 10  读取时检查数据水位的最短间隔(秒)
+    """
+
+    __slots__ = ('_task',)
+
+    def __init__(self, settings) -> None:
+        super().__init__(settings)
+        self._task: Optional[asyncio.Task] = None
+
+    async def after_server_start(self, app: Sanic, loop: BaseEventLoop) -> None:
+        config = self._settings.get('REPORT_WINDOWS', {})
+        report_windows.check_interval = config.get('CHECK_INTERVAL', report_windows.check_interval)
+        self._task = loop.create_task(self._run())
+
+    async def before_server_stop(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        config = self._settings.get('REPORT_WINDOWS', {})
+        interval = config.get('INTERVAL', 300)
+        while True:
+            try:
+                pound_ids = await Pound.all().values_list("id", flat=True)
+                count = await report_windows.refresh(pound_ids)
+                logger.debug('report windows refreshed: %d' % count)
+            except Exception as e:
+                logger.error('report windows refresh failed: %s' % e)
+            await asyncio.sleep(interval)
@@ -0,0 +1,64 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+from asyncio.base_events import BaseEventLoop
+from datetime import date, timedelta
+from typing import Optional
+
+from sanic import Sanic
+
+from .base import BaseListener
+from core.libs.weight_rollup import RollupState, rebuild_stale_rollup, seal_rollup
+from core.libs.closed_periods import closed_periods
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class RollupListener(BaseListener):
+    """称重记录日汇总
+    服务启动后补齐历史日汇总, 之后定时汇总已结束的自然日; 维度映射修改后立即重建标记的日期
+
+    配置(可选):
+    ROLLUP.INTERVAL = 600       检查间隔(秒)
+    ROLLUP.SEAL_LAG_DAYS = 0    延迟汇总天数, 用于等待补传数据
+    """
+
+    __slots__ = ('_task',)
+
+    def __init__(self, settings) -> None:
+        super().__init__(settings)
+        self._task: Optional[asyncio.Task] = None
+
+    async def after_server_start(self, app: Sanic, loop: BaseEventLoop) -> None:
+        self._task = loop.create_task(self._run())
+
+    async def before_server_stop(self, app: Sanic, loop: BaseEventLoop) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        config = self._settings.get('ROLLUP', {})
+        interval = config.get('INTERVAL', 600)
+        lag_days = config.get('SEAL_LAG_DAYS', 0)
+        while True:
+            RollupState.wakeup.clear()
+            try:
+                await seal_rollup(date.today() - timedelta(days=1 + lag_days))
+                if await rebuild_stale_rollup():
+                    # 重建完成前其他进程可能按原映射保存了已结账月份的结果
+                    await closed_periods.invalidate_all()
+            except Exception as e:
+                logger.error('weight rollup failed: %s' % e)
+            try:
+                await asyncio.wait_for(RollupState.wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
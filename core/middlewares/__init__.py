@@ -10,8 +10,12 @@ from typing import Tuple,Type
 from .base import BaseMiddleware
 from .timer import TimerMiddleware
 from .cors import CorsMiddleware
+from .replica import ReplicaMiddleware
+from .admission import AdmissionMiddleware
 
 MIDDLEWARE_TUPLE: Tuple[Type[BaseMiddleware], ...] = (
     TimerMiddleware,
     CorsMiddleware,
+    ReplicaMiddleware,
+    AdmissionMiddleware,
 )
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+import weakref
+from typing import Optional
+
+from .base import BaseMiddleware
+from sanic import Request, HTTPResponse
+from core.libs.admission import Admission
+from core.libs.response_cache import join_in_flight
+from core.libs.response import response_ok
+from core.libs.error_code import ECEnum
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """按优先级类别限制并发, 超出排队上限或排队超时的请求直接返回503与 Retry-After, 配置见 Admission
+
+    相同请求正在由 single_flight 执行时直接放行, 等待该次执行的结果, 不占用槽位
+    """
+
+    __slots__ = ('_admission',)
+
+    def __init__(self) -> None:
+        self._admission: Optional[Admission] = None
+
+    async def before_request(self, request: Request) -> Optional[HTTPResponse]:
+        if self._admission is None:
+            self._admission = Admission(request.app.config.get('ADMISSION'))
+        admission_class = self._admission.classify(request.path)
+        if admission_class is None or join_in_flight(request):
+            return None
+        if not await admission_class.acquire():
+            logger.warning('%s rejected, %s active: %d, waiting: %d' % (
+                request.path, admission_class.name, admission_class.active, admission_class.waiting))
+            response = response_ok(dict(priority=admission_class.name), ECEnum.ServerBusy)
+            response.status = 503
+            response.headers['Retry-After'] = str(self._admission.retry_after)
+            return response
+        # 响应前释放, 流式响应由 hold_admission 改为发送完毕后释放; 连接中断未走到响应时, 请求对象回收后释放
+        request.ctx.admission = weakref.finalize(request, admission_class.release)
+        return None
+
+    async def before_response(self, request: Request, response: HTTPResponse) -> None:
+        release = getattr(request.ctx, 'admission', None)
+        if release is not None:
+            release()
@@ -0,0 +1,29 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+from typing import Tuple
+
+from .base import BaseMiddleware
+from sanic import Request, HTTPResponse
+from core.libs.db_router import ReplicaState, use_replica
+
+# 允许读从库的请求路径前缀(只读的统计报表与列表查询), 可由 MYSQL.REPLICA.READ_PATHS 覆盖
+READ_PATHS: Tuple[str, ...] = (
+    "/web_api/statistics",
+    "/admin_api/weight_record/read_weight_record",
+)
+
+
+class ReplicaMiddleware(BaseMiddleware):
+    """按请求路径选择读库, 未配置从库时不做处理"""
+
+    async def before_request(self, request: Request) -> None:
+        if not ReplicaState.enabled:
+            return
+        read_paths = request.app.config['MYSQL']['REPLICA'].get('READ_PATHS', READ_PATHS)
+        # 同一连接上的后续请求共用上下文, 每次请求都需重新设置
+        use_replica(request.path.startswith(tuple(read_paths)))
+
+    async def before_response(self, request: Request, response: HTTPResponse) -> None:
+        pass
@@ -12,6 +12,7 @@ from .operation_logs import OperationLog
 # from .garbage_type import GarbageType
 # from .driver import Driver
 from .ic_card import CardManager, CardChanged
+from .weight_rollup import WeightRecordDaily, WeightRecordHourly
 
 
 __all__ = [
@@ -33,4 +34,6 @@ __all__ = [
     "Pound",
     "CardPound",
     "UserMenu",
+    "WeightRecordDaily",
+    "WeightRecordHourly",
 ]
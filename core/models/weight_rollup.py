@@ -0,0 +1,115 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from tortoise.models import Model
+from tortoise import fields
+import core.models as models
+
+
+class WeightRecordDaily(Model):
+    # 称重记录日汇总表, 按 日期 × 地磅站 × 清运单位 × 区域 × 垃圾来源 × 统计类别 × 数据类型 聚合
+    id = fields.IntField(pk=True, source_field="id")
+    day = fields.DateField(source_field="day", index=True)                                  # 称重日期
+
+    pound_id: fields.ForeignKeyNullableRelation[models.Pound] = fields.ForeignKeyField(
+        model_name="models.Pound",
+        related_name=False,
+        to_field="id",
+        source_field="pound_id",
+        null=True,
+        db_constraint=False,
+    )
+    dept_id: fields.ForeignKeyNullableRelation[models.Department] = fields.ForeignKeyField(
+        model_name="models.Department",
+        related_name=False,
+        to_field="id",
+        source_field="dept_id",
+        null=True,
+        db_constraint=False,
+    )
+    region_id: fields.ForeignKeyNullableRelation[models.Region] = fields.ForeignKeyField(
+        model_name="models.Region",
+        related_name=False,
+        to_field="id",
+        source_field="region_id",
+        null=True,
+        db_constraint=False,
+    )
+    garbage_source_id: fields.ForeignKeyNullableRelation[models.GarbageSource] = fields.ForeignKeyField(
+        model_name="models.GarbageSource",
+        related_name=False,
+        to_field="id",
+        source_field="garbage_source_id",
+        null=True,
+        db_constraint=False,
+    )
+    garbage_type_id: fields.ForeignKeyNullableRelation[models.GarbageType] = fields.ForeignKeyField(
+        model_name="models.GarbageType",
+        related_name=False,
+        to_field="id",
+        source_field="garbage_type_id",
+        null=True,
+        db_constraint=False,
+    )
+    info = fields.CharField(max_length=200, source_field="info", null=True)                # 数据类型
+
+    record_num = fields.IntField(source_field="record_num", default=0)                     # 车数
+    weight_gross = fields.DecimalField(max_digits=14, decimal_places=2, source_field="weight_gross", default=0)  # 毛重合计
+    weight_tare = fields.DecimalField(max_digits=14, decimal_places=2, source_field="weight_tare", default=0)    # 皮重合计
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            day=self.day,
+            pound_id=self.pound_id_id,
+            dept_id=self.dept_id_id,
+            region_id=self.region_id_id,
+            garbage_source_id=self.garbage_source_id_id,
+            garbage_type_id=self.garbage_type_id_id,
+            info=self.info,
+            record_num=self.record_num,
+            weight_gross=self.weight_gross,
+            weight_tare=self.weight_tare,
+        )
+
+    class Meta:
+        table = "weight_record_daily"  # 数据表名字
+        # 分组键唯一, 增量累加时并发新增同一分组由唯一约束拦截. 含空值的分组 MySQL 不校验唯一, 可能有多行, 统计时求和
+        unique_together = (("day", "pound_id_id", "dept_id_id", "region_id_id", "garbage_source_id_id", "garbage_type_id_id", "info"),)
+
+
+class WeightRecordHourly(Model):
+    # 称重记录小时汇总表, 按 日期 × 小时 × 地磅站 聚合, 用于到站高峰分析
+    id = fields.IntField(pk=True, source_field="id")
+    day = fields.DateField(source_field="day", index=True)                                  # 称重日期
+    hour = fields.SmallIntField(source_field="hour")                                        # 小时 0-23
+
+    pound_id: fields.ForeignKeyNullableRelation[models.Pound] = fields.ForeignKeyField(
+        model_name="models.Pound",
+        related_name=False,
+        to_field="id",
+        source_field="pound_id",
+        null=True,
+        db_constraint=False,
+    )
+
+    record_num = fields.IntField(source_field="record_num", default=0)                     # 车数
+    weight_gross = fields.DecimalField(max_digits=14, decimal_places=2, source_field="weight_gross", default=0)  # 毛重合计
+    weight_tare = fields.DecimalField(max_digits=14, decimal_places=2, source_field="weight_tare", default=0)    # 皮重合计
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            day=self.day,
+            hour=self.hour,
+            pound_id=self.pound_id_id,
+            record_num=self.record_num,
+            weight_gross=self.weight_gross,
+            weight_tare=self.weight_tare,
+        )
+
+    class Meta:
+        table = "weight_record_hourly"  # 数据表名字
+        unique_together = (("day", "hour", "pound_id_id"),)  # 分组键唯一
@@ -15,6 +15,8 @@ from tortoise.transactions import in_transaction
 from core.libs.utils import filter_empty_kvs
 from core.models import Department
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -208,7 +210,7 @@ class InsertDepartment(HTTPMethodView):
         old_record_id = query_dict['old_record_id']
 
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 new_record['parent_dept_id'] = await Department.filter(id=old_record_id).first()
 
                 # related_garbage_source = await GarbageSource.filter(source_name=new_record['garbage_source'])
@@ -223,7 +225,8 @@ class InsertDepartment(HTTPMethodView):
                     type=0,
                     sheshi_type=0,
                 )
-                return response_ok(dict(department=department.to_dict()), ECEnum.Success)
+            ref_data.invalidate()
+            return response_ok(dict(department=department.to_dict()), ECEnum.Success)
         except Exception as e:
             traceback.print_exc()
             logger.error(e.with_traceback(None))
@@ -278,7 +281,7 @@ class UpdateDepartment(HTTPMethodView):
             department_update_num = 0
             if action == "update":
 
-                async with in_transaction():
+                async with in_transaction("default"):
 
                     department_update_num = await Department.select_for_update().filter(
                         id=old_record_id
@@ -288,12 +291,14 @@ class UpdateDepartment(HTTPMethodView):
 
             elif action == "delete":
 
-                async with in_transaction():
+                async with in_transaction("default"):
 
                     department_update_num = await Department.select_for_update().filter(
                         id=old_record_id
                     ).delete()
 
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
             return response_ok(dict(department_update_num=department_update_num), ECEnum.Success)
 
         except Exception as e:
@@ -14,6 +14,8 @@ from tortoise.transactions import in_transaction
 from core.libs.utils import filter_empty_kvs
 from core.models import Driver, Department
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -144,12 +146,13 @@ class InsertDriver(HTTPMethodView):
         try:
             new_record['dept_id'] = await Department.filter(id=new_record['dept_id']).first()
 
-            async with in_transaction():
+            async with in_transaction("default"):
                 driver = await Driver.create(
                     **new_record,
                     upload_state=2
                 )
-                return response_ok(dict(driver=driver.to_dict()), ECEnum.Success)
+            ref_data.invalidate()
+            return response_ok(dict(driver=driver.to_dict()), ECEnum.Success)
         except Exception as e:
             traceback.print_exc()
             logger.error(e.with_traceback(None))
@@ -205,7 +208,7 @@ class UpdateDriver(HTTPMethodView):
             if action == "update":
 
                 new_record['dept_id'] = await Department.filter(id=new_record['dept_id']).first()
-                async with in_transaction():
+                async with in_transaction("default"):
 
                     driver_update_num = await Driver.select_for_update().filter(
                         id=old_record_id
@@ -215,12 +218,14 @@ class UpdateDriver(HTTPMethodView):
 
             elif action == "delete":
 
-                async with in_transaction():
+                async with in_transaction("default"):
 
                     driver_update_num = await Driver.select_for_update().filter(
                         id=old_record_id
                     ).delete()
 
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
             return response_ok(dict(driver_update_num=driver_update_num), ECEnum.Success)
 
         except Exception as e:
@@ -14,8 +14,12 @@ from sanic_ext import openapi, validate
 from tortoise.transactions import in_transaction
 
 from core.libs.utils import filter_empty_kvs
-from core.models import GarbageType, GarbageSource, Region
+from core.models import GarbageType, GarbageSource, Region, WeightRecord
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
+from core.libs.weight_cube import weight_cube
+from core.libs.weight_rollup import remap_rollup
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -116,7 +120,7 @@ class InsertGarbageSource(HTTPMethodView):
         new_record = query_json['new_record']
         print(new_record)
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 region = await Region.filter(id=new_record['region_id']).first()
                 new_record['region_id'] = region
                 garbage_source = await GarbageSource.create(
@@ -125,8 +129,9 @@ class InsertGarbageSource(HTTPMethodView):
                     source_id=0,
                     code=0,
                 )
-                return response_ok(dict(garbage_source=garbage_source.to_dict()),
-                                   ECEnum.Success)
+            ref_data.invalidate()
+            return response_ok(dict(garbage_source=garbage_source.to_dict()),
+                               ECEnum.Success)
 
         except Exception as e:
             traceback.print_exc()
@@ -172,7 +177,8 @@ class UpdateGarbageSource(HTTPMethodView):
             region = await Region.filter(id=new_record['region_id']).first()
             new_record['region_id'] = region
             vehicle_type_update_num = 0
-            async with in_transaction():
+            old_region_id = await GarbageSource.filter(id=old_record_id).first().values_list("region_id_id", flat=True)
+            async with in_transaction("default"):
                 if action == 'update':
                     vehicle_type_update_num = await GarbageSource\
                         .select_for_update()\
@@ -184,8 +190,16 @@ class UpdateGarbageSource(HTTPMethodView):
                         .filter(id=old_record_id) \
                         .delete()
 
-                return response_ok(dict(vehicle_type_update_num=vehicle_type_update_num),
-                                   ECEnum.Success)
+            ref_data.invalidate()
+            # 所属区域变化或来源被删除后, 日汇总表与列式缓存中该来源的记录需按新区域重新汇总(后台执行)
+            new_region_id = region.id if region is not None and action == 'update' else None
+            if vehicle_type_update_num and old_region_id != new_region_id:
+                weight_cube.mark_stale()
+                await remap_rollup(WeightRecord.filter(garbage_source_id_id=old_record_id))
+            # 已结账月份的结果含来源名称与所属区域
+            await closed_periods.invalidate_all()
+            return response_ok(dict(vehicle_type_update_num=vehicle_type_update_num),
+                               ECEnum.Success)
 
         except Exception as e:
             logger.error(e)
@@ -14,6 +14,8 @@ from tortoise.transactions import in_transaction
 
 from core.models import GarbageType, GarbageSource, GarbageType
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -110,7 +112,7 @@ class InsertGarbageType(HTTPMethodView):
         new_record = query_json['new_record']
         print(query_json)
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 garbage_type = await GarbageType.create(
                     **new_record,
                     garbage_type_no="NO",
@@ -119,8 +121,9 @@ class InsertGarbageType(HTTPMethodView):
                         datetime.now(), "%Y-%m-%d %H:%M:%S")),
                     upload_state=1,
                 )
-                return response_ok(dict(garbage_type=garbage_type.to_dict()),
-                                   ECEnum.Success)
+            ref_data.invalidate()
+            return response_ok(dict(garbage_type=garbage_type.to_dict()),
+                               ECEnum.Success)
 
         except Exception as e:
             logger.error(e)
@@ -165,7 +168,7 @@ class UpdateGarbageType(HTTPMethodView):
         elif action == 'delete':
             modify_state = 2
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 garbage_type_update_num = await GarbageType\
                     .select_for_update() \
                     .filter(id=old_record_id) \
@@ -176,8 +179,10 @@ class UpdateGarbageType(HTTPMethodView):
                             datetime.now(), "%Y-%m-%d %H:%M:%S")),
                     )
 
-                return response_ok(dict(garbage_type_update_num=garbage_type_update_num),
-                                   ECEnum.Success)
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
+            return response_ok(dict(garbage_type_update_num=garbage_type_update_num),
+                               ECEnum.Success)
 
         except Exception as e:
             logger.error(e)
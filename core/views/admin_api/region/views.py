@@ -13,6 +13,8 @@ from tortoise.transactions import in_transaction
 from core.libs.utils import filter_empty_kvs
 from core.models import Region
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -98,11 +100,12 @@ class InsertRegion(HTTPMethodView):
         new_record = query_json['new_record']
         print(new_record)
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 region = await Region.create(
                     **new_record,
                     upload_state=0,
                 )
+            ref_data.invalidate()
             return response_ok(dict(region=region.to_dict()),
                                ECEnum.Success)
 
@@ -140,7 +143,7 @@ class UpdateRegion(HTTPMethodView):
         action = request.args.get("action", 'update')
         print(action)
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 if action == 'update':
                     region_update_num = await Region.select_for_update().filter(id=old_record_id) \
                         .update(**new_record)
@@ -148,6 +151,8 @@ class UpdateRegion(HTTPMethodView):
                 elif action == 'delete':
                     region_update_num = await Region.select_for_update().filter(id=old_record_id).delete()
 
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
             return response_ok(dict(region_update_num=region_update_num),
                                ECEnum.Success)
 
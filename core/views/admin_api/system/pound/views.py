@@ -2,6 +2,8 @@ from dataclasses import dataclass
 from sanic.views import HTTPMethodView
 from core.models import Pound
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 from core.libs.logger import LoggerProxy
 from sanic_ext import openapi, validate
@@ -65,6 +67,7 @@ class CreatePounds(HTTPMethodView):
                 modify_state=0,
                 dept_id_id=body_json["dept_id"]
             )
+            ref_data.invalidate()
             return response_ok("新增地磅站信息成功", ECEnum.Success)
 
         except Exception as e:
@@ -183,6 +186,8 @@ class UpdatePounds(HTTPMethodView):
                 comments=body_json["comments"],
                 dept_id_id=body_json["dept_id"]
             )
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
             return response_ok("更新地磅站信息成功", ECEnum.Success)
         except Exception as e:
             logger.error(e)
@@ -227,6 +232,8 @@ class DeletePounds(HTTPMethodView):
         id = body_json["id"]
         try:
             await Pound.filter(id=id).delete()
+            ref_data.invalidate()
+            await closed_periods.invalidate_all()
             return response_ok("删除地磅站信息成功", ECEnum.Success)
         except Exception as e:
             logger.error(e)
@@ -17,8 +17,12 @@ from tortoise.query_utils import Prefetch
 from tortoise.transactions import in_transaction
 
 from core.libs.utils import filter_empty_kvs
-from core.models import Vehicle, VehicleType, Department, GarbageType, GarbageSource, Region, Driver, Card
+from core.models import Vehicle, VehicleType, Department, GarbageType, GarbageSource, Region, Driver, Card, WeightRecord
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data_response
+from core.libs.closed_periods import closed_periods
+from core.libs.weight_cube import weight_cube
+from core.libs.weight_rollup import remap_rollup
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -55,6 +59,20 @@ response_example = Response(
 )
 
 
+async def load_query_drop_items() -> dict:
+    """车辆信息-下拉栏数据"""
+    # vehicle_nums = await Vehicle.all().values_list("vehicle_no", flat=True)
+    vehicle_types = await VehicleType.filter(modify_state=0).values_list("vehicle_type_name", flat=True)
+    depts = await Department.filter(id__not=1).values_list("department_name", flat=True)
+    drivers = await Driver.all().values_list("driver_name", flat=True)
+
+    return dict(
+        depts=depts,
+        vehicle_types=vehicle_types,
+        drivers=drivers,
+    )
+
+
 class GetQueryDropItems(HTTPMethodView):
     @openapi.definition(
         summary="数据维护-车辆信息-下拉栏",
@@ -98,19 +116,7 @@ class GetQueryDropItems(HTTPMethodView):
     )
     # @login_required
     async def get(self, request):
-        # vehicle_nums = await Vehicle.all().values_list("vehicle_no", flat=True)
-        vehicle_types = await VehicleType.filter(modify_state=0).values_list("vehicle_type_name", flat=True)
-        depts = await Department.filter(id__not=1).values_list("department_name", flat=True)
-        drivers = await Driver.all().values_list("driver_name", flat=True)
-
-        return response_ok(
-            dict(
-                depts=depts,
-                vehicle_types=vehicle_types,
-                drivers=drivers,
-            ),
-            ECEnum.Success
-        )
+        return await ref_data_response(request, "vehicle_query_drop_items", load_query_drop_items)
 
 
 @dataclass
@@ -351,6 +357,26 @@ class VehicleUpdateBody:
     new_record: VehicleRecord
 
 
+async def load_insert_drop_items() -> dict:
+    """车辆信息-编辑/添加-下拉栏数据"""
+    vehicle_types = await VehicleType.filter(modify_state=0).values("id", "vehicle_type_name")
+    depts = await Department.filter(id__not=1).values("id", "department_name")
+    source_names = await GarbageSource.all() \
+        .prefetch_related("region_id") \
+        .values("id", "source_name", "region_id__region_name")
+    garbage_type_names = await GarbageType.filter(modify_state=0).values("id", "garbage_type_name")
+    region_names = await Region.all().values("id", "region_name")
+    drivers = await Driver.all().values("id", "driver_name")
+
+    return dict(
+        vehicle_types=vehicle_types,
+        depts=depts,
+        sources=source_names,
+        garbage_types=garbage_type_names,
+        drivers=drivers,
+    )
+
+
 class GetInsertDropItems(HTTPMethodView):
     @openapi.definition(
         summary="数据维护-车辆信息-编辑/添加-下拉栏",
@@ -358,25 +384,7 @@ class GetInsertDropItems(HTTPMethodView):
     )
     # @login_required
     async def get(self, request):
-        vehicle_types = await VehicleType.filter(modify_state=0).values("id", "vehicle_type_name")
-        depts = await Department.filter(id__not=1).values("id", "department_name")
-        source_names = await GarbageSource.all() \
-            .prefetch_related("region_id") \
-            .values("id", "source_name", "region_id__region_name")
-        garbage_type_names = await GarbageType.filter(modify_state=0).values("id", "garbage_type_name")
-        region_names = await Region.all().values("id", "region_name")
-        drivers = await Driver.all().values("id", "driver_name")
-
-        return response_ok(
-            dict(
-                vehicle_types=vehicle_types,
-                depts=depts,
-                sources=source_names,
-                garbage_types=garbage_type_names,
-                drivers=drivers,
-            ),
-            ECEnum.Success
-        )
+        return await ref_data_response(request, "vehicle_insert_drop_items", load_insert_drop_items)
 
 
 # {
@@ -438,7 +446,7 @@ class InsertVehicle(HTTPMethodView):
             new_record['garbage_type_id'] = garbage_type_id
             new_record['garbage_source_id'] = garbage_source_id
 
-            async with in_transaction():
+            async with in_transaction("default"):
                 # related_garbage_source = await GarbageSource.filter(source_name=new_record['garbage_source'])
                 # if len(related_garbage_source) != 1:
                 #     return response_ok(dict(), ECEnum.Fail, msg="对应垃圾来源数据有误")
@@ -534,7 +542,7 @@ class UpdateVehicle(HTTPMethodView):
             modify_state = '0'
             if action == 'scrap':
                 modify_state = '2'
-                async with in_transaction():
+                async with in_transaction("default"):
                     vehicle_update_num = await Vehicle.select_for_update().filter(
                         id=old_record_id
                     ).update(
@@ -554,7 +562,8 @@ class UpdateVehicle(HTTPMethodView):
                 new_record['vehicle_type_id'] = vehicle_type_id
                 new_record['garbage_type_id'] = garbage_type_id
                 new_record['garbage_source_id'] = garbage_source_id
-                async with in_transaction():
+                old_dept_id = await Vehicle.filter(id=old_record_id).first().values_list("dept_id_id", flat=True)
+                async with in_transaction("default"):
                     # related_garbage_source = await GarbageSource.filter(source_name=new_record['garbage_source'])
                     # if len(related_garbage_source) != 1:
                     #     return response_ok(dict(), ECEnum.Fail, msg="对应垃圾来源数据有误")
@@ -567,10 +576,15 @@ class UpdateVehicle(HTTPMethodView):
                         modify_state=modify_state,
                         modify_time=str(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")),
                     )
-                    return response_ok(
-                        dict(vehicle_update_num=vehicle_update_num),
-                        ECEnum.Success
-                    )
+                # 所属单位变化后, 日汇总表与列式缓存中该车辆的记录需按新单位重新汇总(后台执行), 并删除已结账月份的结果
+                if vehicle_update_num and old_dept_id != (dept_id.id if dept_id is not None else None):
+                    weight_cube.mark_stale()
+                    await remap_rollup(WeightRecord.filter(vehicle_id_id=old_record_id))
+                    await closed_periods.invalidate_all()
+                return response_ok(
+                    dict(vehicle_update_num=vehicle_update_num),
+                    ECEnum.Success
+                )
         except Exception as e:
             traceback.print_exc()
             logger.error(e.with_traceback(None))
@@ -14,6 +14,7 @@ from tortoise.transactions import in_transaction
 from core.libs.utils import filter_empty_kvs
 from core.models import VehicleType
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data
 from core.libs.error_code import ECEnum
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
@@ -109,7 +110,7 @@ class InsertVehicleTypes(HTTPMethodView):
         new_record = query_json['new_record']
         print(new_record)
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 vehicle_type = await VehicleType.create(
                     **new_record,
                     vehicle_type_no=0,
@@ -118,6 +119,7 @@ class InsertVehicleTypes(HTTPMethodView):
                         datetime.now(), "%Y-%m-%d %H:%M:%S")),
                     upload_state=1,
                 )
+            ref_data.invalidate()
             return response_ok(dict(vehicle_type=vehicle_type.to_dict()),
                                ECEnum.Success)
 
@@ -162,7 +164,7 @@ class UpdateVehicleTypes(HTTPMethodView):
         if action == 'delete':
             modify_state = 2
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 vehicle_type_update_num = await VehicleType \
                     .select_for_update() \
                     .filter(id=old_record_id) \
@@ -173,6 +175,7 @@ class UpdateVehicleTypes(HTTPMethodView):
                             datetime.now(), "%Y-%m-%d %H:%M:%S")),
                     )
 
+            ref_data.invalidate()
             return response_ok(dict(vehicle_type_update_num=vehicle_type_update_num),
                                ECEnum.Success)
 
@@ -5,6 +5,7 @@ Email: rensongqi1024@gmail.com
 import traceback
 from dataclasses import dataclass
 from types import TracebackType
+from typing import List, Optional
 
 # coding: utf-8
 from sanic.views import HTTPMethodView
@@ -12,14 +13,20 @@ from sanic_ext.extensions.openapi.definitions import Parameter, Response, Reques
 from sanic_ext import openapi, validate
 from tortoise.query_utils import Prefetch
 from tortoise.transactions import in_transaction
-from tortoise.functions import Count, Sum
 
 from core.libs.utils import filter_empty_kvs
 from core.models import \
     WeightRecord, GarbageSource, Region, Vehicle, Department, GarbageType, VehicleType, Driver
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data_response
+from core.libs.concurrency import gather_queries
+from core.libs.weight_cube import weight_cube
+from core.libs.weight_rollup import apply_rollup_deltas, reconcile_rollup, rollup_buckets
+from core.libs.cache import WriteGeneration
+from core.libs.closed_periods import closed_periods
 from core.libs.error_code import ECEnum
 from core.libs.sql_udfs import TruncDateTime
+from core.libs.dimensions import MAX_DIMENSIONS, group_weight_records
 from core.libs.logger import LoggerProxy
 
 logger: LoggerProxy = LoggerProxy(__name__)
@@ -65,6 +72,27 @@ response_example = Response(
 # }
 
 
+async def load_drop_items() -> dict:
+    """称重数据查询-下拉栏数据"""
+    vehicle_types, depts, garbage_types, garbage_sources, region, drivers = await gather_queries(
+        VehicleType.all().values_list("vehicle_type_name", flat=True),
+        Department.all().values_list("department_name", flat=True),
+        GarbageType.all().values_list("garbage_type_name", flat=True),
+        GarbageSource.all().values_list("source_name", flat=True),
+        Region.all().values_list("region_name", flat=True),
+        Driver.all().values_list("driver_name", flat=True),
+    )
+
+    return dict(
+        vehicle_types=vehicle_types,
+        depts=depts,
+        garbage_types=garbage_types,
+        garbage_sources=garbage_sources,
+        region=region,
+        drivers=drivers,
+    )
+
+
 class GetDropItems(HTTPMethodView):
     @openapi.definition(
         summary="称重信息管理-称重数据查询-查看详细-下拉栏",
@@ -72,24 +100,7 @@ class GetDropItems(HTTPMethodView):
     )
     # @login_required
     async def get(self, request):
-        vehicle_types = await VehicleType.all().values_list("vehicle_type_name", flat=True)
-        depts = await Department.all().values_list("department_name", flat=True)
-        garbage_types = await GarbageType.all().values_list("garbage_type_name", flat=True)
-        garbage_sources = await GarbageSource.all().values_list("source_name", flat=True)
-        region = await Region.all().values_list("region_name", flat=True)
-        drivers = await Driver.all().values_list("driver_name", flat=True)
-
-        return response_ok(
-            dict(
-                vehicle_types=vehicle_types,
-                depts=depts,
-                garbage_types=garbage_types,
-                garbage_sources=garbage_sources,
-                region=region,
-                drivers=drivers,
-            ),
-            ECEnum.Success
-        )
+        return await ref_data_response(request, "weight_record_drop_items", load_drop_items)
 
 
 class GetFullWeightRecord(HTTPMethodView):
@@ -191,19 +202,19 @@ class GetWeightRecord(HTTPMethodView):
             # recs = await weight_records.all()
             # print([rec.to_dict() for rec in recs])
             # print("first:", (await WeightRecord.first()).to_dict())
-            record_count = await weight_records.count()
-            if record_count > 0:
-                weight_records = await weight_records\
-                    .limit(length).offset(page_num * length)\
-                    .prefetch_related(
-                        Prefetch(
-                            "garbage_source",
-                            queryset=GarbageSource.all().select_related("region"),
-                            to_attr="to_attr_source"
-                        )
+            # 总数与当前页并发查询
+            record_count, weight_records = await gather_queries(
+                weight_records.count(),
+                weight_records
+                .limit(length).offset(page_num * length)
+                .prefetch_related(
+                    Prefetch(
+                        "garbage_source",
+                        queryset=GarbageSource.all().select_related("region"),
+                        to_attr="to_attr_source"
                     )
-            else:
-                weight_records = []
+                ),
+            )
             # print(a[0].fetch_related(""))
             # print(a[0].garbage_source, type(a[0].garbage_source))
             # print(a[0].to_attr_source.region.region_name, type(a[0].to_attr_source))
@@ -303,17 +314,23 @@ class InsertWeightRecord(HTTPMethodView):
         #               }
 
         try:
-            async with in_transaction():
+            async with in_transaction("default"):
                 related_garbage_source = await GarbageSource.filter(source_name=new_record['garbage_source'])
                 if len(related_garbage_source) != 1:
                     return response_ok(dict(), ECEnum.Fail, msg="对应垃圾来源数据有误")
 
                 new_record['garbage_source'] = related_garbage_source[0]
                 weight_record = await WeightRecord.create(**new_record)
-                return response_ok(
-                    dict(weight_records=[weight_record.to_dict()]),
-                    ECEnum.Success
-                )
+                # 日汇总表在同一事务中累加增量
+                after = await rollup_buckets(WeightRecord.filter(id=weight_record.id))
+                pending = await apply_rollup_deltas((), after)
+            # 提交后补齐汇总期间写入的日期; 补录到已结账月份时删除该月保存的报表结果
+            await reconcile_rollup(pending)
+            await closed_periods.invalidate_records(after)
+            return response_ok(
+                dict(weight_records=[weight_record.to_dict()]),
+                ECEnum.Success
+            )
         except Exception as e:
             traceback.print_exc()
             logger.error(e.with_traceback(None))
@@ -349,12 +366,22 @@ class UpdateWeightRecord(HTTPMethodView):
         new_record = filter_empty_kvs(query_dict['new_record'])
 
         try:
-            async with in_transaction():
-                udpate_num = await WeightRecord.filter(**old_record).update(**new_record)
-                return response_ok(
-                    dict(udpate_num=udpate_num),
-                    ECEnum.Success
-                )
+            async with in_transaction("default"):
+                # 先锁定待修改的记录, 避免并发修改读到同一旧值重复扣减; 修改前后的记录分别从原分组减去, 加到新分组
+                await WeightRecord.select_for_update().filter(**old_record).values_list("id", flat=True)
+                before = await rollup_buckets(WeightRecord.filter(**old_record))
+                record_ids = [row['id'] for row in before]
+                udpate_num = await WeightRecord.filter(id__in=record_ids).update(**new_record) if record_ids else 0
+                after = await rollup_buckets(WeightRecord.filter(id__in=record_ids)) if record_ids else []
+                pending = await apply_rollup_deltas(before, after)
+            weight_cube.mark_stale()
+            WriteGeneration.bump()
+            await reconcile_rollup(pending)
+            await closed_periods.invalidate_records(before, after)
+            return response_ok(
+                dict(udpate_num=udpate_num),
+                ECEnum.Success
+            )
         except Exception as e:
             logger.error(e.with_traceback(None))
             return response_ok(dict(error=str(e.with_traceback(None))), ECEnum.Fail, msg="称重记录更新失败")
@@ -387,15 +414,22 @@ class DeleteWeightRecord(HTTPMethodView):
         old_record = filter_empty_kvs(query_dict['old_record'])
 
         try:
-            async with in_transaction():
-                delete_num = await WeightRecord.filter(**old_record).delete()
-                return response_ok(
-                    dict(
-                        delete_num=delete_num,
-                        old_record=old_record,
-                     ),
-                    ECEnum.Success
-                )
+            async with in_transaction("default"):
+                await WeightRecord.select_for_update().filter(**old_record).values_list("id", flat=True)
+                before = await rollup_buckets(WeightRecord.filter(**old_record))
+                delete_num = await WeightRecord.filter(id__in=[row['id'] for row in before]).delete() if before else 0
+                pending = await apply_rollup_deltas(before, ())
+            weight_cube.mark_stale()
+            WriteGeneration.bump()
+            await reconcile_rollup(pending)
+            await closed_periods.invalidate_records(before)
+            return response_ok(
+                dict(
+                    delete_num=delete_num,
+                    old_record=old_record,
+                 ),
+                ECEnum.Success
+            )
         except Exception as e:
             traceback.print_exc()
             logger.error(e.with_traceback(None))
@@ -404,14 +438,11 @@ class DeleteWeightRecord(HTTPMethodView):
 
 @dataclass
 class WeightRecordClassifyInfo:
-    vehicle_type: str
-    trans_dept: str
-    garbage_type: str
-    garbage_source__source_name: str
-    garbage_source__region__region_name: str
-    time_filtered: bool
-    start_time: str
-    end_time: str
+    dimensions: List[str]  # 分组维度: pound/dept/region/source/type/driver/vehicle/info, 时间 month/day/hour 选其一
+    measures: Optional[List[str]] = None  # 汇总指标: vehicle_num/weight_gross_sum/weight_tare_sum/weight_net_sum
+    filters: Optional[dict] = None  # 维度过滤条件 {维度: id或id列表}
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
 
 
 class ClassifyWeightRecord(HTTPMethodView):
@@ -421,68 +452,60 @@ class ClassifyWeightRecord(HTTPMethodView):
 
     @openapi.definition(
         summary="称重分类查询-统计",
-        description="称重分类查询-统计",
+        description="按白名单维度(最多%d个)分组统计称重记录, 一次分组聚合完成, 条件允许时读取日汇总表" % MAX_DIMENSIONS,
         body=RequestBody(
             content={
                 "application/json": WeightRecordClassifyInfo,
             },
-            description="称重信息",
+            description="""
+                dimensions: list    分组维度 pound/dept/region/source/type/driver/vehicle/info, 时间维度 month/day/hour 选其一
+                measures: list      汇总指标 vehicle_num/weight_gross_sum/weight_tare_sum/weight_net_sum, 默认全部
+                filters: dict       维度过滤条件, 如 {"pound": 1, "type": [1, 2]}
+                start_time: str     2022-02-01 00:00:00
+                end_time: str       2022-02-28 23:59:59
+            """,
             required=True
         ),
-        response=response_example,
+        response=Response(
+            status=200,
+            content={
+                "application/json": {
+                    "example": {
+                        "weight_records": [
+                            {
+                                "dept": "永康市环境卫生管理处",
+                                "dept_id": 51,
+                                "day": "2022-02-01",
+                                "vehicle_num": 102,
+                                "weight_net_sum": "405.78"
+                            },
+                        ],
+                    },
+                },
+            },
+        ),
     )
     # @login_required
     @validate(json=WeightRecordClassifyInfo)
     async def post(self, request, body: WeightRecordClassifyInfo):
-        query_dict = request.json
-        print(query_dict)
-        query_dict = filter_empty_kvs(query_dict)
-        print(query_dict)
         try:
-            # 按时间过滤
-            start_time = query_dict['start_time']
-            end_time = query_dict['end_time']
-            del query_dict['start_time']
-            del query_dict['end_time']
-
-            weight_records = WeightRecord \
-                .filter(time_weightingT__range=[start_time, end_time])
-
-            if len(list(query_dict.keys())) != 1:
-                return response_ok(dict(query_dict=query_dict), ECEnum.InvalidParameter, msg="过滤字段格式有误")
-
-            # 分类统计并按分类项过滤
-            classification = list(query_dict.keys())[0]
-            if query_dict[classification] != 'all':
-                weight_records = weight_records.filter(**query_dict)
-
-            weight_records = await (
-                weight_records
-                .group_by(classification)
-                .annotate(
-                    classified_name=classification,
-                    weight_gross_sum=Sum("weight_gross"),
-                    weight_tare_sum=Sum("weight_tare"),
-                    weight_net_sum=Sum("weight_net"),
-                    vehicle_no_count=Count("vehicle_no"),
-                )
-                .values(
-                    classification,
-                    "weight_gross_sum",
-                    "weight_tare_sum",
-                    "weight_net_sum",
-                    "vehicle_no_count",
-                )
-            )
-
-            return response_ok(
-                dict(weight_records=weight_records),
-                ECEnum.Success
+            weight_records = await group_weight_records(
+                body.dimensions,
+                measures=body.measures,
+                filters=body.filters,
+                start_time=body.start_time or None,
+                end_time=body.end_time or None,
             )
+        except ValueError as e:
+            return response_ok(dict(dimensions=body.dimensions), ECEnum.InvalidParameter, msg=str(e))
         except Exception as e:
             traceback.print_exc()
             logger.error(e)
             return response_ok(dict(error=str(e.with_traceback(None))), ECEnum.Fail, msg="称重记录获取失败")
+        return response_ok(
+            dict(weight_records=weight_records),
+            ECEnum.Success
+        )
 
 
 @dataclass
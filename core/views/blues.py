@@ -25,6 +25,7 @@ from core.views.admin_api.system.pound.blues import bp as pound_blueprint
 from core.views.admin_api.users.blues import bp as user_blueprint
 from core.views.admin_api.driver.blues import bp as driver_blueprint
 from core.views.web_api.statistics.blues import bp as statistic_blueprint
+from core.views.web_api.jobs.blues import bp as jobs_blueprint
 
 
 
@@ -33,6 +34,7 @@ BLUE_TUPLE: Tuple[Blueprint, ...] = (
     driver_blueprint,
     user_blueprint,
     statistic_blueprint,
+    jobs_blueprint,
     region_blueprint,
     garbage_blueprint,
     vehicle_blueprint,
@@ -0,0 +1,13 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from sanic import Blueprint
+from .views import *
+
+bp: Blueprint = Blueprint('jobs', url_prefix='/web_api/jobs')
+
+bp.add_route(SubmitJob.as_view(), "")  # 提交报表任务
+bp.add_route(GetJob.as_view(), "/<job_id:str>")  # 任务状态
+bp.add_route(GetJobResult.as_view(), "/<job_id:str>/result")  # 任务结果
@@ -0,0 +1,105 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from dataclasses import dataclass
+
+from sanic.response import raw
+from sanic.views import HTTPMethodView
+from sanic_ext import openapi
+from sanic_ext import validate
+from sanic_ext.extensions.openapi.definitions import RequestBody, Response
+
+from core.libs.response import response_ok
+from core.libs.error_code import ECEnum
+from core.libs.jobs import DONE, FAILED, QueueFull, report_jobs
+from core.libs.logger import LoggerProxy
+
+logger: LoggerProxy = LoggerProxy(__name__)
+
+
+@dataclass
+class SubmitJobBody:
+    report: str  # 报表名称, 同统计接口路径, 如 get_trans_group_by_date_info
+    params: dict  # 统计接口的请求体
+
+
+class SubmitJob(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-异步报表任务-提交",
+        description="提交统计报表任务, 立即返回任务id; 相同报表和参数的任务在排队或执行中时返回已有任务",
+        body=RequestBody(
+            content={
+                "application/json": SubmitJobBody,
+            },
+            required=True,
+            description="""
+                report: str     get_region_weight_info / get_garbage_source_trans_info /
+                                get_pound_garbage_info / get_trans_group_by_date_info
+                params: dict    统计接口的请求体
+            """,
+        ),
+        response=Response(
+            status=200,
+            content={
+                "application/json": {
+                    "example": {
+                        "id": "3f6c0d4e9a8b4c1f8e2d7a5b6c9d0e1f",
+                        "report": "get_trans_group_by_date_info",
+                        "status": "pending",
+                        "error": None,
+                        "created_at": "2023-02-14 10:00:00",
+                        "started_at": None,
+                        "finished_at": None,
+                        "position": 0
+                    },
+                },
+            },
+        ),
+    )
+    # @login_required
+    @validate(json=SubmitJobBody)
+    async def post(self, request, body: SubmitJobBody):
+        report = request.json['report']
+        params = request.json['params']
+        if not isinstance(params, dict):
+            return response_ok(dict(params=params), ECEnum.InvalidParameter, msg="params须为统计接口的请求体")
+        try:
+            job = report_jobs.submit(report, params)
+        except KeyError:
+            return response_ok(dict(reports=report_jobs.reports), ECEnum.InvalidParameter, msg="不支持的报表")
+        except QueueFull:
+            return response_ok(None, ECEnum.Fail, msg="排队任务过多, 请稍后再试")
+        return response_ok(report_jobs.status(job.id), ECEnum.Success)
+
+
+class GetJob(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-异步报表任务-状态",
+        description="任务状态: pending 排队中(position 为前面的任务数), running 执行中, done 已完成, failed 失败(error 为原因)",
+    )
+    # @login_required
+    async def get(self, request, job_id: str):
+        status = report_jobs.status(job_id)
+        if status is None:
+            return response_ok(dict(id=job_id), ECEnum.NoResourceFound, msg="任务不存在或已过期")
+        return response_ok(status, ECEnum.Success)
+
+
+class GetJobResult(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-异步报表任务-结果",
+        description="已完成任务的结果, 响应体与同步的统计接口一致",
+    )
+    # @login_required
+    async def get(self, request, job_id: str):
+        content = await report_jobs.result(job_id)
+        if content is None:
+            status = report_jobs.status(job_id)
+            if status is None or status['status'] == DONE:
+                return response_ok(dict(id=job_id), ECEnum.NoResourceFound, msg="任务不存在或已过期")
+            if status['status'] == FAILED:
+                return response_ok(status, ECEnum.Fail, msg="任务失败")
+            return response_ok(status, ECEnum.Fail, msg="任务未完成")
+        return raw(content, content_type="application/json")
@@ -10,9 +10,12 @@ bp: Blueprint = Blueprint('statistics', url_prefix='/web_api/statistics')
 
 bp.add_route(GetTransQueryDropItems.as_view(), "/get_trans_query_drop_items")  #
 bp.add_route(GetTransInfo.as_view(), "/get_trans_info")  #
+bp.add_route(ExportTransInfo.as_view(), "/export_trans_info")  #
 bp.add_route(GetWeightInfo.as_view(), "/get_region_weight_info")  #
 bp.add_route(GetGarbageSourceTransInfo.as_view(), "/get_garbage_source_trans_info")  #
 bp.add_route(GetPoundGarbageInfo.as_view(), "/get_pound_garbage_info")  #
 bp.add_route(GetTransGroupByDateInfo.as_view(), "/get_trans_group_by_date_info")  #
+bp.add_route(GetPoundHourlyLoadInfo.as_view(), "/get_pound_hourly_load_info")  #
+bp.add_route(GetRankInfo.as_view(), "/get_rank_info")  #
 # bp.add_route(GetDept.as_view(), "/get_department")  #
 # bp.add_route(GetDeptSTA.as_view(), "/get_department_sta")  #
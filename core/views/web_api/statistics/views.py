@@ -9,11 +9,13 @@ import decimal
 from decimal import Decimal
 import traceback
 from dataclasses import dataclass
+from typing import Optional
+from sanic.response import HTTPResponse
 from sanic.views import HTTPMethodView
 from sanic_ext import openapi
 from sanic_ext import validate
 from sanic_ext.extensions.openapi.definitions import RequestBody, Response, Parameter
-from tortoise.functions import Sum, Count
+from tortoise.functions import Sum, Count, Max
 from tortoise.query_utils import Prefetch
 from tortoise.transactions import in_transaction
 
@@ -21,13 +23,90 @@ from core.libs.utils import filter_empty_kvs
 from core.models import Vehicle, VehicleType, Department, GarbageType, GarbageSource, Region, Driver, Card, Pound, \
     Dictionary, WeightRecord, Operator
 from core.libs.response import response_ok
+from core.libs.ref_data import ref_data_response
 from core.libs.error_code import ECEnum
-from core.libs.sql_udfs import TruncDateTime
+from core.libs.sql_udfs import NetWeightSum, TruncDateTime, aggregate_totals
+from core.libs.weight_rollup import aggregate_weight_records, aggregate_grouping_sets, aggregate_hourly
+from core.libs.aggregation import MEASURES, reduce_groups, union_group_by
+from core.libs.classification import dept_classes
+from core.libs.report_windows import inclusive_window, month_window, report_windows
+from core.libs.periods import parse_time
+from core.libs.dimensions import RANK_LIMIT, rank_weight_records
+from core.libs.jobs import QueueFull, report_jobs
+from core.libs.cost_guard import JOB, REJECT, ROLLUP, cost_guard
+from core.libs.admission import hold_admission
+from core.libs.cache import TTLCache, WriteGeneration, make_key
+from core.libs.response_cache import cached_report, single_flight
+from core.libs.closed_periods import closed_period_report
+from core.libs.concurrency import gather_queries
+from core.libs.pagination import NEXT, PREV, decode_cursor, encode_cursor, page_index, row_key, seek
+from core.libs.export import ARROW_FORMATS, EXPORT_FORMATS, Workbook, arrow_chunks, csv_chunks, format_weight_records, \
+    pa, parquet_chunks, project, xlsx_chunks
 # from tortoise.transactions import in_transaction
 from core.libs.logger import LoggerProxy
 
 logger: LoggerProxy = LoggerProxy(__name__)
 
+# 清运明细表筛选条件下的总数与合计, 键含数据水位与修改计数; ttl 兜底其它进程修改记录的情况
+trans_totals_cache: TTLCache = TTLCache(maxsize=256, ttl=300)
+
+
+async def guard_report(query: dict, report: str, group_by=()) -> Optional[HTTPResponse]:
+    """统计报表的查询代价保护, 需拒绝或已转为后台任务时返回响应, 否则返回None
+
+    :param query: 请求体, 不修改
+    :param report: 转后台任务时的报表名称
+    :param group_by: 报表的分组字段
+    """
+    query_dict = filter_empty_kvs(dict(query))
+    start_time = query_dict.pop('start_time', None)
+    end_time = query_dict.pop('end_time', None)
+    action, estimate = await cost_guard.check(query_dict, start_time, end_time, group_by, deferrable=True)
+    if action == JOB:
+        try:
+            job = report_jobs.submit(report, query)
+        except QueueFull:
+            action = REJECT
+        else:
+            logger.info('%s deferred to job %s, estimated rows: %d' % (report, job.id, estimate))
+            return response_ok(report_jobs.status(job.id), ECEnum.JobAccepted)
+    if action == REJECT:
+        return response_ok(dict(estimated_rows=estimate), ECEnum.QueryTooLarge)
+    return None
+
+
+async def load_trans_query_drop_items() -> dict:
+    """清运明细表查询-下拉栏数据"""
+    pounds, depts, data_types, regions, garbage_sources, garbage_types, drivers = await gather_queries(
+        Pound.all().values("id", "comp_name"),
+        Department.all().values("id", "department_name"),
+        Dictionary.filter(data_type='DataType').values_list("data_value", flat=True),
+        Region.all().values("id", "region_name"),
+        GarbageSource.all().values("id", "source_name"),
+        GarbageType.all().values("id", "garbage_type_name"),
+        Driver.all().values("id", "driver_name"),
+    )
+    pound_garbage_statistic_type = [
+        {
+            "id": 1,
+            "driver_name": "永康市卫生环卫管理处"
+        },
+        {
+            "id": 2,
+            "driver_name": "去除永康市环卫管理处"
+        }
+    ]
+    return dict(
+        pounds=pounds,
+        depts=depts,
+        data_types=data_types,
+        regions=regions,
+        garbage_sources=garbage_sources,
+        garbage_types=garbage_types,
+        drivers=drivers,
+        pound_garbage_statistic_type=pound_garbage_statistic_type,
+    )
+
 
 class GetTransQueryDropItems(HTTPMethodView):
     @openapi.definition(
@@ -96,36 +175,7 @@ class GetTransQueryDropItems(HTTPMethodView):
     )
     # @login_required
     async def get(self, request):
-        pounds = await Pound.all().values("id", "comp_name")
-        depts = await Department.all().values("id", "department_name")
-        data_types = await Dictionary.filter(data_type='DataType').values_list("data_value", flat=True)
-        regions = await Region.all().values("id", "region_name")
-        garbage_sources = await GarbageSource.all().values("id", "source_name")
-        garbage_types = await GarbageType.all().values("id", "garbage_type_name")
-        drivers = await Driver.all().values("id", "driver_name")
-        pound_garbage_statistic_type = [
-            {
-                "id": 1,
-                "driver_name": "永康市卫生环卫管理处"
-            },
-            {
-                "id": 2,
-                "driver_name": "去除永康市环卫管理处"
-            }
-        ]
-        return response_ok(
-            dict(
-                pounds=pounds,
-                depts=depts,
-                data_types=data_types,
-                regions=regions,
-                garbage_sources=garbage_sources,
-                garbage_types=garbage_types,
-                drivers=drivers,
-                pound_garbage_statistic_type=pound_garbage_statistic_type,
-            ),
-            ECEnum.Success
-        )
+        return await ref_data_response(request, "trans_query_drop_items", load_trans_query_drop_items)
 
 
 @dataclass
@@ -165,6 +215,7 @@ class GetTransInfo(HTTPMethodView):
         parameter=[
             Parameter("page", int, "query", required=True, description="页数"),
             Parameter("length", int, "query", required=True, description="页面长度"),
+            Parameter("cursor", str, "query", required=False, description="翻页游标(next_cursor/prev_cursor), 传入时忽略page"),
         ],
         body=RequestBody(
             content={
@@ -221,6 +272,8 @@ class GetTransInfo(HTTPMethodView):
                         "weight_gross_sum": "853.99",
                         "weight_tare_sum": "533.67",
                         "weight_net_sum": "320.32",
+                        "next_cursor(下一页游标)": "WyIyMDIyLTAyLTAxIDAzOjQ5OjAzLjAwMDAwMCIsIDM1Mjg1NiwgIm5leHQiXQ==",
+                        "prev_cursor(上一页游标)": "null",
                     },
 
                 },
@@ -235,67 +288,185 @@ class GetTransInfo(HTTPMethodView):
         length = int(request.args.get("length", 20))
         if length > 100 or length == 0:
             return response_ok(dict(length=length), ECEnum.Fail, msg="请将页面长度设置为大于0小于100")
+        cursor = request.args.get("cursor", None)
+        version = None
+        if cursor:
+            try:
+                cursor_key, direction, version = decode_cursor(cursor)
+            except ValueError:
+                return response_ok(dict(cursor=cursor), ECEnum.InvalidParameter, msg="翻页游标无效")
 
         query_dict = filter_empty_kvs(request.json)
         start_time = query_dict['start_time']
         end_time = query_dict['end_time']
         del query_dict['start_time']
         del query_dict['end_time']
+        # 查询代价保护: 合计可由日汇总表回答时从日汇总表统计, 预估扫描行数过大时拒绝
+        action, estimate = await cost_guard.check(query_dict, start_time, end_time)
+        if action == REJECT:
+            return response_ok(dict(estimated_rows=estimate), ECEnum.QueryTooLarge)
         # 过滤
         filter_weight_records = WeightRecord.filter(
             **query_dict,
             time_weight__range=[start_time, end_time]
         )
-        # 获取称重记录格个数
-        weight_record_num = await filter_weight_records.count()
-
-        # 统计毛重，皮重，净重
-        total_gross_weight = await filter_weight_records.annotate(
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-        ).first()
-        print(total_gross_weight)
+        # 数据版本: 范围内最大id与称重时间及修改计数, 有新增或修改时缓存键随之变化;
+        # 只在无游标时查询, 由游标携带到后续页, 同一次翻页沿用首页的合计
+        if version is None:
+            watermark = await aggregate_totals(
+                filter_weight_records.annotate(max_id=Max("id"), max_time_weight=Max("time_weight")),
+                "max_id",
+                "max_time_weight",
+            )
+            version = make_key(watermark, WriteGeneration.value)
+        filter_key = make_key(query_dict, start_time, end_time, version)
+
+        # 获取称重记录格个数, 统计毛重，皮重，净重; 同一筛选条件翻页时复用
+        async def get_totals() -> dict:
+            cached = trans_totals_cache.get(filter_key)
+            if cached is None and action == ROLLUP:
+                rows = await aggregate_weight_records(query_dict, start_time, end_time)
+                cached = dict(
+                    record_num=rows[0]['vehicle_num'],
+                    weight_gross_sum=rows[0]['weight_gross_sum'],
+                    weight_tare_sum=rows[0]['weight_tare_sum'],
+                    weight_net_sum=rows[0]['weight_net_sum'],
+                ) if rows and rows[0]['vehicle_num'] else dict(
+                    record_num=0, weight_gross_sum=None, weight_tare_sum=None, weight_net_sum=None,
+                )
+                trans_totals_cache.set(filter_key, cached)
+            if cached is None:
+                cached = await aggregate_totals(
+                    filter_weight_records.annotate(
+                        record_num=Count("id"),
+                        weight_gross_sum=Sum("weight_gross"),
+                        weight_tare_sum=Sum("weight_tare"),
+                        weight_net_sum=NetWeightSum(),
+                    ),
+                    "record_num",
+                    "weight_gross_sum",
+                    "weight_tare_sum",
+                    "weight_net_sum",
+                ) or dict(record_num=0, weight_gross_sum=None, weight_tare_sum=None, weight_net_sum=None)
+                trans_totals_cache.set(filter_key, cached)
+            return cached
+
+        # 分页, 按 (称重时间, id) 游标定位; 无游标时通过稀疏页边界索引定位到第 page_num 页
+        index_key = make_key(filter_key, length)
+
+        async def get_page() -> list:
+            if cursor:
+                page = seek(filter_weight_records, cursor_key, direction).limit(length)
+            else:
+                page_key, page_offset = await page_index.locate(filter_weight_records, index_key, page_num, length)
+                page = seek(filter_weight_records, page_key).offset(page_offset).limit(length)
+            # 一次关联查询取出所需列, 不实例化模型
+            return await project(page)
+
+        if not cursor:
+            direction = NEXT
+        # 合计与当前页相互独立, 并发查询
+        totals, weight_records = await gather_queries(get_totals(), get_page())
+        weight_record_num = totals["record_num"]
         weight_gross_sum = 0.00
         weight_tare_sum = 0.00
         weight_net_sum = Decimal(0.00)
 
-        if total_gross_weight.weight_gross_sum is not None and total_gross_weight.weight_tare_sum is not None:
-            weight_gross_sum = total_gross_weight.weight_gross_sum
-            weight_tare_sum = total_gross_weight.weight_tare_sum
-            weight_net_sum = weight_gross_sum - weight_tare_sum
-
-        # 分页
-        weight_records = filter_weight_records.limit(length).offset(page_num * length)
-
-        # 获取关联字段信息
-        weight_records = await weight_records.select_related(
-            "garbage_type_id",
-            "driver_id",
-            "user_id",
-            "pound_id",
-        ).prefetch_related(
-            Prefetch(
-                "vehicle_id",
-                queryset=Vehicle.all().select_related("dept_id")
-            ),
-            Prefetch(
-                "garbage_source_id",
-                queryset=GarbageSource.all().select_related("region_id")
-            ),
-        )
+        if totals["weight_gross_sum"] is not None and totals["weight_tare_sum"] is not None:
+            weight_gross_sum = totals["weight_gross_sum"]
+            weight_tare_sum = totals["weight_tare_sum"]
+            weight_net_sum = totals["weight_net_sum"]
+
+        if direction == PREV:
+            weight_records.reverse()
+
+        next_cursor = None
+        prev_cursor = None
+        if weight_records:
+            if direction == PREV or len(weight_records) == length:
+                next_cursor = encode_cursor(row_key(weight_records[-1]), NEXT, version)
+            if direction == NEXT and (cursor or page_num > 0) or direction == PREV and len(weight_records) == length:
+                prev_cursor = encode_cursor(row_key(weight_records[0]), PREV, version)
+            if not cursor and len(weight_records) == length:
+                page_index.record(index_key, page_num + 1, row_key(weight_records[-1]))
 
         return response_ok(
             dict(
-                weight_records=[weight_record.to_dict() for weight_record in weight_records],
+                weight_records=format_weight_records(weight_records),
                 record_count=weight_record_num,
                 weight_gross_sum=weight_gross_sum,
                 weight_tare_sum=weight_tare_sum,
                 weight_net_sum=weight_net_sum,
+                next_cursor=next_cursor,
+                prev_cursor=prev_cursor,
             ),
             ECEnum.Success
         )
 
 
+class ExportTransInfo(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-清运明细表查询/称重数据明细表-导出",
+        description="按查询条件导出全部称重记录, 分批读取并以分块响应回传, 不受分页长度限制",
+        parameter=[
+            Parameter("format", str, "query", required=False, description="导出格式: csv(默认) / xlsx / arrow / parquet"),
+        ],
+        body=RequestBody(
+            content={
+                "application/json": QueryTransInfo,
+            },
+            required=True,
+            description="与 get_trans_info 查询条件相同",
+        ),
+        response=Response(
+            status=200,
+            content={
+                "text/csv": {},
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": {},
+                "application/vnd.apache.arrow.stream": {},
+                "application/vnd.apache.parquet": {},
+            },
+            description="导出文件; arrow/parquet 为带类型的列式格式(重量为decimal, 时间为timestamp), 供数据分析使用",
+        ),
+    )
+    # @login_required
+    @validate(json=QueryTransInfo)
+    async def post(self, request, body):
+        export_format = request.args.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return response_ok(dict(format=export_format), ECEnum.InvalidParameter, msg="导出格式仅支持csv/xlsx/arrow/parquet")
+        if export_format == "xlsx" and Workbook is None:
+            return response_ok(dict(format=export_format), ECEnum.Fail, msg="服务端未安装openpyxl, 无法导出xlsx")
+        if export_format in ARROW_FORMATS and pa is None:
+            return response_ok(dict(format=export_format), ECEnum.Fail, msg="服务端未安装pyarrow, 无法导出%s" % export_format)
+
+        query_dict = filter_empty_kvs(request.json)
+        start_time = query_dict.pop('start_time')
+        end_time = query_dict.pop('end_time')
+        filter_weight_records = WeightRecord.filter(
+            **query_dict,
+            time_weight__range=[start_time, end_time]
+        )
+
+        content_type, suffix = EXPORT_FORMATS[export_format]
+        chunks = dict(csv=csv_chunks, xlsx=xlsx_chunks, arrow=arrow_chunks, parquet=parquet_chunks)[export_format]
+        # 导出期间一直占用报表槽位, 直到发送完毕
+        release = hold_admission(request)
+        try:
+            response = await request.respond(
+                content_type=content_type,
+                headers={
+                    "Content-Disposition": "attachment; filename=weight_records_%s.%s" % (
+                        datetime.now().strftime("%Y%m%d%H%M%S"), suffix),
+                },
+            )
+            async for chunk in chunks(filter_weight_records):
+                await response.send(chunk)
+            await response.eof()
+        finally:
+            release()
+
+
 @dataclass
 class QueryRegionGarbageInfo:
     pound_id: int  #
@@ -307,6 +478,52 @@ class QueryRegionGarbageInfo:
     end_time: str  #
 
 
+# 运输区域垃圾量汇总表的分组字段
+REGION_WEIGHT_GROUP_BY = (
+    "garbage_source_id__region_id__region_name",
+    "vehicle_id__dept_id__department_name",
+)
+
+
+async def region_weight_report(query: dict) -> dict:
+    """运输区域垃圾量汇总表"""
+    query_dict = filter_empty_kvs(query)
+
+    start_time = query_dict['start_time']
+    end_time = query_dict['end_time']
+    del query_dict['start_time']
+    del query_dict['end_time']
+    # 分组统计与合计相互独立, 并发查询; 合计按清运单位是否属于环卫处分类条件汇总
+    group_weight_records, totals = await gather_queries(
+        aggregate_weight_records(
+            query_dict,
+            start_time,
+            end_time,
+            group_by=REGION_WEIGHT_GROUP_BY,
+        ),
+        aggregate_weight_records(
+            query_dict,
+            start_time,
+            end_time,
+            splits=dict(
+                sanitation=dept_classes.member("SANITATION"),
+                towns=dept_classes.non_member("SANITATION"),
+            ),
+        ),
+    )
+    totals = totals[0] if totals else {}
+
+    return dict(
+        group_weight_records=group_weight_records,
+        vehicle_num_total=totals.get('vehicle_num') or 0,
+        weight_net_total=totals.get('weight_net_sum') or Decimal(0.00),
+        sanitation_total_vehicle_num=totals.get('sanitation_vehicle_num') or 0,
+        sanitation_total_garbage_weight=totals.get('sanitation_weight_net_sum') or Decimal(0.00),
+        towns_total_vehicle_num=totals.get('towns_vehicle_num') or 0,
+        towns_total_garbage_weight=totals.get('towns_weight_net_sum') or Decimal(0.00),
+    )
+
+
 class GetWeightInfo(HTTPMethodView):
     @openapi.definition(
         summary="数据查询-运输区域垃圾量汇总表-查询",
@@ -367,65 +584,14 @@ class GetWeightInfo(HTTPMethodView):
         ),
     )
     # @login_required
+    @single_flight()
+    @cached_report()
     @validate(json=QueryRegionGarbageInfo)
     async def post(self, request, body: QueryRegionGarbageInfo):
-        query_dict = filter_empty_kvs(request.json)
-
-        start_time = query_dict['start_time']
-        end_time = query_dict['end_time']
-        del query_dict['start_time']
-        del query_dict['end_time']
-        group_weight_records = await WeightRecord.filter(
-            **query_dict,
-            time_weight__range=[start_time, end_time]
-        ).annotate(
-            vehicle_num=Count("id_center"),
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-        ).group_by(
-            "garbage_source_id__region_id__region_name",
-            "vehicle_id__dept_id__department_name"
-        ).values(
-            "garbage_source_id__region_id__region_name",
-            "vehicle_id__dept_id__department_name",
-            "vehicle_num",
-            "weight_gross_sum",
-            "weight_tare_sum",
-        )
-
-        sanitation_dept_names = await Department.filter(id=349).values_list("department_name", flat=True)
-        sanitation_dept_name = sanitation_dept_names[0]
-        print(sanitation_dept_name)
-        # TODO，剩余合计和按乡镇，环卫处分类
-        vehicle_num_total = Decimal(0)
-        weight_net_total = Decimal(0.00)
-        sanitation_total_vehicle_num = Decimal(0)
-        sanitation_total_garbage_weight = Decimal(0.00)
-        towns_total_vehicle_num = Decimal(0)
-        towns_total_garbage_weight = Decimal(0.00)
-        for d in group_weight_records:
-            d['weight_net_sum'] = d['weight_gross_sum'] - d['weight_tare_sum']
-            vehicle_num_total += d['vehicle_num']
-            weight_net_total += d['weight_net_sum']
-            if d['vehicle_id__dept_id__department_name'] == sanitation_dept_name:
-                sanitation_total_vehicle_num += d['vehicle_num']
-                sanitation_total_garbage_weight += d['weight_net_sum']
-            else:
-                towns_total_vehicle_num += d['vehicle_num']
-                towns_total_garbage_weight += d['weight_net_sum']
-
-        return response_ok(
-            dict(
-                group_weight_records=group_weight_records,
-                vehicle_num_total=vehicle_num_total,
-                weight_net_total=weight_net_total,
-                sanitation_total_vehicle_num=sanitation_total_vehicle_num,
-                sanitation_total_garbage_weight=sanitation_total_garbage_weight,
-                towns_total_vehicle_num=towns_total_vehicle_num,
-                towns_total_garbage_weight=towns_total_garbage_weight,
-            ),
-            ECEnum.Success
-        )
+        guarded = await guard_report(request.json, "get_region_weight_info", REGION_WEIGHT_GROUP_BY)
+        if guarded is not None:
+            return guarded
+        return response_ok(await region_weight_report(request.json), ECEnum.Success)
 
 
 @dataclass
@@ -438,6 +604,33 @@ class QueryGarbageSourceTransInfo:
     month: str
 
 
+async def garbage_source_trans_report(query: dict) -> dict:
+    """垃圾来源清运统计表"""
+    query_dict = filter_empty_kvs(query)
+
+    # month 在统计层改写为称重时间的半开区间; 按来源和日期统计一次, 上卷得到按日期, 按来源的统计
+    grouping_sets = await aggregate_grouping_sets(
+        query_dict,
+        grouping_sets=dict(
+            group_weight_records=("garbage_source_id__source_name", "date"),
+            vehicle_num_groupBy_date=("date",),
+            vehicle_num_groupBy_garbage_source=("garbage_source_id__source_name",),
+        ),
+        date_format='%d',
+    )
+    for records in grouping_sets.values():
+        for record in records:
+            del record['weight_gross_sum']
+            del record['weight_tare_sum']
+            del record['weight_net_sum']
+
+    return dict(
+        group_weight_records=grouping_sets['group_weight_records'],
+        vehicle_num_groupBy_date=grouping_sets['vehicle_num_groupBy_date'],
+        vehicle_num_groupBy_garbage_source=grouping_sets['vehicle_num_groupBy_garbage_source'],
+    )
+
+
 class GetGarbageSourceTransInfo(HTTPMethodView):
     @openapi.definition(
         summary="数据查询-垃圾来源清运统计表-查询",
@@ -492,61 +685,12 @@ class GetGarbageSourceTransInfo(HTTPMethodView):
         )
     )
     # @login_required
+    @single_flight()
+    @closed_period_report("get_garbage_source_trans_info")
+    @cached_report()
     @validate(json=QueryGarbageSourceTransInfo)
     async def post(self, request, body: QueryRegionGarbageInfo):
-        query_dict = filter_empty_kvs(request.json)
-
-        month = query_dict['month']
-        del query_dict['month']
-        group_weight_records = await WeightRecord.filter(
-            **query_dict,
-            month=month,
-        ).annotate(
-            vehicle_num=Count("id_center"),
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-            month=TruncDateTime('time_weight', '%Y-%m'),
-            date=TruncDateTime('time_weight', '%d'),
-        ).group_by(
-            "garbage_source_id__source_name",
-            "date"
-        ).values(
-            "garbage_source_id__source_name",
-            "date",
-            "vehicle_num",
-        )
-
-        vehicle_num_groupBy_date = await WeightRecord.filter(
-            **query_dict,
-        ).annotate(
-            vehicle_num=Count("id_center"),
-            date=TruncDateTime('time_weight', '%d'),
-        ).group_by(
-            "date"
-        ).values(
-            "date",
-            "vehicle_num",
-        )
-
-        vehicle_num_groupBy_garbage_source = await WeightRecord.filter(
-            **query_dict,
-        ).annotate(
-            vehicle_num=Count("id_center"),
-        ).group_by(
-            "garbage_source_id__source_name"
-        ).values(
-            "garbage_source_id__source_name",
-            "vehicle_num",
-        )
-
-        return response_ok(
-            dict(
-                group_weight_records=group_weight_records,
-                vehicle_num_groupBy_date=vehicle_num_groupBy_date,
-                vehicle_num_groupBy_garbage_source=vehicle_num_groupBy_garbage_source,
-            ),
-            ECEnum.Success
-        )
+        return response_ok(await garbage_source_trans_report(request.json), ECEnum.Success)
 
 
 @dataclass
@@ -556,6 +700,81 @@ class QueryPoundGarbageInfo:
     month: str
 
 
+# 地磅清运统计的类型: 1 永康市卫生环卫管理处, 2 去除永康市环卫管理处, 0 全部
+POUND_GARBAGE_TYPES = (1, 2)
+
+
+def pound_type_condition(data_type: int) -> Optional[dict]:
+    """地磅清运统计类型对应的清运单位条件, 全部时返回None"""
+    if data_type == 1:
+        return dept_classes.member("POUND_SANITATION")
+    if data_type == 2:
+        return dept_classes.non_member("POUND_SANITATION", include_unassigned=False)
+    return None
+
+
+async def load_pound_garbage_window(pound_id: int, start: datetime, end: datetime) -> list:
+    """地磅清运统计的标准时间窗口: 按日期统计, 含各类型的条件汇总"""
+    return await aggregate_weight_records(
+        dict(pound_id=pound_id),
+        start,
+        end,
+        group_by=("date",),
+        date_format='%d',
+        end_inclusive=False,
+        splits={"type%d" % t: pound_type_condition(t) for t in POUND_GARBAGE_TYPES},
+    )
+
+
+report_windows.register("pound_garbage", load_pound_garbage_window)
+
+
+async def pound_garbage_report(query: dict) -> dict:
+    """地磅清运统计汇总表"""
+    query_dict = dict(query)
+    data_type = query_dict['type']
+    del query_dict['type']
+    query_dict = filter_empty_kvs(query_dict)
+    # month 在统计层改写为称重时间的半开区间
+    # 按日期统计一次, type 对应的清运单位分类在同一查询中条件汇总; 全部上卷得到月合计
+    typed = pound_type_condition(data_type)
+    split = "type%d" % data_type
+    # 单个地磅本月/上月的统计已预计算
+    window = month_window(query_dict['month']) if set(query_dict) == {'pound_id', 'month'} else None
+    weight_records_group_by_date_all = await report_windows.get("pound_garbage", query_dict.get('pound_id'), window)
+    if weight_records_group_by_date_all is None:
+        weight_records_group_by_date_all = await aggregate_weight_records(
+            query_dict,
+            group_by=("date",),
+            date_format='%d',
+            splits={split: typed} if typed is not None else None,
+        )
+    prefix = split + '_' if typed is not None else ''
+    weight_records_group_by_date = [
+        dict(date=r['date'], **{m: r[prefix + m] for m in MEASURES})
+        for r in weight_records_group_by_date_all if r[prefix + 'vehicle_num']
+    ]
+    weight_records_group_by_month = reduce_groups(weight_records_group_by_date_all, ())
+
+    vehicle_num_total = 0
+    weight_net_total = 0.00
+    weight_gross_total = 0.00
+    weight_tare_total = 0.00
+    month_total = weight_records_group_by_month[0] if weight_records_group_by_month else {}
+    if month_total.get('vehicle_num') and month_total['weight_gross_sum'] is not None:
+        vehicle_num_total = month_total['vehicle_num']
+        weight_net_total = month_total['weight_net_sum']
+        weight_gross_total = month_total['weight_gross_sum']
+        weight_tare_total = month_total['weight_tare_sum']
+    return dict(
+        weight_records_group_by_date=weight_records_group_by_date,
+        vehicle_num_total=vehicle_num_total,
+        weight_net_total=weight_net_total,
+        weight_gross_total=weight_gross_total,
+        weight_tare_total=weight_tare_total,
+    )
+
+
 class GetPoundGarbageInfo(HTTPMethodView):
     @openapi.definition(
         summary="数据查询-地磅清运统计汇总表-查询",
@@ -594,71 +813,12 @@ class GetPoundGarbageInfo(HTTPMethodView):
         )
     )
     # @login_required
+    @single_flight()
+    @closed_period_report("get_pound_garbage_info", lambda: dept_classes.dept_ids("POUND_SANITATION"))
+    @cached_report()
     @validate(json=QueryPoundGarbageInfo)
     async def post(self, request, body: QueryRegionGarbageInfo):
-
-        query_dict = request.json
-        data_type = query_dict['type']
-        month = query_dict['month']
-        del query_dict['month']
-        del query_dict['type']
-        query_dict = filter_empty_kvs(query_dict)
-        weight_records_group_by_date = WeightRecord.filter(
-            **query_dict,
-            month=month,
-        ).annotate(
-            vehicle_num=Count("id_center"),
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-            month=TruncDateTime('time_weight', '%Y-%m'),
-            date=TruncDateTime('time_weight', '%d'),
-        ).group_by(
-            "date"
-        ).values(
-            "date",
-            "vehicle_num",
-            "weight_gross_sum",
-            "weight_tare_sum",
-        )
-        if data_type == 1:
-            weight_records_group_by_date = weight_records_group_by_date.filter(vehicle_id__dept_id=51)
-        elif data_type == 2:
-            weight_records_group_by_date = weight_records_group_by_date.filter(vehicle_id__dept_id__not=51)
-
-        weight_records_group_by_date = await weight_records_group_by_date
-
-        weight_records_group_by_month = await WeightRecord.filter(
-            **query_dict,
-            month=month,
-        ).annotate(
-            month=TruncDateTime('time_weight', '%Y-%m'),
-            vehicle_num=Count("id_center"),
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-        )
-
-        for record in weight_records_group_by_date:
-            record['weight_net_sum'] = record['weight_gross_sum'] - record['weight_tare_sum']
-
-        vehicle_num_total = 0
-        weight_net_total = 0.00
-        weight_gross_total = 0.00
-        weight_tare_total = 0.00
-        if weight_records_group_by_month[0].id_center is not None:
-            vehicle_num_total = weight_records_group_by_month[0].vehicle_num
-            weight_net_total = weight_records_group_by_month[0].weight_gross_sum - weight_records_group_by_month[0].weight_tare_sum
-            weight_gross_total = weight_records_group_by_month[0].weight_gross_sum
-            weight_tare_total = weight_records_group_by_month[0].weight_tare_sum
-        return response_ok(
-            dict(
-                weight_records_group_by_date=weight_records_group_by_date,
-                vehicle_num_total=vehicle_num_total,
-                weight_net_total=weight_net_total,
-                weight_gross_total=weight_gross_total,
-                weight_tare_total=weight_tare_total,
-            ),
-            ECEnum.Success
-        )
+        return response_ok(await pound_garbage_report(request.json), ECEnum.Success)
 
 
 @dataclass
@@ -671,6 +831,28 @@ class QueryTransInfo:
     end_time: str
 
 
+# 清运量报表(按日统计)的分组集合
+TRANS_GROUPING_SETS = dict(
+    weight_records_group_by_date_source=("date", "garbage_source_id__source_name"),
+    weight_records_group_by_date=("date",),
+    weight_records_group_by_source=("garbage_source_id__source_name",),
+)
+
+
+async def load_trans_group_by_date_window(pound_id: int, start: datetime, end: datetime) -> dict:
+    """清运量报表(按日统计)的标准时间窗口"""
+    return await aggregate_grouping_sets(
+        dict(pound_id=pound_id),
+        start,
+        end,
+        grouping_sets=TRANS_GROUPING_SETS,
+        end_inclusive=False,
+    )
+
+
+report_windows.register("trans_group_by_date", load_trans_group_by_date_window)
+
+
 # {
 #   "pound_id": 0,
 #   "vehicle_id__dept_id": 0,
@@ -686,6 +868,38 @@ class QueryTransInfo:
 # }
 
 
+async def trans_group_by_date_report(query: dict) -> dict:
+    """清运量报表(按日统计)"""
+    query_dict = filter_empty_kvs(query)
+
+    start_time = query_dict['start_time']
+    end_time = query_dict['end_time']
+    del query_dict['start_time']
+    del query_dict['end_time']
+    # 按日期和垃圾来源统计一次, 上卷得到按日期, 按垃圾来源的统计; 单个地磅今日/本月/上月的统计已预计算
+    grouping_sets = None
+    if set(query_dict) == {'pound_id'}:
+        grouping_sets = await report_windows.get(
+            "trans_group_by_date", query_dict['pound_id'], inclusive_window(start_time, end_time),
+        )
+    if grouping_sets is None:
+        grouping_sets = await aggregate_grouping_sets(
+            query_dict,
+            start_time,
+            end_time,
+            grouping_sets=TRANS_GROUPING_SETS,
+        )
+    for records in grouping_sets.values():
+        for record in records:
+            del record['vehicle_num']
+
+    return dict(
+        weight_records_group_by_date_source=grouping_sets['weight_records_group_by_date_source'],
+        weight_records_group_by_date=grouping_sets['weight_records_group_by_date'],
+        weight_records_group_by_source=grouping_sets['weight_records_group_by_source'],
+    )
+
+
 class GetTransGroupByDateInfo(HTTPMethodView):
     @openapi.definition(
         summary="数据查询-清运量报表（按日统计）-查询",
@@ -737,6 +951,8 @@ class GetTransGroupByDateInfo(HTTPMethodView):
         )
     )
     # @login_required
+    @single_flight()
+    @cached_report()
     @validate(json=QueryTransInfo)
     async def post(self, request, body):
         page_num = int(request.args.get("page", 0))
@@ -744,77 +960,229 @@ class GetTransGroupByDateInfo(HTTPMethodView):
         if length > 100 or length == 0:
             return response_ok(dict(length=length), ECEnum.Fail, msg="请将页面长度设置为大于0小于100")
 
-        query_dict = filter_empty_kvs(request.json)
-
-        start_time = query_dict['start_time']
-        end_time = query_dict['end_time']
-        del query_dict['start_time']
-        del query_dict['end_time']
-        # 按日期和垃圾来源统计
-        weight_records_group_by_date_source = await WeightRecord.filter(
-            **query_dict,
-            time_weight__range=[start_time, end_time]
-        ).select_related(
-            "garbage_source_id"
-        ).annotate(
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-            date=TruncDateTime('time_weight', '%Y-%m-%d'),
-        ).group_by(
-            "date",
-            "garbage_source_id__source_name"
-        ).values(
-            "date",
-            "weight_gross_sum",
-            "weight_tare_sum",
-            "garbage_source_id__source_name",
+        guarded = await guard_report(
+            request.json, "get_trans_group_by_date_info", union_group_by(TRANS_GROUPING_SETS),
         )
-        for record in weight_records_group_by_date_source:
-            record['weight_net_sum'] = record['weight_gross_sum'] - record['weight_tare_sum']
+        if guarded is not None:
+            return guarded
+        return response_ok(await trans_group_by_date_report(request.json), ECEnum.Success)
 
-        # 按日期统计
-        weight_records_group_by_date = await WeightRecord.filter(
-            **query_dict,
-            time_weight__range=[start_time, end_time]
-        ).annotate(
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-            date=TruncDateTime('time_weight', '%Y-%m-%d'),
-        ).group_by(
-            "date",
-        ).values(
-            "date",
-            "weight_gross_sum",
-            "weight_tare_sum",
-        )
-        for record in weight_records_group_by_date:
-            record['weight_net_sum'] = record['weight_gross_sum'] - record['weight_tare_sum']
 
-        # 按部门统计
-        weight_records_group_by_source = await WeightRecord.filter(
-            **query_dict,
-            time_weight__range=[start_time, end_time]
-        ).select_related(
-            "garbage_source_id"
-        ).annotate(
-            weight_gross_sum=Sum("weight_gross"),
-            weight_tare_sum=Sum("weight_tare"),
-        ).group_by(
-            "garbage_source_id__source_name"
-        ).values(
-            "weight_gross_sum",
-            "weight_tare_sum",
-            "garbage_source_id__source_name",
+@dataclass
+class QueryPoundHourlyLoadInfo:
+    pound_id: int  # 地磅站id, 为空时统计全部地磅站
+    start_time: str  # 2022-02-01 00:00:00
+    end_time: str  # 2022-02-28 23:59:59
+    peak_num: int  # 高峰小时数, 为空时为 PEAK_HOURS
+
+
+# 默认返回的高峰小时数
+PEAK_HOURS = 3
+
+
+async def pound_hourly_load_report(query: dict) -> dict:
+    """地磅站到站负荷(按小时统计)"""
+    query_dict = filter_empty_kvs(dict(query))
+    start_time = query_dict.pop('start_time', None)
+    end_time = query_dict.pop('end_time', None)
+    peak_num = int(query_dict.pop('peak_num', None) or PEAK_HOURS)
+    rows = await aggregate_hourly(query_dict, start_time, end_time)
+
+    start = parse_time(start_time) if start_time else None
+    end = parse_time(end_time) if end_time else None
+    # 范围内的自然日数, 用于计算日均车数; 未给出范围时不计算
+    days = (end.date() - start.date()).days + 1 if start is not None and end is not None else None
+    pound_ids = sorted({row['pound_id_id'] for row in rows}, key=lambda i: (i is None, i or 0))
+    pound_names = dict(await Pound.filter(id__in=[i for i in pound_ids if i is not None]).values_list("id", "comp_name"))
+    by_pound_hour = {(row['pound_id_id'], row['hour']): row for row in rows}
+
+    pounds = []
+    for pound_id in pound_ids:
+        hours = []
+        for hour in range(24):
+            row = by_pound_hour.get((pound_id, hour))
+            vehicle_num = row['vehicle_num'] if row is not None else 0
+            hours.append(dict(
+                hour=hour,
+                vehicle_num=vehicle_num,
+                weight_net_sum=row['weight_net_sum'] if row is not None else Decimal("0.00"),
+                avg_vehicle_num=round(vehicle_num / days, 2) if days else None,
+            ))
+        peak_hours = sorted(
+            (h for h in hours if h['vehicle_num']),
+            key=lambda h: (-h['vehicle_num'], h['hour']),
+        )[:peak_num]
+        pounds.append(dict(
+            pound_id=pound_id,
+            pound_name=pound_names.get(pound_id),
+            vehicle_num=sum(h['vehicle_num'] for h in hours),
+            weight_net_sum=sum((h['weight_net_sum'] for h in hours), Decimal("0.00")),
+            hours=hours,
+            peak_hours=peak_hours,
+        ))
+    return dict(days=days, pounds=pounds)
+
+
+class GetPoundHourlyLoadInfo(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-地磅站到站负荷（按小时统计）-查询",
+        description="各地磅站在时间范围内每个小时(0-23时)的车数与净重合计, 日均车数及车数最多的高峰小时, 用于安排过磅人员",
+        body=RequestBody(
+            content={
+                "application/json": QueryPoundHourlyLoadInfo,
+            },
+            required=True,
+            description="""
+                pound_id: int       地磅站id, 0表示全部地磅站
+                start_time: str     2022-02-01 00:00:00
+                end_time: str       2022-02-28 23:59:59
+                peak_num: int       高峰小时数, 0表示默认3个
+            """,
+        ),
+        response=Response(
+            status=200,
+            content={
+                "application/json": {
+                    "example": {
+                        "days(天数)": 28,
+                        "pounds": [
+                            {
+                                "pound_id": 22,
+                                "pound_name(收货单位)": "伟明环保能源有限公司",
+                                "vehicle_num(车数)": 4765,
+                                "weight_net_sum(净重)": "26332.46",
+                                "hours": [
+                                    {
+                                        "hour(小时)": 7,
+                                        "vehicle_num(车数)": 512,
+                                        "weight_net_sum(净重)": "2830.15",
+                                        "avg_vehicle_num(日均车数)": 18.29
+                                    },
+                                ],
+                                "peak_hours(高峰小时, 按车数降序)": [
+                                    {
+                                        "hour": 7,
+                                        "vehicle_num": 512,
+                                        "weight_net_sum": "2830.15",
+                                        "avg_vehicle_num": 18.29
+                                    },
+                                ]
+                            },
+                        ]
+                    },
+                },
+            },
         )
+    )
+    # @login_required
+    @single_flight()
+    @cached_report()
+    @validate(json=QueryPoundHourlyLoadInfo)
+    async def post(self, request, body: QueryPoundHourlyLoadInfo):
+        return response_ok(await pound_hourly_load_report(request.json), ECEnum.Success)
 
-        for record in weight_records_group_by_source:
-            record['weight_net_sum'] = record['weight_gross_sum'] - record['weight_tare_sum']
 
-        return response_ok(
-            dict(
-                weight_records_group_by_date_source=weight_records_group_by_date_source,
-                weight_records_group_by_date=weight_records_group_by_date,
-                weight_records_group_by_source=weight_records_group_by_source,
-            ),
-            ECEnum.Success
+def _invalid_parameter(data: dict, msg: str) -> HTTPResponse:
+    """参数错误, 响应状态码为400"""
+    response = response_ok(data, ECEnum.InvalidParameter, msg=msg)
+    response.status = 400
+    return response
+
+
+@dataclass
+class QueryRankInfo:
+    dimension: str  # 排名维度: source/vehicle/driver/pound/dept/region/type/info
+    measure: Optional[str] = None  # 排名指标: vehicle_num/weight_gross_sum/weight_tare_sum/weight_net_sum, 默认净重
+    limit: Optional[int] = None  # 名次数, 默认20, 最大100
+    filters: Optional[dict] = None  # 维度过滤条件 {维度: id或id列表}
+    start_time: Optional[str] = None  # 2022-01-01 00:00:00
+    end_time: Optional[str] = None  # 2022-03-31 23:59:59
+
+
+class GetRankInfo(HTTPMethodView):
+    @openapi.definition(
+        summary="数据查询-排名（前N名）-查询",
+        description="按垃圾来源/车辆/司机等维度统计, 返回指标最大的前N名及其余合并的其它; 指标相同名次相同",
+        body=RequestBody(
+            content={
+                "application/json": QueryRankInfo,
+            },
+            required=True,
+            description="""
+                dimension: str      source 垃圾来源 / vehicle 车辆 / driver 司机 / pound / dept / region / type / info
+                measure: str        vehicle_num / weight_gross_sum / weight_tare_sum / weight_net_sum, 默认 weight_net_sum
+                limit: int          名次数, 默认20, 最大100
+                filters: dict       维度过滤条件, 如 {"pound": 22, "type": [1, 2]}
+                start_time: str     2022-01-01 00:00:00
+                end_time: str       2022-03-31 23:59:59
+            """,
+        ),
+        response=Response(
+            status=200,
+            content={
+                "application/json": {
+                    "example": {
+                        "ranking": [
+                            {
+                                "rank(名次)": 1,
+                                "source(垃圾来源)": "胜利街",
+                                "source_id": 267,
+                                "vehicle_num(车数)": 1523,
+                                "weight_gross_sum(毛重)": "25318.20",
+                                "weight_tare_sum(皮重)": "17130.55",
+                                "weight_net_sum(净重)": "8187.65"
+                            },
+                        ],
+                        "others(其余分组合计)": {
+                            "group_num(分组数)": 131,
+                            "vehicle_num": 20311,
+                            "weight_gross_sum": "301250.12",
+                            "weight_tare_sum": "214633.40",
+                            "weight_net_sum": "86616.72"
+                        },
+                        "total(总计)": {
+                            "group_num": 151,
+                            "vehicle_num": 38720,
+                            "weight_gross_sum": "651230.88",
+                            "weight_tare_sum": "452117.03",
+                            "weight_net_sum": "199113.85"
+                        },
+                        "tie_at_limit(第N+1名与第N名并列)": False
+                    },
+                },
+            },
         )
+    )
+    # @login_required
+    @single_flight()
+    @cached_report()
+    @validate(json=QueryRankInfo)
+    async def post(self, request, body: QueryRankInfo):
+        # 时间在查询前解析, 格式错误时返回400, 不交给数据库比较
+        times = {}
+        for name in ("start_time", "end_time"):
+            value = getattr(body, name)
+            times[name] = parse_time(value) if value else None
+            if value and times[name] is None:
+                return _invalid_parameter({name: value}, "%s传入时间格式错误" % name)
+        start, end = times["start_time"], times["end_time"]
+        if start is not None and end is not None and start > end:
+            return _invalid_parameter(dict(start_time=body.start_time, end_time=body.end_time), "开始时间不能晚于结束时间")
+        try:
+            ranking = await rank_weight_records(
+                body.dimension,
+                measure=body.measure or "weight_net_sum",
+                limit=body.limit or RANK_LIMIT,
+                filters=body.filters,
+                **times,
+            )
+        except ValueError as e:
+            return _invalid_parameter(dict(dimension=body.dimension), str(e))
+        return response_ok(ranking, ECEnum.Success)
+
+
+# 可提交为异步任务的报表, 名称同接口路径
+report_jobs.register("get_region_weight_info", region_weight_report)
+report_jobs.register("get_garbage_source_trans_info", garbage_source_trans_report)
+report_jobs.register("get_pound_garbage_info", pound_garbage_report)
+report_jobs.register("get_trans_group_by_date_info", trans_group_by_date_report)
@@ -37,8 +37,9 @@ class TomlConfig(Config):
             upper_key = key.upper()
             # print(isinstance(value, list))
             if isinstance(value, list):
+                # 列表项为表时转换键, 其它值(如id列表)原样保留
                 retval[upper_key] = [
-                    self._to_uppercase(item) for item in value
+                    self._to_uppercase(item) if isinstance(item, dict) else item for item in value
                 ]
             elif isinstance(value, dict):
                 retval[upper_key] = self._to_uppercase(value)
@@ -0,0 +1,117 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import asyncio
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+# 测试数据的起始时间
+BASE_TIME = datetime(2022, 2, 1)
+
+
+def _date_format(value, fmt):
+    """sqlite 中模拟 MySQL 的 DATE_FORMAT"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('T', ' ')[:26])
+    return value.strftime(fmt.replace('%i', '%M'))
+
+
+@pytest.fixture
+def run():
+    """初始化内存 sqlite 数据库, 返回在同一事件循环中执行协程的函数"""
+    from tortoise import Tortoise, connections
+    from core.libs.weight_cube import weight_cube
+    from core.libs.weight_rollup import RollupState
+
+    async def init():
+        await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["core.models"]})
+        await Tortoise.generate_schemas()
+        connection = connections.get("default")
+        await connection._connection.create_function("DATE_FORMAT", 2, _date_format)
+        await connection.execute_script("PRAGMA foreign_keys=OFF")
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(init())
+    yield loop.run_until_complete
+    loop.run_until_complete(Tortoise.close_connections())
+    loop.close()
+    weight_cube.ready = weight_cube.stale = False
+    RollupState.sealed_until = None
+    RollupState.rebuilding.clear()
+    RollupState.dirty.clear()
+    RollupState.stale.clear()
+
+
+async def _make(model, **kwargs):
+    """新建记录, 未指定的必填字段取零值"""
+    from tortoise import fields
+
+    zero_values = {int: 0, str: '', Decimal: Decimal(0), datetime: BASE_TIME}
+    for name, field in model._meta.fields_map.items():
+        if name in kwargs or field.pk or field.null or getattr(field, 'default', None) is not None:
+            continue
+        if isinstance(field, (fields.relational.BackwardFKRelation, fields.relational.ManyToManyFieldInstance)):
+            continue
+        if name in model._meta.fk_fields:
+            if name + '_id' not in kwargs:
+                kwargs[name + '_id'] = 0
+            continue
+        if name.endswith('_id') and name[:-3] in model._meta.fk_fields:
+            continue
+        kwargs[name] = zero_values.get(field.field_type, 0)
+    return await model.create(**kwargs)
+
+
+@pytest.fixture
+def make(run):
+    """新建记录的协程函数 make(模型, **字段), 未指定的必填字段取零值"""
+    return _make
+
+
+@pytest.fixture
+def seed_records(run):
+    """生成维表与称重记录的协程函数 seed(num, days): days 天内随机 num 条记录, 含无垃圾来源, 无数据类型的记录"""
+    from core.models import \
+        Department, Driver, GarbageSource, GarbageType, Operator, Pound, Region, Vehicle, WeightRecord
+
+    async def seed(num: int = 400, days: int = 10):
+        rng = random.Random(1)
+        regions = [await _make(Region, region_name="区域%d" % i) for i in range(3)]
+        depts = [await _make(Department, id=dept_id, department_name="单位%d" % dept_id) for dept_id in (51, 52, 349)]
+        pounds = [await _make(Pound, comp_name="地磅站%d" % i, dept_id=depts[0]) for i in range(2)]
+        vehicles = [
+            await _make(Vehicle, vehicle_no="车%d" % i, dept_id=depts[i % 3], max_net_weight=Decimal(10))
+            for i in range(6)
+        ]
+        sources = [await _make(GarbageSource, source_name="来源%d" % i, region_id=regions[i % 3]) for i in range(5)]
+        garbage_types = [await _make(GarbageType, garbage_type_name="类别%d" % i) for i in range(2)]
+        drivers = [await _make(Driver, driver_name="司机%d" % i, dept_id=depts[0]) for i in range(3)]
+        await _make(Operator, user_id="u1", username="计量员", dept_id=depts[0])
+        records = []
+        for i in range(num):
+            gross = Decimal(rng.randint(1000, 3000)) / 100
+            records.append(WeightRecord(
+                id_center=i + 1,
+                vehicle_id=rng.choice(vehicles),
+                garbage_source_id=rng.choice(sources + [None]),
+                garbage_type_id=rng.choice(garbage_types),
+                pound_id=rng.choice(pounds),
+                driver_id=rng.choice(drivers),
+                time_weight=BASE_TIME + timedelta(seconds=rng.randint(0, days * 86400 - 1)),
+                weight_gross=gross,
+                weight_tare=gross - Decimal(rng.randint(100, 900)) / 100,
+                operator_id=0,
+                data_mark=0,
+                info=rng.choice(["1期", "2期", None]),
+                user_id_id="u1",
+            ))
+        await WeightRecord.bulk_create(records)
+
+    return seed
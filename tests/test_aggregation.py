@@ -0,0 +1,63 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("core")
+
+from core.libs.aggregation import reduce_groups, split_grouping_sets, union_group_by
+
+ROWS = [
+    dict(date="2022-02-01", pound_id_id=1, vehicle_num=2, weight_gross_sum=Decimal("30.5"), weight_tare_sum=Decimal("10"),
+         weight_net_sum=Decimal("20.5")),
+    dict(date="2022-02-01", pound_id_id=2, vehicle_num=1, weight_gross_sum=Decimal("12"), weight_tare_sum=None,
+         weight_net_sum=Decimal("12")),
+    dict(date="2022-02-02", pound_id_id=1, vehicle_num=3, weight_gross_sum=Decimal("40"), weight_tare_sum=Decimal("15"),
+         weight_net_sum=Decimal("25")),
+    dict(date="2022-02-02", pound_id_id=None, vehicle_num=1, weight_gross_sum=None, weight_tare_sum=None,
+         weight_net_sum=None),
+]
+
+
+def test_reduce_groups_rolls_up_measures():
+    by_pound = {row["pound_id_id"]: row for row in reduce_groups(ROWS, ("pound_id_id",))}
+    assert set(by_pound) == {1, 2, None}
+    assert by_pound[1]["vehicle_num"] == 5
+    assert by_pound[1]["weight_gross_sum"] == Decimal("70.5")
+    assert by_pound[1]["weight_net_sum"] == Decimal("45.5")
+    assert "date" not in by_pound[1]
+    # 空值不参与相加, 全为空时保持为空
+    assert by_pound[2]["weight_tare_sum"] is None
+    assert by_pound[None]["weight_gross_sum"] is None
+
+
+def test_reduce_groups_total():
+    total, = reduce_groups(ROWS, ())
+    assert total == dict(vehicle_num=7, weight_gross_sum=Decimal("82.5"), weight_tare_sum=Decimal("25"),
+                         weight_net_sum=Decimal("57.5"))
+    assert reduce_groups([], ()) == []
+
+
+def test_reduce_groups_does_not_modify_rows():
+    before = [dict(row) for row in ROWS]
+    reduce_groups(ROWS, ())
+    assert ROWS == before
+
+
+def test_split_grouping_sets_matches_reduce_groups():
+    grouping_sets = {"by_date": ("date",), "by_pound": ("pound_id_id",), "total": ()}
+    assert union_group_by(grouping_sets) == ("date", "pound_id_id")
+    results = split_grouping_sets(ROWS, grouping_sets)
+    assert set(results) == set(grouping_sets)
+    for name, group_by in grouping_sets.items():
+        assert results[name] == reduce_groups(ROWS, group_by)
+
+
+def test_split_grouping_sets_custom_measures():
+    rows = [dict(info="1期", record_num=1), dict(info="1期", record_num=2), dict(info=None, record_num=4)]
+    results = split_grouping_sets(rows, {"by_info": ("info",)}, ("record_num",))
+    assert results == {"by_info": [dict(info="1期", record_num=3), dict(info=None, record_num=4)]}
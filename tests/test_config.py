@@ -0,0 +1,20 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import os
+
+from settings import TomlConfig
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'settings', 'config.toml')
+
+
+def test_load_development_config():
+    config = TomlConfig(path=CONFIG_PATH, config_type='development')
+    assert config.APP_NAME
+    assert config['CLASSIFICATION']['SANITATION'] == [349]
+    assert config['CLASSIFICATION']['POUND_SANITATION'] == [51]
+    assert config['ADMISSION']['REPORT']['LIMIT'] == 2
+    assert config['MYSQL']['DB']
+
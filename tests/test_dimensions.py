@@ -0,0 +1,84 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("core")
+
+from core.libs.dimensions import rank_weight_records
+from core.libs.weight_rollup import seal_rollup
+
+# 各垃圾来源的净重, None 表示无垃圾来源的记录
+SOURCE_NET_WEIGHTS = [("来源1", 30), ("来源2", 20), ("来源3", 20), ("来源4", 10), ("来源5", 5), (None, 7)]
+
+
+def _amount(value):
+    return Decimal(str(value)).quantize(Decimal("0.01")) if value is not None else None
+
+
+@pytest.fixture
+def rank(run, make):
+    """按垃圾来源排名, sealed 为True时从日汇总表读取"""
+    from core.models import GarbageSource, WeightRecord
+
+    async def seed():
+        for name, net in SOURCE_NET_WEIGHTS:
+            source = await make(GarbageSource, source_name=name) if name is not None else None
+            await make(WeightRecord, garbage_source_id=source, time_weight=datetime(2022, 2, 2, 10),
+                       weight_gross=Decimal(net + 3), weight_tare=Decimal(3), user_id_id="u1")
+
+    run(seed())
+
+    def rank_sources(limit, sealed=False):
+        async def scenario():
+            if sealed:
+                await seal_rollup(date(2022, 2, 5))
+            return await rank_weight_records("source", "weight_net_sum", limit)
+
+        return run(scenario())
+
+    return rank_sources
+
+
+@pytest.mark.parametrize("sealed", [False, True])
+def test_rank_ties_share_rank(rank, sealed):
+    result = rank(4, sealed)
+    ranking = [(row["rank"], row["source"], _amount(row["weight_net_sum"])) for row in result["ranking"]]
+    assert ranking == [(1, "来源1", 30), (2, "来源2", 20), (2, "来源3", 20), (4, "来源4", 10)]
+    assert [row["source_id"] for row in result["ranking"]] == sorted(row["source_id"] for row in result["ranking"])
+    assert result["tie_at_limit"] is False
+
+
+@pytest.mark.parametrize("sealed", [False, True])
+def test_rank_tie_at_limit(rank, sealed):
+    result = rank(2, sealed)
+    assert [row["source"] for row in result["ranking"]] == ["来源1", "来源2"]
+    assert result["tie_at_limit"] is True
+
+
+@pytest.mark.parametrize("sealed", [False, True])
+def test_rank_others_include_unranked_and_unrelated_records(rank, sealed):
+    result = rank(3, sealed)
+    total, others = result["total"], result["others"]
+    assert total["group_num"] == 5
+    assert int(total["vehicle_num"]) == 6
+    assert _amount(total["weight_net_sum"]) == 92
+    # 其它 = 来源4 + 来源5 + 无垃圾来源的记录
+    assert others["group_num"] == 2
+    assert others["vehicle_num"] == 3
+    assert _amount(others["weight_net_sum"]) == 22
+    assert _amount(others["weight_gross_sum"]) == 31
+    assert _amount(others["weight_tare_sum"]) == 9
+
+
+def test_rank_without_records(run):
+    result = run(rank_weight_records("source", "weight_net_sum", 3))
+    assert result["ranking"] == []
+    assert result["others"]["group_num"] == 0
+    assert result["others"]["vehicle_num"] == 0
+    assert result["tie_at_limit"] is False
@@ -0,0 +1,65 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("core")
+
+from core.libs.pagination import NEXT, PREV, decode_cursor, encode_cursor, row_key, seek
+
+
+def test_cursor_round_trip():
+    key = (datetime(2022, 2, 1, 8, 30, 5, 120), 42)
+    assert decode_cursor(encode_cursor(key)) == (key, NEXT, None)
+    assert decode_cursor(encode_cursor(key, PREV, "3:1700000000")) == (key, PREV, "3:1700000000")
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor((datetime(2022, 2, 1), 1), NEXT, "版本?/+")
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+
+@pytest.mark.parametrize("raw", [
+    None,
+    ["2022-02-01 00:00:00", 1, "down"],
+    ["not a time", 1, NEXT],
+    ["2022-02-01 00:00:00", "x", NEXT],
+    ["2022-02-01 00:00:00", 1, NEXT, 5],
+])
+def test_decode_invalid_cursor(raw):
+    cursor = "###" if raw is None else base64.urlsafe_b64encode(json.dumps(raw).encode("utf-8")).decode("ascii")
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_seek_pages_through_ties(run, make):
+    from core.models import WeightRecord
+
+    async def scenario():
+        # 每3条记录称重时间相同, 只靠 id 区分先后
+        for i in range(12):
+            await make(WeightRecord, id_center=i, time_weight=datetime(2022, 2, 1) + timedelta(minutes=i // 3))
+        ordered = await seek(WeightRecord.all()).values_list("time_weight", "id")
+        pages, key = [], None
+        while True:
+            rows = await seek(WeightRecord.all(), key).limit(5).values("time_weight", "id")
+            if not rows:
+                break
+            pages.append([row_key(row) for row in rows])
+            key = row_key(rows[-1])
+        backwards = await seek(WeightRecord.all(), pages[1][0], PREV).values_list("time_weight", "id")
+        return [tuple(row) for row in ordered], pages, [tuple(row) for row in backwards]
+
+    ordered, pages, backwards = run(scenario())
+    assert len(ordered) == 12
+    assert ordered == sorted(ordered)
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert [key for page in pages for key in page] == ordered
+    # 向前翻页为倒序, 不含游标本身
+    assert backwards == ordered[:5][::-1]
@@ -0,0 +1,68 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("core")
+pytest.importorskip("numpy")
+
+from core.libs.weight_cube import weight_cube
+from core.libs.weight_rollup import aggregate_weight_records
+
+# (过滤条件, 开始时间, 结束时间, 分组字段, 日期格式, 是否包含结束时间)
+CASES = [
+    ({}, None, None, (), "%Y-%m-%d", True),
+    ({}, datetime(2022, 2, 1), datetime(2022, 2, 11), ("date",), "%Y-%m-%d", True),
+    ({"pound_id": 1}, datetime(2022, 2, 3, 5), datetime(2022, 2, 9, 13), ("date", "garbage_source_id__source_name"),
+     "%Y-%m-%d", True),
+    ({"vehicle_id__dept_id_id__not": 51}, datetime(2022, 2, 1), datetime(2022, 3, 1), ("date", "vehicle_id__dept_id_id"),
+     "%d", False),
+    ({"garbage_source_id__region_id": 2, "info": "1期"}, datetime(2022, 2, 2), datetime(2022, 2, 10), (
+        "garbage_source_id__region_id__region_name", "vehicle_id__dept_id__department_name"), "%Y-%m-%d", True),
+    ({"garbage_source_id_id__isnull": True}, None, None, ("date", "pound_id__comp_name"), "%Y-%m-%d %H", True),
+    ({"garbage_type_id_id__in": [1], "driver_id_id__not_in": [2]}, None, None, ("info",), "%Y-%m-%d", True),
+    ({"pound_id": 99}, None, None, (), "%Y-%m-%d", True),
+]
+
+
+def _normalize(rows, group_by):
+    def amount(value):
+        return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+    return sorted(
+        (tuple(str(row[g]) for g in group_by), int(row["vehicle_num"]),
+         amount(row["weight_gross_sum"]), amount(row["weight_tare_sum"]), amount(row["weight_net_sum"]))
+        for row in rows
+    )
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_cube_matches_sql(run, seed_records, case):
+    filters, start_time, end_time, group_by, date_format, end_inclusive = case
+
+    async def scenario():
+        await seed_records(600, days=10)
+        expected = await aggregate_weight_records(dict(filters), start_time, end_time, group_by, date_format,
+                                                  end_inclusive)
+        await weight_cube.load(0)
+        actual = await weight_cube.aggregate(dict(filters), start_time, end_time, group_by, date_format, end_inclusive)
+        return expected, actual
+
+    expected, actual = run(scenario())
+    assert actual is not None
+    assert _normalize(actual, group_by) == _normalize(expected, group_by)
+
+
+def test_cube_declines_when_stale(run, seed_records):
+    async def scenario():
+        await seed_records(50, days=2)
+        await weight_cube.load(0)
+        weight_cube.mark_stale()
+        return await weight_cube.aggregate({})
+
+    assert run(scenario()) is None
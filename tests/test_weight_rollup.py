@@ -0,0 +1,191 @@
+"""
+Author: rensongqi(）
+Email: rensongqi1024@gmail.com
+"""
+# coding: utf-8
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("core")
+
+from tortoise.transactions import in_transaction
+
+from core.libs import weight_rollup
+from core.libs.weight_rollup import (
+    HOURLY_BUCKET_KEYS, RollupState, aggregate_weight_records, apply_rollup_deltas, build_rollup_day,
+    rebuild_stale_rollup, reconcile_rollup, remap_rollup, rollup_buckets, rollup_covers, seal_rollup,
+)
+
+SEALED_UNTIL = date(2022, 2, 7)
+# (过滤条件, 开始时间, 结束时间, 分组字段, 日期格式, 是否包含结束时间)
+CASES = [
+    ({}, None, None, (), "%Y-%m-%d", True),
+    ({}, datetime(2022, 2, 1), datetime(2022, 2, 11), ("date",), "%Y-%m-%d", True),
+    # 首尾非整日的部分读取称重记录表
+    ({"pound_id": 1}, datetime(2022, 2, 2, 5, 30), datetime(2022, 2, 9, 13), ("date", "garbage_source_id__source_name"),
+     "%Y-%m-%d", True),
+    ({"vehicle_id__dept_id_id__not": 51}, datetime(2022, 2, 1), datetime(2022, 3, 1), ("vehicle_id__dept_id_id",),
+     "%Y-%m-%d", False),
+    ({"garbage_source_id__region_id": 2, "info": "1期"}, datetime(2022, 2, 3, 12), datetime(2022, 2, 6, 12),
+     ("garbage_source_id__region_id__region_name", "vehicle_id__dept_id__department_name"), "%Y-%m-%d", True),
+    ({"info__isnull": True}, datetime(2022, 2, 1), datetime(2022, 2, 5), ("date",), "%Y-%m", True),
+]
+
+
+def _normalize(rows, group_by):
+    def amount(value):
+        return Decimal(str(value or 0)).quantize(Decimal("0.01"))
+
+    return sorted(
+        (tuple(str(row[g]) for g in group_by), int(row["vehicle_num"]),
+         amount(row["weight_gross_sum"]), amount(row["weight_tare_sum"]), amount(row["weight_net_sum"]))
+        for row in rows
+    )
+
+
+async def _snapshot(model):
+    rows = await model.all().values()
+    return sorted(
+        tuple(str(v) if k not in ("id", "weight_gross", "weight_tare") else Decimal(str(v)).quantize(Decimal("0.01"))
+              for k, v in sorted(row.items()) if k != "id")
+        for row in rows
+    )
+
+
+async def _rebuilt_snapshots(days):
+    """当前汇总表与整日重建后的汇总表"""
+    current = (await _snapshot(weight_rollup.WeightRecordDaily), await _snapshot(weight_rollup.WeightRecordHourly))
+    for day in days:
+        await build_rollup_day(day)
+    rebuilt = (await _snapshot(weight_rollup.WeightRecordDaily), await _snapshot(weight_rollup.WeightRecordHourly))
+    return current, rebuilt
+
+
+def _days(until):
+    return [date(2022, 2, 1) + timedelta(days=i) for i in range((until - date(2022, 2, 1)).days + 1)]
+
+
+def test_rollup_matches_raw_records(run, seed_records):
+    async def scenario():
+        await seed_records(600, days=10)
+        raw = [await aggregate_weight_records(dict(f), s, e, g, fmt, inc) for f, s, e, g, fmt, inc in CASES]
+        await seal_rollup(SEALED_UNTIL)
+        covered = [rollup_covers(dict(f), s, e, g, fmt) for f, s, e, g, fmt, inc in CASES]
+        rolled = [await aggregate_weight_records(dict(f), s, e, g, fmt, inc) for f, s, e, g, fmt, inc in CASES]
+        return raw, covered, rolled
+
+    raw, covered, rolled = run(scenario())
+    assert all(covered)
+    for case, raw_rows, rolled_rows in zip(CASES, raw, rolled):
+        assert raw_rows
+        assert _normalize(rolled_rows, case[3]) == _normalize(raw_rows, case[3])
+
+
+def test_rollup_deltas_follow_writes(run, seed_records):
+    from core.models import WeightRecord
+
+    async def write(old_filters=None, new_record=None, delete=False):
+        """同管理端写入接口: 同一事务中写入称重记录并累加日汇总增量"""
+        async with in_transaction("default"):
+            if old_filters is None:
+                record = await WeightRecord.create(**new_record)
+                before, after = [], await rollup_buckets(WeightRecord.filter(id=record.id))
+            else:
+                before = await rollup_buckets(WeightRecord.filter(**old_filters))
+                ids = [row["id"] for row in before]
+                if delete:
+                    await WeightRecord.filter(id__in=ids).delete()
+                    after = []
+                else:
+                    await WeightRecord.filter(id__in=ids).update(**new_record)
+                    after = await rollup_buckets(WeightRecord.filter(id__in=ids))
+            pending = await apply_rollup_deltas(before, after)
+        await reconcile_rollup(pending)
+        return pending
+
+    async def scenario():
+        await seed_records(300, days=10)
+        await seal_rollup(SEALED_UNTIL)
+        pending = [
+            # 新增到已汇总日期, 新增到未汇总日期
+            await write(new_record=dict(id_center=1001, time_weight=datetime(2022, 2, 3, 10), weight_gross=Decimal(20),
+                                        weight_tare=Decimal(8), pound_id_id=1, operator_id=0, data_mark=0,
+                                        user_id_id="u1")),
+            await write(new_record=dict(id_center=1002, time_weight=datetime(2022, 2, 9, 10), weight_gross=Decimal(20),
+                                        weight_tare=Decimal(8), pound_id_id=1, operator_id=0, data_mark=0,
+                                        user_id_id="u1")),
+            # 修改分组字段与称重日期, 记录在分组间移动
+            await write({"pound_id_id": 2, "time_weight__lt": datetime(2022, 2, 2)}, dict(pound_id_id=1, info="3期")),
+            await write({"id_center__in": [5, 6, 7]}, dict(time_weight=datetime(2022, 2, 5, 23, 59))),
+            await write({"garbage_source_id_id": 1, "time_weight__lt": datetime(2022, 2, 4)}, dict(weight_tare=None)),
+            # 删除整个分组
+            await write({"garbage_source_id_id": 3}, delete=True),
+        ]
+        return pending, await _rebuilt_snapshots(_days(SEALED_UNTIL))
+
+    pending, (current, rebuilt) = run(scenario())
+    assert pending[0] == set()
+    assert pending[1] == {date(2022, 2, 9)}
+    assert current == rebuilt
+
+
+def test_apply_deltas_deletes_bucket_only_when_total_is_zero(run):
+    from core.models import WeightRecordHourly
+
+    def record(gross):
+        return dict(day=date(2022, 2, 1), hour=8, pound_id_id=None, weight_gross=Decimal(gross), weight_tare=Decimal(0))
+
+    async def totals():
+        rows = await WeightRecordHourly.all().values("record_num", "weight_gross")
+        return len(rows), sum(row["record_num"] for row in rows), sum(Decimal(str(row["weight_gross"])) for row in rows)
+
+    async def scenario():
+        # 分组键含空值时唯一约束不生效, 同一分组可有多行
+        await WeightRecordHourly.create(day=date(2022, 2, 1), hour=8, record_num=1, weight_gross=10, weight_tare=0)
+        await WeightRecordHourly.create(day=date(2022, 2, 1), hour=8, record_num=3, weight_gross=30, weight_tare=0)
+        # 增量只累加到其中一行, 该行车数为负时分组合计仍不为0
+        await weight_rollup._apply_deltas(WeightRecordHourly, HOURLY_BUCKET_KEYS, [record(10)] * 2, [])
+        partial = await totals()
+        await weight_rollup._apply_deltas(WeightRecordHourly, HOURLY_BUCKET_KEYS, [record(10)] * 2, [])
+        emptied = await totals()
+        await weight_rollup._apply_deltas(WeightRecordHourly, HOURLY_BUCKET_KEYS, [], [record(5), record(7)])
+        await weight_rollup._apply_deltas(WeightRecordHourly, HOURLY_BUCKET_KEYS, [], [record(1)])
+        return partial, emptied, await totals()
+
+    partial, emptied, added = run(scenario())
+    assert partial == (2, 2, Decimal(20))
+    assert emptied == (0, 0, 0)
+    assert added == (1, 3, Decimal(13))
+
+
+def test_remap_rollup_rebuilds_in_background(run, seed_records):
+    from core.models import Vehicle, WeightRecord
+
+    group_by = ("vehicle_id__dept_id_id",)
+    start, end = datetime(2022, 2, 1), datetime(2022, 2, 11)
+
+    async def scenario():
+        await seed_records(300, days=10)
+        await seal_rollup(SEALED_UNTIL)
+        vehicle_id = await Vehicle.filter(vehicle_no="车0").first().values_list("id", flat=True)
+        await Vehicle.filter(id=vehicle_id).update(dept_id_id=52)
+        days = await remap_rollup(WeightRecord.filter(vehicle_id_id=vehicle_id))
+        stale = set(RollupState.stale)
+        RollupState.sealed_until, sealed_until = None, RollupState.sealed_until
+        raw = await aggregate_weight_records({}, start, end, group_by)
+        RollupState.sealed_until = sealed_until
+        # 重建前等待重建的日期读取称重记录表
+        before = await aggregate_weight_records({}, start, end, group_by)
+        rebuilt_days = await rebuild_stale_rollup()
+        after = await aggregate_weight_records({}, start, end, group_by)
+        return days, stale, rebuilt_days, raw, before, after, await _rebuilt_snapshots(_days(SEALED_UNTIL))
+
+    days, stale, rebuilt_days, raw, before, after, (current, rebuilt) = run(scenario())
+    assert days and max(days) <= SEALED_UNTIL
+    assert stale == days == rebuilt_days
+    assert not RollupState.stale
+    assert _normalize(before, group_by) == _normalize(raw, group_by)
+    assert _normalize(after, group_by) == _normalize(raw, group_by)
+    assert current == rebuilt